@@ -3,26 +3,28 @@ Flask Web 應用 - 使用 pytubefix 下載 YouTube 影片/音訊
 優化版本：添加速率限制、改善錯誤處理、效能監控
 支援 yt-dlp 作為後備下載引擎
 """
-from flask import Flask, render_template, request, jsonify, send_file, g
+from flask import (
+    Blueprint, Flask, render_template, request, jsonify, g, Response, stream_with_context,
+    current_app, has_app_context
+)
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from pytubefix import YouTube
 import os
 import threading
 import uuid
 from datetime import datetime, timedelta
 import json
+import asyncio
 import subprocess
+import time
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as futures_wait
 
-# 嘗試導入 yt-dlp 作為後備方案
-try:
-    import yt_dlp
-    YTDLP_AVAILABLE = True
-    print('✅ yt-dlp 可用作為後備下載引擎')
-except ImportError:
-    YTDLP_AVAILABLE = False
-    print('⚠️ yt-dlp 不可用，僅使用 pytubefix')
+# 下載引擎在第一次使用時才導入；yt-dlp 作為後備方案 (只檢查是否已安裝，不導入)
+from engines import registry as engine_registry
+YTDLP_AVAILABLE = engine_registry.available('yt-dlp')
 
 # 獲取 cookies 檔案路徑
 def get_cookies_path():
@@ -66,13 +68,43 @@ def get_cookies_path():
     print('⚠️ 未找到 cookies 檔案，yt-dlp 可能會遭遇 bot 檢測')
     return None
 
-# 初始化 cookies 路徑
-COOKIES_PATH = get_cookies_path()
+# cookies 路徑 (由 init_process() 載入，導入模組時不寫入檔案)
+COOKIES_PATH = None
 import logging
 from logging.handlers import RotatingFileHandler
-from threading import Semaphore
-import psutil
 from functools import wraps
+from result_cache import ResultCache, make_cache_key
+from metadata_cache import MetadataCache
+from strategy_selector import default_selector as strategy_selector
+from transcode import (
+    encode_stream_to_mp3,
+    encode_file_to_mp3_segmented,
+    set_segment_budget,
+    convert_audio,
+    convert_audio_async,
+    encode_to_mp3_async,
+    mp3_command,
+    mux_streams,
+    mux_streams_async,
+    normalize_audio_codec,
+    resolve_audio_format,
+    AUDIO_FORMATS,
+    AUDIO_OUTPUT_FORMATS,
+    CONTAINER_DEMUXERS,
+    TranscodeError
+)
+from ranged_downloader import RangedDownloader, RangedDownloadError, RANGE_STYLE_QUERY, discard_partial
+from task_store import create_task_store, TaskStoreFullError
+from job_queue import JobQueue
+from bounded_executor import AsyncBoundedExecutor, BoundedExecutor, QueueFullError
+from batch_scheduler import BatchScheduler
+from file_eviction import EvictionManager
+from progress_notifier import ProgressNotifier
+from zip_stream import iter_zip, unique_names
+from file_delivery import send_download, DELIVERY_MODES, DELIVERY_APP
+from leader_lock import LeaderLock
+from ytdlp_service import YtdlpService
+from werkzeug.local import LocalProxy
 
 # 導入配置和工具函數
 try:
@@ -80,6 +112,7 @@ try:
     from utils import (
         validate_youtube_url,
         clean_youtube_url,
+        extract_video_id,
         validate_bitrate,
         check_ffmpeg_available,
         validate_file_path,
@@ -103,6 +136,9 @@ except ImportError:
     def clean_youtube_url(url):
         return url
     
+    def extract_video_id(url):
+        return None
+    
     def validate_bitrate(bitrate):
         return bitrate
     
@@ -124,68 +160,146 @@ except ImportError:
         total, used, free = shutil.disk_usage(path)
         return (total // (1024*1024), used // (1024*1024), free // (1024*1024))
 
-app = Flask(__name__)
-config = get_config()
-
-# 設定 Flask 配置
-app.config['MAX_CONTENT_LENGTH'] = config.MAX_FILE_SIZE
+# 應用程式的服務存放在 app.extensions 中的名稱
+EXTENSION_NAME = 'ymp3'
 
-CORS(app)
+# 路由與請求處理 (由 create_app() 註冊到應用程式)
+bp = Blueprint('main', __name__)
 
-# 設定速率限制
+# 設定速率限制 (由 create_app() 綁定到應用程式)
 limiter = Limiter(
-    app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
     storage_uri="memory://"
 )
 
-# 設定下載資料夾 (使用絕對路徑)
-DOWNLOAD_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), 'downloads'))
-print(f'📁 下載目錄: {DOWNLOAD_FOLDER}')
+# 此行程最近建立的應用程式 (應用程式情境之外的呼叫使用，如 worker.py 與 asgi.py)
+_default_app = None
+
+
+def current_application():
+    """
+    目前的應用程式：應用程式情境中為 current_app，否則為此行程最近建立的應用程式
+    
+    Raises:
+        RuntimeError: 尚未呼叫 create_app()
+    """
+    if has_app_context():
+        return current_app._get_current_object()
+    if _default_app is None:
+        raise RuntimeError('尚未建立應用程式，請先呼叫 create_app()')
+    return _default_app
+
+
+def get_services():
+    """目前應用程式的設定與服務 (AppServices)"""
+    return current_application().extensions[EXTENSION_NAME]
+
+
+def with_app_context(func, app=None):
+    """
+    包裝 func，使其在 app (預設為目前的應用程式) 的情境中執行
+    
+    提交到執行緒池、事件迴圈或背景執行緒的工作使用，讓工作存取所屬應用程式的服務
+    """
+    app = app or current_application()
+    
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def run_async(*args, **kwargs):
+            with app.app_context():
+                return await func(*args, **kwargs)
+        return run_async
+    
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return run
+
+
+def _service(name):
+    """指向目前應用程式的服務 name 的代理"""
+    return LocalProxy(lambda: getattr(get_services(), name))
+
+
+# 模組層級的名稱指向目前應用程式的設定與服務 (各應用程式由 create_app() 各自建立)
+config = _service('config')
+download_tasks = _service('download_tasks')
+download_executor = _service('download_executor')
+transcode_executor = _service('transcode_executor')
+file_evictor = _service('file_evictor')
+result_cache = _service('result_cache')
+info_cache = _service('info_cache')
+info_hedge_executor = _service('info_hedge_executor')
+ytdlp_service = _service('ytdlp_service')
+batch_scheduler = _service('batch_scheduler')
+cleaner_lock = _service('cleaner_lock')
+progress_notifier = _service('progress_notifier')
+logger = LocalProxy(lambda: current_application().logger)
 
-if not os.path.exists(DOWNLOAD_FOLDER):
-    os.makedirs(DOWNLOAD_FOLDER)
-    print(f'✅ 創建下載目錄: {DOWNLOAD_FOLDER}')
-else:
-    print(f'✅ 下載目錄已存在: {DOWNLOAD_FOLDER}')
 
 # 設定日誌
-def setup_logging(app):
+def setup_logging(app, config):
     """設定應用日誌"""
     if not app.debug:
+        log_file = config.LOG_FILE if hasattr(config, 'LOG_FILE') else 'logs/app.log'
+        
         # 確保日誌目錄存在
-        log_dir = os.path.dirname(config.LOG_FILE) if hasattr(config, 'LOG_FILE') else 'logs'
+        log_dir = os.path.dirname(log_file)
         if log_dir and not os.path.exists(log_dir):
             os.makedirs(log_dir)
         
-        # 檔案日誌處理器
-        file_handler = RotatingFileHandler(
-            config.LOG_FILE if hasattr(config, 'LOG_FILE') else 'logs/app.log',
-            maxBytes=10240000,  # 10MB
-            backupCount=10
-        )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+        # 同一行程中的應用程式共用日誌器，每個日誌檔只加入一個處理器
+        log_path = os.path.abspath(log_file)
+        if not any(getattr(handler, 'baseFilename', None) == log_path for handler in app.logger.handlers):
+            # 檔案日誌處理器
+            file_handler = RotatingFileHandler(
+                log_file,
+                maxBytes=10240000,  # 10MB
+                backupCount=10
+            )
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+            ))
+            file_handler.setLevel(logging.INFO)
+            app.logger.addHandler(file_handler)
     
     app.logger.setLevel(logging.INFO)
     app.logger.info('YouTube 下載工具啟動')
 
-# 設定日誌
-try:
-    setup_logging(app)
-except Exception as e:
-    print(f'日誌設定失敗: {e}')
+# 跟隨任務不鏡像的欄位
+MIRROR_EXCLUDED_FIELDS = {'id', 'request_id', 'created_at', 'follows', 'followers', 'batch_id', 'awaiting_dispatch'}
 
-# 儲存下載任務狀態
-download_tasks = {}
+# 批次記錄與任務存放在同一個儲存中 (跨 gunicorn worker 共用)，以此狀態區分
+BATCH_STATUS = 'batch'
 
-# 並發下載限制
-download_semaphore = Semaphore(config.MAX_CONCURRENT_DOWNLOADS)
 
+def load_completed_result(cache_key):
+    """從任務儲存查詢其他行程 (gunicorn worker 或 worker.py) 已完成的相同請求"""
+    task = download_tasks.find_completed(cache_key)
+    if not task or not task.get('file_path') or 'file_size' not in task:
+        return None
+    return {
+        'file_path': task['file_path'],
+        'filename': task.get('filename'),
+        'size': task['file_size'],
+        'mtime': task['file_mtime'],
+        'title': task.get('title'),
+        'author': task.get('author'),
+        'length': task.get('length')
+    }
+
+
+def ytdlp_defaults(download_folder):
+    """所有 yt-dlp 設定檔共用的選項 (輸出路徑與 cookies)"""
+    options = {
+        'outtmpl': os.path.join(download_folder, '%(title)s.%(ext)s'),
+        'noprogress': True  # 輔助行程與 web worker 共用日誌輸出
+    }
+    if COOKIES_PATH:
+        options['cookiefile'] = COOKIES_PATH
+    return options
 # 統一錯誤回應格式
 def error_response(message, code='ERROR', status_code=400, details=None):
     """
@@ -212,6 +326,52 @@ def error_response(message, code='ERROR', status_code=400, details=None):
     return jsonify(response), status_code
 
 
+def busy_response(task_id):
+    """
+    下載佇列已滿的回應 (503 + Retry-After)
+    
+    Args:
+        task_id: 已建立但無法排入的任務 ID (標記為錯誤，連同合併到此任務的請求)
+    """
+    update_task(task_id, status='error', message='伺服器忙碌中，請稍後再試')
+    body, status_code = error_response(
+        '伺服器忙碌中，請稍後再試',
+        code='QUEUE_FULL',
+        status_code=503,
+        details={'retry_after': config.DOWNLOAD_RETRY_AFTER}
+    )
+    return body, status_code, {'Retry-After': str(config.DOWNLOAD_RETRY_AFTER)}
+
+
+def get_queue_position(task):
+    """
+    查詢等待中任務的排隊位置 (1 為下一個)
+    
+    Returns:
+        int | None: 位置；任務已開始、或不在此行程的執行器中時返回 None
+    """
+    if task['status'] != 'pending':
+        return None
+    
+    # 合併的請求跟隨主任務的位置
+    leader = download_tasks.get(task['follows']) if task.get('follows') else task
+    if leader is None:
+        return None
+    
+    download_queue = get_services().download_queue
+    if download_queue is not None:
+        return download_queue.position(leader['job_id']) if leader.get('job_id') else None
+    return download_executor.position(leader['id'])
+
+
+def load_progress(task_id):
+    """讀取任務與排隊位置 (進度查詢與進度通知使用)，任務不存在時返回 None"""
+    task = download_tasks.get(task_id)
+    if task is not None:
+        task['queue_position'] = get_queue_position(task)
+    return task
+
+
 def success_response(data=None, message=None):
     """
     統一的成功回應格式
@@ -235,32 +395,56 @@ def success_response(data=None, message=None):
 
 
 # 請求ID中介層
-@app.before_request
+@bp.before_app_request
 def before_request():
     """為每個請求生成唯一ID"""
+    start_services()
     g.request_id = str(uuid.uuid4())
     g.start_time = datetime.now()
 
 
-@app.after_request
+@bp.after_app_request
 def after_request(response):
     """記錄請求資訊"""
     if hasattr(g, 'start_time'):
         duration = (datetime.now() - g.start_time).total_seconds()
-        app.logger.info(
+        logger.info(
             f'[{g.request_id}] {request.method} {request.path} '
             f'- {response.status_code} - {duration:.3f}s'
         )
     return response
 
 
-def convert_to_mp3(input_file, bitrate='192k'):
+# FFmpeg 檢查結果 (每個行程只執行一次 ffmpeg -version)
+_ffmpeg_probe = None
+
+
+def ffmpeg_available():
+    """FFmpeg 是否可用 (快取第一次檢查的結果)"""
+    global _ffmpeg_probe
+    if _ffmpeg_probe is None:
+        _ffmpeg_probe = check_ffmpeg_available()
+    return _ffmpeg_probe
+
+
+def use_segmented_transcode(duration):
+    """長度超過 TRANSCODE_SEGMENT_MIN_DURATION 且有多個 CPU 時使用分段並行轉換"""
+    return (
+        config.TRANSCODE_SEGMENTED_ENABLED
+        and bool(duration)
+        and duration >= config.TRANSCODE_SEGMENT_MIN_DURATION
+        and (config.TRANSCODE_SEGMENT_WORKERS or os.cpu_count() or 1) > 1
+    )
+
+
+def convert_to_mp3(input_file, bitrate='192k', duration=None):
     """
     使用 FFmpeg 將音訊轉換為 MP3
     
     Args:
         input_file: 輸入音訊檔案
         bitrate: MP3 位元率
+        duration: 音訊長度 (秒)，長音訊會切段並行轉換
     
     Returns:
         str: MP3 檔案路徑
@@ -273,33 +457,40 @@ def convert_to_mp3(input_file, bitrate='192k'):
     
     # 驗證檔案存在
     if not os.path.exists(input_file):
-        app.logger.error(f'輸入檔案不存在: {input_file}')
+        logger.error(f'輸入檔案不存在: {input_file}')
         return input_file
     
     # 驗證檔案路徑安全性
-    if not validate_file_path(input_file, DOWNLOAD_FOLDER):
-        app.logger.error(f'檔案路徑不安全: {input_file}')
+    if not validate_file_path(input_file, config.DOWNLOAD_FOLDER):
+        logger.error(f'檔案路徑不安全: {input_file}')
         return input_file
     
     output_file = os.path.splitext(input_file)[0] + '.mp3'
     
-    app.logger.info(f'開始轉換為 MP3: {os.path.basename(input_file)}')
+    logger.info(f'開始轉換為 MP3: {os.path.basename(input_file)}')
     
     # 檢查 FFmpeg 是否可用
-    if not check_ffmpeg_available():
-        app.logger.error('FFmpeg 未正確安裝')
+    if not ffmpeg_available():
+        logger.error('FFmpeg 未正確安裝')
         return input_file
     
-    cmd = [
-        'ffmpeg',
-        '-i', input_file,
-        '-vn',
-        '-ar', '44100',
-        '-ac', '2',
-        '-b:a', bitrate,
-        '-y',
-        output_file
-    ]
+    if use_segmented_transcode(duration):
+        try:
+            encode_file_to_mp3_segmented(
+                input_file,
+                output_file,
+                duration,
+                bitrate=bitrate,
+                workers=config.TRANSCODE_SEGMENT_WORKERS or None,
+                timeout=config.FFMPEG_TIMEOUT
+            )
+            os.remove(input_file)
+            logger.info(f'MP3 分段轉換完成: {os.path.basename(output_file)} ({format_file_size(os.path.getsize(output_file))})')
+            return output_file
+        except TranscodeError as e:
+            logger.warning(f'分段轉換失敗，改用單一行程轉換: {e}')
+    
+    cmd = mp3_command(input_file, output_file, bitrate)
     
     try:
         result = subprocess.run(
@@ -317,552 +508,1747 @@ def convert_to_mp3(input_file, bitrate='192k'):
             # 刪除原始檔案
             os.remove(input_file)
             
-            app.logger.info(f'MP3 轉換完成: {os.path.basename(output_file)} ({format_file_size(output_size)})')
+            logger.info(f'MP3 轉換完成: {os.path.basename(output_file)} ({format_file_size(output_size)})')
             
             return output_file
         else:
             raise Exception('MP3 檔案未產生')
             
     except subprocess.TimeoutExpired:
-        app.logger.error('MP3 轉換超時')
+        logger.error('MP3 轉換超時')
         return input_file
     except subprocess.CalledProcessError as e:
-        app.logger.error(f'MP3 轉換失敗: {e}')
+        logger.error(f'MP3 轉換失敗: {e}')
         return input_file
     except Exception as e:
-        app.logger.error(f'MP3 轉換失敗: {e}', exc_info=True)
+        logger.error(f'MP3 轉換失敗: {e}', exc_info=True)
         return input_file
 
 
-def progress_callback(stream, chunk, bytes_remaining):
-    """下載進度回調"""
-    task_id = getattr(stream, '_task_id', None)
-    if task_id and task_id in download_tasks:
-        total_size = stream.filesize
-        bytes_downloaded = total_size - bytes_remaining
-        percentage = (bytes_downloaded / total_size) * 100
-        
-        download_tasks[task_id]['progress'] = round(percentage, 1)
-        download_tasks[task_id]['downloaded'] = bytes_downloaded
-        download_tasks[task_id]['total'] = total_size
+def convert_to_format(input_file, output_format, bitrate='192k', source_codec=None, input_format=None):
+    """
+    將音訊轉為 m4a / opus，來源編碼相符時只重新封裝不重新編碼
+    
+    Args:
+        input_file: 輸入音訊檔案
+        output_format: 'm4a' 或 'opus'
+        bitrate: 需要重新編碼時的位元率
+        source_codec: 來源音訊編碼 (如 'aac'、'opus')
+        input_format: 來源容器的 FFmpeg demuxer，已知時 FFmpeg 不需偵測格式
+    
+    Returns:
+        str: 輸出檔案路徑 (失敗時返回原始檔案)
+    """
+    if not os.path.exists(input_file):
+        logger.error(f'輸入檔案不存在: {input_file}')
+        return input_file
+    
+    if not validate_file_path(input_file, config.DOWNLOAD_FOLDER):
+        logger.error(f'檔案路徑不安全: {input_file}')
+        return input_file
+    
+    if not ffmpeg_available():
+        logger.error('FFmpeg 未正確安裝')
+        return input_file
+    
+    # 輸出與輸入同名 (如 .m4a 來源) 時，convert_audio 先寫入 .part 再取代原檔
+    output_file = os.path.splitext(input_file)[0] + '.' + output_format
+    
+    try:
+        output_file, copied = convert_audio(
+            input_file,
+            output_file,
+            output_format,
+            source_codec=source_codec,
+            input_format=input_format,
+            bitrate=bitrate,
+            timeout=config.FFMPEG_TIMEOUT
+        )
+    except TranscodeError as e:
+        logger.error(f'{output_format} 轉換失敗: {e}')
+        return input_file
+    
+    if output_file != input_file:
+        os.remove(input_file)
+    logger.info(
+        f'{output_format} {"重新封裝" if copied else "轉換"}完成: '
+        f'{os.path.basename(output_file)} ({format_file_size(os.path.getsize(output_file))})'
+    )
+    return output_file
 
 
-def complete_callback(stream, file_path):
-    """下載完成回調"""
-    task_id = getattr(stream, '_task_id', None)
-    if task_id and task_id in download_tasks:
-        download_tasks[task_id]['file_path'] = file_path
-        print(f'✅ 下載完成: {os.path.basename(file_path)}')
+def can_stream_copy(output_format, source_codec):
+    """來源編碼可直接放入輸出容器 (不需重新編碼)"""
+    spec = AUDIO_FORMATS.get(output_format)
+    return spec is not None and spec['codec'] == source_codec
 
 
-def download_video_thread(task_id, url, download_type, quality):
-    """背景執行緒下載影片"""
-    # 使用 Semaphore 限制並發下載
-    with download_semaphore:
-        # 嘗試多個策略以避免 403 錯誤
-        # 策略 1: WEB 客戶端 + 自動 PoToken (需要 Node.js)
-        # 策略 2: IOS 客戶端 (不需要 PoToken)
-        # 策略 3: ANDROID 客戶端 (不需要 PoToken)
-        strategies = [
-            {'name': 'WEB + PoToken', 'client': 'WEB', 'use_po_token': True},
-            {'name': 'IOS', 'client': 'IOS', 'use_po_token': False},
-            {'name': 'ANDROID', 'client': 'ANDROID', 'use_po_token': False},
-        ]
-        last_error = None
-        
-        for strategy in strategies:
-            try:
-                download_tasks[task_id]['status'] = 'downloading'
-                download_tasks[task_id]['message'] = f'正在使用 {strategy["name"]} 策略下載...'
-                
-                app.logger.info(f'嘗試策略: {strategy["name"]} (task_id={task_id})')
-                
-                # 建立 YouTube 物件
-                if strategy['use_po_token']:
-                    # WEB 客戶端使用自動 PoToken 生成 (需要 Node.js)
-                    yt = YouTube(
-                        url,
-                        'WEB',  # 使用位置參數啟用自動 PoToken
-                        on_progress_callback=progress_callback,
-                        on_complete_callback=complete_callback
-                    )
-                else:
-                    # IOS/ANDROID 客戶端
-                    yt = YouTube(
-                        url,
-                        client=strategy['client'],
-                        on_progress_callback=progress_callback,
-                        on_complete_callback=complete_callback
-                    )
-                
-                # 儲存 task_id 到 stream 物件
-                if download_type == 'video':
-                    # 影片模式
-                    if quality == 'best':
-                        stream = yt.streams.filter(progressive=True).order_by('resolution').desc().first()
-                    else:
-                        # 特定解析度
-                        stream = yt.streams.filter(progressive=True, res=quality).first()
-                        if not stream:
-                            # 如果找不到指定解析度,使用最高畫質
-                            stream = yt.streams.filter(progressive=True).order_by('resolution').desc().first()
-                else:
-                    # 音訊模式 - 獲取最高品質音訊
-                    stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-                
-                if not stream:
-                    raise Exception('找不到可用的串流')
-                
-                # 設定 task_id
-                stream._task_id = task_id
-                
-                # 儲存影片資訊
-                download_tasks[task_id]['title'] = yt.title
-                download_tasks[task_id]['author'] = yt.author
-                download_tasks[task_id]['length'] = yt.length
-                
-                # 下載
-                file_path = stream.download(output_path=DOWNLOAD_FOLDER)
-                app.logger.info(f'下載完成: {os.path.basename(file_path)} ({format_file_size(os.path.getsize(file_path))})')
-                
-                # 如果是音訊,轉換為 MP3
-                if download_type == 'audio':
-                    app.logger.info('音訊模式 - 開始轉換為 MP3')
-                    download_tasks[task_id]['status'] = 'converting'
-                    download_tasks[task_id]['message'] = '正在轉換為 MP3...'
-                    download_tasks[task_id]['progress'] = 95
-                    
-                    original_file = file_path
-                    file_path = convert_to_mp3(file_path)
-                    
-                    # 檢查是否成功轉換
-                    if file_path.endswith('.mp3'):
-                        app.logger.info('MP3 轉換成功')
-                    else:
-                        app.logger.warning(f'轉換失敗，返回原始檔案 {os.path.splitext(file_path)[1]}')
-                        download_tasks[task_id]['message'] = f'下載完成 (轉換失敗，格式: {os.path.splitext(file_path)[1]})'
-                
-                # 下載完成
-                download_tasks[task_id]['status'] = 'completed'
-                download_tasks[task_id]['message'] = '下載完成'
-                download_tasks[task_id]['file_path'] = os.path.abspath(file_path)  # 使用絕對路徑
-                download_tasks[task_id]['filename'] = os.path.basename(file_path)
-                download_tasks[task_id]['progress'] = 100
-                
-                app.logger.info(f'任務完成: {download_tasks[task_id]["filename"]}')
-                return  # 成功，退出函數
-                
-            except Exception as e:
-                last_error = e
-                app.logger.warning(f'{strategy["name"]} 策略失敗: {e}')
-                continue
+def select_audio_stream(yt, audio_format):
+    """
+    選擇音訊串流
+    
+    m4a 優先選擇 AAC (mp4) 串流、opus 優先選擇 Opus (webm) 串流，讓輸出可直接重新封裝；
+    其餘情況選擇位元率最高的串流
+    """
+    audio_streams = yt.streams.filter(only_audio=True)
+    preferred_subtype = {'m4a': 'mp4', 'opus': 'webm'}.get(audio_format)
+    if preferred_subtype:
+        stream = audio_streams.filter(subtype=preferred_subtype).order_by('abr').desc().first()
+        if stream:
+            return stream
+    return audio_streams.order_by('abr').desc().first()
+
+
+def update_task(task_id, **fields):
+    """
+    更新任務狀態，並同步到所有跟隨此任務的合併請求
+    
+    Args:
+        task_id: 任務 ID
+        **fields: 要更新的欄位
+    """
+    with download_tasks.transaction():
+        task = download_tasks.update(task_id, fields)
+        if task is not None and task.get('followers'):
+            mirrored = {k: v for k, v in fields.items() if k not in MIRROR_EXCLUDED_FIELDS}
+            for follower_id in task['followers']:
+                download_tasks.update(follower_id, mirrored)
+    
+    # 立即推送給此行程中觀看進度的串流
+    progress_notifier.notify(task_id)
+    for follower_id in (task or {}).get('followers', []):
+        progress_notifier.notify(follower_id)
+    
+    # 新產生的檔案計入下載目錄用量，超過水位時立即清理
+    if fields.get('status') == 'completed' and fields.get('file_path') and not fields.get('cached'):
+        file_evictor.added(fields['file_path'])
+
+
+def attach_to_inflight(task_id, cache_key, batch_id=None):
+    """
+    若相同請求已在下載中，將新任務附加為跟隨任務
+    
+    Args:
+        task_id: 新任務 ID (必須已存在於 download_tasks)
+        cache_key: 請求的快取鍵
+        batch_id: 新任務所屬批次 (可跟隨同一批次中尚未派送的任務)
+    
+    Returns:
+        str | None: 主任務 ID，若沒有進行中的相同請求則返回 None
+                    (此時新任務成為該鍵的主任務)
+    """
+    with download_tasks.transaction():
+        leader = download_tasks.find_leader(cache_key, batch_id)
+        if leader is None or leader['id'] == task_id:
+            return None
         
-        # pytubefix 所有策略都失敗，嘗試使用 yt-dlp 作為後備方案
-        if YTDLP_AVAILABLE:
-            try:
-                app.logger.info(f'嘗試使用 yt-dlp 後備方案 (task_id={task_id})')
-                download_tasks[task_id]['message'] = '正在使用 yt-dlp 後備方案下載...'
-                
-                # yt-dlp 選項
-                if download_type == 'audio':
-                    ydl_opts = {
-                        'format': 'bestaudio/best',
-                        'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s.%(ext)s'),
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                        'quiet': True,
-                        'no_warnings': True,
-                        'http_headers': {
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        },
-                        'retries': 5,
-                        'socket_timeout': 30,
-                        'extractor_args': {
-                            'youtube': {
-                                'player_client': ['ios', 'android', 'web'],
-                            }
-                        },
-                    }
-                    # 添加 cookies 設定
-                    if COOKIES_PATH:
-                        ydl_opts['cookiefile'] = COOKIES_PATH
-                else:
-                    # 影片模式
-                    if quality == 'best':
-                        format_spec = 'best[ext=mp4]/best'
-                    else:
-                        height = quality.replace('p', '') if quality else '720'
-                        format_spec = f'best[height<={height}][ext=mp4]/best[height<={height}]'
-                    
-                    ydl_opts = {
-                        'format': format_spec,
-                        'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s.%(ext)s'),
-                        'quiet': True,
-                        'no_warnings': True,
-                        'http_headers': {
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        },
-                        'retries': 5,
-                        'socket_timeout': 30,
-                        'extractor_args': {
-                            'youtube': {
-                                'player_client': ['ios', 'android', 'web'],
-                            }
-                        },
-                    }
-                    # 添加 cookies 設定
-                    if COOKIES_PATH:
-                        ydl_opts['cookiefile'] = COOKIES_PATH
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    
-                    # 獲取下載的檔案路徑
-                    if download_type == 'audio':
-                        file_path = os.path.join(DOWNLOAD_FOLDER, ydl.prepare_filename(info).rsplit('.', 1)[0] + '.mp3')
-                    else:
-                        file_path = os.path.join(DOWNLOAD_FOLDER, ydl.prepare_filename(info))
-                    
-                    # 確認檔案存在
-                    if not os.path.exists(file_path):
-                        # 嘗試找到下載的檔案
-                        for ext in ['mp3', 'mp4', 'webm', 'mkv', 'm4a']:
-                            test_path = file_path.rsplit('.', 1)[0] + '.' + ext
-                            if os.path.exists(test_path):
-                                file_path = test_path
-                                break
-                    
-                    if os.path.exists(file_path):
-                        download_tasks[task_id]['title'] = info.get('title', 'Unknown')
-                        download_tasks[task_id]['author'] = info.get('uploader', info.get('channel', 'Unknown'))
-                        download_tasks[task_id]['length'] = info.get('duration', 0)
-                        download_tasks[task_id]['status'] = 'completed'
-                        download_tasks[task_id]['message'] = '下載完成 (yt-dlp)'
-                        download_tasks[task_id]['file_path'] = os.path.abspath(file_path)
-                        download_tasks[task_id]['filename'] = os.path.basename(file_path)
-                        download_tasks[task_id]['progress'] = 100
-                        
-                        app.logger.info(f'yt-dlp 下載完成: {os.path.basename(file_path)}')
-                        return
-                    else:
-                        raise Exception(f'檔案未找到: {file_path}')
-                        
-            except Exception as ytdlp_error:
-                app.logger.error(f'yt-dlp 後備方案也失敗: {ytdlp_error}')
-                last_error = f'pytubefix 和 yt-dlp 都失敗: {last_error} / {ytdlp_error}'
-        
-        # 所有方法都失敗
-        download_tasks[task_id]['status'] = 'error'
-        download_tasks[task_id]['message'] = f'下載失敗: {last_error}'
-        app.logger.error(f'下載錯誤 (task_id={task_id}): {last_error}', exc_info=True)
-
-
-@app.route('/')
-def index():
-    """首頁"""
-    return render_template('index.html')
+        # 複製主任務目前狀態，之後由 update_task 持續同步
+        mirrored = {k: v for k, v in leader.items() if k not in MIRROR_EXCLUDED_FIELDS}
+        mirrored['follows'] = leader['id']
+        download_tasks.update(task_id, mirrored)
+        download_tasks.update(leader['id'], {'followers': leader.get('followers', []) + [task_id]})
+        return leader['id']
 
 
-# 安全性 Headers
-@app.after_request
-def set_security_headers(response):
-    """設定安全性 Headers"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    return response
+def download_stream(stream, filename_prefix=None):
+    """
+    下載串流到 DOWNLOAD_FOLDER
+    
+    檔案大小已知時以 RangedDownloader 下載 (超過 RANGED_DOWNLOAD_MIN_SIZE 時使用多連線)，
+    下載中的內容寫入 .part 並記錄進度；stream._source_id (影片 ID + itag) 相同的重試，
+    包含改用其他客戶端策略或行程重啟後，都從已完成的位置繼續 (yt-dlp 後備不續傳，成功後刪除 .part)。
+    檔案大小未知、或尚未下載任何內容就失敗時，改用 pytubefix 的單連線下載
+    
+    Args:
+        stream: pytubefix 串流 (進度透過 progress_callback 回報)
+        filename_prefix: 檔名前綴 (同時下載多個串流時避免檔名衝突)
+    
+    Returns:
+        str: 下載的檔案路徑
+    
+    Raises:
+        RangedDownloadError: 已保存部分內容後失敗 (由下一個策略續傳)
+    """
+    try:
+        total_size = stream.filesize
+    except Exception as e:
+        logger.warning(f'無法取得檔案大小，使用單連線下載: {e}')
+        total_size = 0
+    
+    connections = 1
+    if total_size >= config.RANGED_DOWNLOAD_MIN_SIZE:
+        connections = max(config.RANGED_DOWNLOAD_CONNECTIONS, 1)
+    
+    if total_size > 0 and (connections > 1 or config.RESUMABLE_DOWNLOADS):
+        file_path = stream.get_file_path(output_path=config.DOWNLOAD_FOLDER, filename_prefix=filename_prefix)
+        source_id = getattr(stream, '_source_id', None) if config.RESUMABLE_DOWNLOADS else None
+        downloader = RangedDownloader(
+            connections=connections,
+            segment_size=config.RANGED_DOWNLOAD_SEGMENT_SIZE,
+            max_retries=config.RANGED_DOWNLOAD_RETRIES,
+            range_style=RANGE_STYLE_QUERY
+        )
+        try:
+            return downloader.download(
+                stream.url,
+                file_path,
+                total_size,
+                # 進度由下載執行緒回報，在目前的應用程式情境中更新任務
+                on_progress=with_app_context(lambda done, total: progress_callback(stream, None, total - done)),
+                source_id=source_id
+            )
+        except RangedDownloadError as e:
+            if source_id and e.bytes_done:
+                # 保留 .part，交給下一個策略續傳，不從頭重新下載
+                logger.warning(f'下載中斷，已保存 {format_file_size(e.bytes_done)}: {e}')
+                raise
+            logger.warning(f'分段下載失敗，改用單連線下載: {e}')
+    
+    return stream.download(output_path=config.DOWNLOAD_FOLDER, filename_prefix=filename_prefix)
 
 
-# 錯誤處理器
-@app.errorhandler(404)
-def not_found(error):
-    """404 錯誤處理"""
-    return error_response('找不到資源', code='NOT_FOUND', status_code=404)
+def resolution_height(resolution):
+    """'1080p' / '1080p60' -> 1080，無法解析時返回 0"""
+    try:
+        return int(str(resolution).split('p')[0])
+    except (TypeError, ValueError):
+        return 0
 
 
-@app.errorhandler(500)
-def internal_error(error):
-    """500 錯誤處理"""
-    app.logger.error(f'[{g.get("request_id", "unknown")}] 伺服器錯誤: {error}', exc_info=True)
-    return error_response('伺服器內部錯誤', code='INTERNAL_ERROR', status_code=500)
+def select_video_stream(yt, quality, adaptive=True):
+    """
+    選擇影片串流
+    
+    優先使用同時含影音的 progressive 串流 (最高約 720p)；
+    自適應 (DASH) 串流可提供更高畫質時，改用純影像串流並搭配 AAC 音訊串流
+    
+    Args:
+        adaptive: 是否考慮自適應串流 (合併失敗後重新下載時停用)
+    
+    Returns:
+        tuple: (progressive 串流, 純影像串流, 純音訊串流)；不使用自適應時後兩者為 None
+    """
+    progressive = yt.streams.filter(progressive=True)
+    if quality == 'best':
+        stream = progressive.order_by('resolution').desc().first()
+    else:
+        # 特定解析度，找不到時使用最高畫質
+        stream = progressive.filter(res=quality).first() or progressive.order_by('resolution').desc().first()
+    
+    if not adaptive or not config.ADAPTIVE_VIDEO_ENABLED or not ffmpeg_available():
+        return stream, None, None
+    
+    # 不超過要求解析度的最高畫質；相同解析度優先選擇 MP4 (H.264) 以提高播放相容性
+    limit = None if quality == 'best' else resolution_height(quality)
+    candidates = [
+        s for s in yt.streams.filter(adaptive=True, only_video=True)
+        if resolution_height(s.resolution) and (not limit or resolution_height(s.resolution) <= limit)
+    ]
+    if not candidates:
+        return stream, None, None
+    video_stream = max(candidates, key=lambda s: (
+        resolution_height(s.resolution), s.subtype == 'mp4', getattr(s, 'fps', 0) or 0
+    ))
+    
+    # progressive 已有相同畫質時不需要額外合併
+    if stream and resolution_height(stream.resolution) >= resolution_height(video_stream.resolution):
+        return stream, None, None
+    
+    audio_stream = select_audio_stream(yt, 'm4a')
+    if not audio_stream:
+        return stream, None, None
+    return stream, video_stream, audio_stream
 
 
-@app.errorhandler(413)
-def request_entity_too_large(error):
-    """413 錯誤處理（請求實體過大）"""
-    return error_response('檔案過大', code='FILE_TOO_LARGE', status_code=413)
+class AdaptiveProgress:
+    """合併同時下載的影像與音訊串流進度"""
+    
+    def __init__(self, streams):
+        self.lock = threading.Lock()
+        self.done = {id(s): 0 for s in streams}
+        self.total = sum(s.filesize for s in streams)
+    
+    def update(self, stream, bytes_downloaded):
+        """記錄單一串流進度，返回 (合計已下載, 合計大小)"""
+        with self.lock:
+            self.done[id(stream)] = bytes_downloaded
+            return sum(self.done.values()), self.total
 
 
-@app.errorhandler(429)
-def ratelimit_handler(e):
-    """速率限制錯誤處理"""
-    return error_response(
-        f'請求過於頻繁，請稍後再試',
-        code='RATE_LIMIT_EXCEEDED',
-        status_code=429,
-        details={'retry_after': e.description}
+def adaptive_output_file(video_stream):
+    """
+    自適應影片合併後的 MP4 路徑
+    
+    Raises:
+        TranscodeError: 路徑不安全 (呼叫端可改用 progressive 串流)
+    """
+    output_file = os.path.join(config.DOWNLOAD_FOLDER, os.path.splitext(video_stream.default_filename)[0] + '.mp4')
+    if not validate_file_path(output_file, config.DOWNLOAD_FOLDER):
+        raise TranscodeError(f'檔案路徑不安全: {output_file}')
+    return output_file
+
+
+def fetch_adaptive(task_id, video_stream, audio_stream):
+    """
+    同時下載純影像與純音訊串流
+    
+    Returns:
+        tuple: (純影像檔案, 純音訊檔案)
+    
+    Raises:
+        Exception: 下載錯誤 (已下載的另一個檔案會被刪除)
+    """
+    progress = AdaptiveProgress((video_stream, audio_stream))
+    video_stream._adaptive_progress = progress
+    audio_stream._adaptive_progress = progress
+    
+    # 兩個串流同時下載，總時間約為較大者的下載時間
+    # 檔名前綴使用 itag：同一串流在重試或重啟後對應到相同的 .part 檔，可以續傳
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='adaptive') as pool:
+        futures = [
+            pool.submit(with_app_context(download_stream), video_stream, f'v{video_stream.itag}_'),
+            pool.submit(with_app_context(download_stream), audio_stream, f'a{audio_stream.itag}_'),
+        ]
+    errors = [f.exception() for f in futures if f.exception()]
+    if errors:
+        # 其中一個失敗時清除另一個已下載的檔案
+        for future in futures:
+            if not future.exception():
+                remove_file_quietly(future.result())
+        raise errors[0]
+    video_file, audio_file = (f.result() for f in futures)
+    
+    logger.info(
+        f'自適應串流下載完成: {video_stream.resolution} {video_stream.subtype} + {audio_stream.abr} '
+        f'({format_file_size(os.path.getsize(video_file) + os.path.getsize(audio_file))})'
     )
+    return video_file, audio_file
 
 
-# 健康檢查端點
-@app.route('/health')
-def health_check():
-    """健康檢查端點"""
-    total, used, free = get_disk_space(DOWNLOAD_FOLDER)
+def download_adaptive(task_id, video_stream, audio_stream):
+    """
+    同時下載純影像與純音訊串流，再以 -c copy 合併為 MP4
     
-    checks = {
-        'status': 'healthy',
-        'ffmpeg': check_ffmpeg_available(),
-        'disk_space_mb': free,
-        'active_tasks': len([t for t in download_tasks.values() if t['status'] in ['downloading', 'converting']])
-    }
+    Args:
+        task_id: 任務 ID
+        video_stream: 純影像串流
+        audio_stream: 純音訊串流 (AAC)
     
-    # 如果 FFmpeg 不可用或磁碟空間不足，返回 503
-    status_code = 200 if checks['ffmpeg'] and free > 100 else 503
-    return jsonify(checks), status_code
+    Returns:
+        str: MP4 檔案路徑
+    
+    Raises:
+        TranscodeError: 合併失敗 (呼叫端可改用 progressive 串流)
+        Exception: 下載錯誤
+    """
+    output_file = adaptive_output_file(video_stream)
+    video_file, audio_file = fetch_adaptive(task_id, video_stream, audio_stream)
+    update_task(task_id, status='converting', message='正在合併影像與音訊...', progress=99)
+    
+    try:
+        mux_streams(
+            video_file,
+            audio_file,
+            output_file,
+            video_format=CONTAINER_DEMUXERS.get(video_stream.subtype),
+            audio_format=CONTAINER_DEMUXERS.get(audio_stream.subtype),
+            timeout=config.FFMPEG_TIMEOUT
+        )
+    finally:
+        remove_file_quietly(video_file)
+        remove_file_quietly(audio_file)
+    return output_file
 
 
-# 系統監控端點
-@app.route('/api/metrics')
-@limiter.exempt  # 監控端點不受速率限制
-def get_metrics():
-    """獲取系統效能指標"""
+def remove_file_quietly(path):
+    """刪除檔案，忽略不存在等錯誤"""
     try:
-        # CPU 和記憶體使用
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        
-        # 磁碟空間
-        total, used, free = get_disk_space(DOWNLOAD_FOLDER)
-        
-        # 任務統計
-        task_stats = {
-            'total': len(download_tasks),
-            'pending': len([t for t in download_tasks.values() if t['status'] == 'pending']),
-            'downloading': len([t for t in download_tasks.values() if t['status'] == 'downloading']),
-            'converting': len([t for t in download_tasks.values() if t['status'] == 'converting']),
-            'completed': len([t for t in download_tasks.values() if t['status'] == 'completed']),
-            'error': len([t for t in download_tasks.values() if t['status'] == 'error'])
-        }
-        
-        metrics = {
-            'timestamp': datetime.now().isoformat(),
-            'system': {
-                'cpu_percent': psutil.cpu_percent(interval=0.1),
-                'memory_mb': memory_info.rss // (1024 * 1024),
-                'threads': threading.active_count()
-            },
-            'disk': {
-                'total_mb': total,
-                'used_mb': used,
-                'free_mb': free,
-                'usage_percent': round((used / total) * 100, 2) if total > 0 else 0
-            },
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def stream_audio_to_mp3(task_id, stream, bitrate):
+    """
+    將音訊串流直接透過管線餵給 FFmpeg，邊下載邊轉換為 MP3
+    
+    Args:
+        task_id: 任務 ID
+        stream: pytubefix 音訊串流 (進度透過 on_progress 回調回報)
+        bitrate: MP3 位元率
+    
+    Returns:
+        str | None: MP3 檔案路徑；FFmpeg 失敗時返回 None，由呼叫端改用下載後轉換
+    
+    Raises:
+        Exception: 下載串流時的錯誤 (交由策略重試處理)
+    """
+    output_file = os.path.join(config.DOWNLOAD_FOLDER, os.path.splitext(stream.default_filename)[0] + '.mp3')
+    if not validate_file_path(output_file, config.DOWNLOAD_FOLDER):
+        logger.error(f'檔案路徑不安全: {output_file}')
+        return None
+    
+    update_task(task_id, message='正在下載並轉換為 MP3...')
+    logger.info(f'開始串流轉換為 MP3: {os.path.basename(output_file)}')
+    
+    try:
+        file_path = encode_stream_to_mp3(
+            stream.iter_chunks(),
+            output_file,
+            bitrate=bitrate,
+            timeout=config.FFMPEG_TIMEOUT,
+            expected_duration=(download_tasks.get(task_id) or {}).get('length')
+        )
+    except TranscodeError as e:
+        logger.warning(f'串流轉換失敗，改用下載後轉換: {e}')
+        return None
+    
+    logger.info(f'MP3 串流轉換完成: {os.path.basename(file_path)} ({format_file_size(os.path.getsize(file_path))})')
+    return file_path
+
+
+def progress_callback(stream, chunk, bytes_remaining):
+    """下載進度回調"""
+    task_id = getattr(stream, '_task_id', None)
+    if task_id:
+        total_size = stream.filesize
+        bytes_downloaded = total_size - bytes_remaining
+        # 自適應下載：回報影像與音訊串流的合計進度
+        combined = getattr(stream, '_adaptive_progress', None)
+        if combined is not None:
+            bytes_downloaded, total_size = combined.update(stream, bytes_downloaded)
+            bytes_remaining = total_size - bytes_downloaded
+        percentage = (bytes_downloaded / total_size) * 100
+        
+        # 每增加 1% 才寫入一次，避免頻繁寫入共用的任務儲存
+        if int(percentage) == getattr(stream, '_last_progress', None) and bytes_remaining > 0:
+            return
+        stream._last_progress = int(percentage)
+        
+        update_task(
+            task_id,
+            progress=round(percentage, 1),
+            downloaded=bytes_downloaded,
+            total=total_size
+        )
+
+
+def complete_callback(stream, file_path):
+    """下載完成回調"""
+    task_id = getattr(stream, '_task_id', None)
+    # 串流模式 (iter_chunks) 完成時 file_path 為 None
+    if task_id and file_path:
+        update_task(task_id, file_path=file_path)
+        print(f'✅ 下載完成: {os.path.basename(file_path)}')
+
+
+def run_download_job(task_id, url, download_type, quality, bitrate, wait_for_transcode=False,
+                     audio_format='mp3', adaptive=True):
+    """
+    執行下載任務，確保任務不會因未預期的例外停留在進行中狀態
+    
+    Args:
+        wait_for_transcode: 是否等待轉換階段完成 (worker.py 的行程需要等待，
+                            thread 模式則讓下載執行緒立即處理下一個任務)
+        audio_format: 音訊輸出格式 (mp3, m4a, opus, auto)
+        adaptive: 影片是否可使用自適應串流
+    """
+    try:
+        pending = download_video_thread(task_id, url, download_type, quality, bitrate, audio_format, adaptive)
+    except Exception as e:
+        logger.error(f'下載任務異常結束 (task_id={task_id}): {e}', exc_info=True)
+        update_task(task_id, status='error', message=f'下載失敗: {e}')
+        return
+    
+    if pending is not None and wait_for_transcode:
+        pending.result()
+
+
+def run_transcode_job(task_id, file_path, bitrate, duration, output_format='mp3',
+                      source_codec=None, input_format=None):
+    """轉換階段：將下載完成的音訊轉換為 output_format (預設 MP3) 並完成任務"""
+    # 等待轉換期間已超過修改時間保護，轉換中不可被容量清理刪除
+    pin = file_evictor.pin(file_path)
+    try:
+        label = output_format.upper()
+        update_task(task_id, status='converting', message=f'正在轉換為 {label}...', progress=95)
+        
+        if output_format == 'mp3':
+            file_path = convert_to_mp3(file_path, bitrate, duration=duration)
+        else:
+            file_path = convert_to_format(
+                file_path, output_format, bitrate,
+                source_codec=source_codec, input_format=input_format
+            )
+        
+        finish_transcode_job(task_id, file_path, output_format)
+    except Exception as e:
+        logger.error(f'轉換任務異常結束 (task_id={task_id}): {e}', exc_info=True)
+        update_task(task_id, status='error', message=f'轉換失敗: {e}')
+    finally:
+        pin.release()
+
+
+async def run_transcode_job_async(task_id, file_path, bitrate, duration, output_format='mp3',
+                                  source_codec=None, input_format=None):
+    """
+    run_transcode_job 的協程版本 (ASGI 模式，由 AsyncBoundedExecutor 執行)
+    
+    FFmpeg 以 asyncio 子行程執行，等待轉換時不佔用執行緒；
+    長音訊的分段轉換同時使用多個 FFmpeg 行程，仍交給執行緒版本。
+    任務儲存 (SQLite 查詢與寫入) 與檔案釘選可能等待鎖定，在執行緒中執行，不阻塞事件迴圈
+    """
+    if output_format == 'mp3' and use_segmented_transcode(duration):
+        return await asyncio.to_thread(
+            run_transcode_job, task_id, file_path, bitrate, duration, output_format, source_codec, input_format
+        )
+    
+    pin = await asyncio.to_thread(file_evictor.pin, file_path)
+    try:
+        await asyncio.to_thread(
+            update_task, task_id, status='converting', message=f'正在轉換為 {output_format.upper()}...', progress=95
+        )
+        file_path = await convert_file_async(file_path, output_format, bitrate, source_codec, input_format)
+        await asyncio.to_thread(finish_transcode_job, task_id, file_path, output_format)
+    except Exception as e:
+        logger.error(f'轉換任務異常結束 (task_id={task_id}): {e}', exc_info=True)
+        await asyncio.to_thread(update_task, task_id, status='error', message=f'轉換失敗: {e}')
+    finally:
+        await asyncio.to_thread(pin.release)
+
+
+async def convert_file_async(input_file, output_format, bitrate='192k', source_codec=None, input_format=None):
+    """
+    convert_to_mp3 / convert_to_format 的協程版本 (單一 FFmpeg 行程)
+    
+    Returns:
+        str: 輸出檔案路徑 (失敗時返回原始檔案)
+    """
+    if not os.path.exists(input_file):
+        logger.error(f'輸入檔案不存在: {input_file}')
+        return input_file
+    
+    if not validate_file_path(input_file, config.DOWNLOAD_FOLDER):
+        logger.error(f'檔案路徑不安全: {input_file}')
+        return input_file
+    
+    # 只有第一次在執行緒中執行 ffmpeg -version，之後使用快取結果
+    available = _ffmpeg_probe if _ffmpeg_probe is not None else await asyncio.to_thread(ffmpeg_available)
+    if not available:
+        logger.error('FFmpeg 未正確安裝')
+        return input_file
+    
+    output_file = os.path.splitext(input_file)[0] + '.' + output_format
+    try:
+        if output_format == 'mp3':
+            try:
+                bitrate = validate_bitrate(bitrate)
+            except ValueError:
+                bitrate = '192k'
+            await encode_to_mp3_async(input_file, output_file, bitrate, timeout=config.FFMPEG_TIMEOUT)
+        else:
+            output_file, _ = await convert_audio_async(
+                input_file, output_file, output_format,
+                source_codec=source_codec, input_format=input_format,
+                bitrate=bitrate, timeout=config.FFMPEG_TIMEOUT
+            )
+    except TranscodeError as e:
+        logger.error(f'{output_format} 轉換失敗: {e}')
+        return input_file
+    
+    if output_file != input_file:
+        os.remove(input_file)
+    logger.info(f'{output_format} 轉換完成: {os.path.basename(output_file)} ({format_file_size(os.path.getsize(output_file))})')
+    return output_file
+
+
+async def run_mux_job_async(task_id, video_file, audio_file, output_file, video_format=None,
+                            audio_format=None, fallback=None):
+    """
+    自適應影片的合併階段 (非同步轉換階段執行)：以 asyncio 子行程合併影像與音訊並完成任務
+    
+    Args:
+        fallback: 合併失敗時重新派送的下載參數 (停用自適應串流)，None 則標記任務失敗
+    """
+    pins = [await asyncio.to_thread(file_evictor.pin, path) for path in (video_file, audio_file)]
+    try:
+        await asyncio.to_thread(
+            update_task, task_id, status='converting', message='正在合併影像與音訊...', progress=99
+        )
+        await mux_streams_async(
+            video_file, audio_file, output_file,
+            video_format=video_format, audio_format=audio_format, timeout=config.FFMPEG_TIMEOUT
+        )
+        await asyncio.to_thread(finish_transcode_job, task_id, output_file, 'mp4')
+    except TranscodeError as e:
+        if fallback is None:
+            logger.error(f'影音合併失敗 (task_id={task_id}): {e}')
+            await asyncio.to_thread(update_task, task_id, status='error', message=f'影音合併失敗: {e}')
+        else:
+            logger.warning(f'影音合併失敗，改用 progressive 串流重新下載: {e}')
+            await asyncio.to_thread(update_task, task_id, status='pending', message='合併失敗，改用 progressive 串流...')
+            await asyncio.to_thread(dispatch_download, task_id, fallback, True)
+    except Exception as e:
+        logger.error(f'合併任務異常結束 (task_id={task_id}): {e}', exc_info=True)
+        await asyncio.to_thread(update_task, task_id, status='error', message=f'合併失敗: {e}')
+    finally:
+        for pin in pins:
+            await asyncio.to_thread(pin.release)
+        await asyncio.to_thread(remove_file_quietly, video_file)
+        await asyncio.to_thread(remove_file_quietly, audio_file)
+
+
+def finish_transcode_job(task_id, file_path, output_format):
+    """轉換階段結束：依輸出副檔名判斷是否轉換成功並完成任務"""
+    label = output_format.upper()
+    if file_path.endswith('.' + output_format):
+        logger.info(f'{label} 轉換成功')
+        message = '下載完成'
+    else:
+        logger.warning(f'轉換失敗，返回原始檔案 {os.path.splitext(file_path)[1]}')
+        message = f'下載完成 (轉換失敗，格式: {os.path.splitext(file_path)[1]})'
+    
+    update_task(
+        task_id,
+        status='completed',
+        message=message,
+        file_path=os.path.abspath(file_path),
+        filename=os.path.basename(file_path),
+        progress=100
+    )
+    cache_completed_task(task_id)
+    logger.info(f'任務完成: {os.path.basename(file_path)}')
+
+
+def cache_completed_task(task_id):
+    """將已完成的任務寫入結果快取"""
+    task = download_tasks.get(task_id)
+    if not task or not task.get('cache_key') or not config.RESULT_CACHE_ENABLED:
+        return
+    
+    # 音訊轉換失敗時檔案不是預期格式，不快取 (auto 依來源編碼決定實際格式)
+    expected = task['output_format']
+    extensions = ('.mp3', '.m4a', '.opus') if expected == 'auto' else ('.' + expected,)
+    if not task['file_path'].endswith(extensions):
+        return
+    
+    # 記錄檔案大小與修改時間，讓其他行程可透過任務儲存驗證並重用此結果
+    try:
+        stat = os.stat(task['file_path'])
+    except OSError:
+        return
+    download_tasks.update(task_id, {'file_size': stat.st_size, 'file_mtime': stat.st_mtime})
+    
+    result_cache.put(
+        task['cache_key'],
+        task['file_path'],
+        title=task.get('title'),
+        author=task.get('author'),
+        length=task.get('length')
+    )
+
+
+def download_video_thread(task_id, url, download_type, quality, bitrate='192k', audio_format='mp3', adaptive=True):
+    """
+    背景執行緒下載影片 (管線的下載階段)
+    
+    Args:
+        audio_format: 音訊輸出格式 (mp3, m4a, opus, auto)；
+                      來源編碼相符時只重新封裝，'auto' 依來源編碼選擇不需重新編碼的格式
+        adaptive: 影片是否可使用自適應串流 (非同步合併失敗後以 False 重新下載)
+    
+    非同步轉換階段 (transcode_executor.is_async) 時下載階段只負責下載，
+    MP3 編碼、重新封裝與影音合併都交給轉換階段的 asyncio 子行程
+    
+    Returns:
+        Future | None: 需要轉換時返回轉換階段的 Future，任務由轉換階段完成
+    """
+    # 嘗試多個策略以避免 403 錯誤
+    # 策略順序由 strategy_selector 依近期成功率與延遲決定，斷路器開啟中的策略會被跳過
+    strategies = strategy_selector.ordered()
+    last_error = None if strategies else '所有客戶端策略都在冷卻中'
+    # 嘗試過的串流來源 (影片 ID + itag)，yt-dlp 後備完成後據此刪除留下的 .part
+    attempted_sources = set()
+    
+    for strategy in strategies:
+        attempt_start = time.monotonic()
+        stream_latency = None
+        # 已取得檔案：之後的錯誤 (封裝、轉換、磁碟) 與客戶端策略無關，不計入斷路器
+        fetched = False
+        try:
+            update_task(
+                task_id,
+                status='downloading',
+                message=f'正在使用 {strategy["name"]} 策略下載...'
+            )
+            
+            logger.info(f'嘗試策略: {strategy["name"]} (task_id={task_id})')
+            
+            # 建立 YouTube 物件
+            if strategy['use_po_token']:
+                # WEB 客戶端使用自動 PoToken 生成 (需要 Node.js)
+                yt = engine_registry.load('pytubefix').YouTube(
+                    url,
+                    'WEB',  # 使用位置參數啟用自動 PoToken
+                    on_progress_callback=progress_callback,
+                    on_complete_callback=complete_callback
+                )
+            else:
+                # IOS/ANDROID 客戶端
+                yt = engine_registry.load('pytubefix').YouTube(
+                    url,
+                    client=strategy['client'],
+                    on_progress_callback=progress_callback,
+                    on_complete_callback=complete_callback
+                )
+            
+            # 儲存 task_id 到 stream 物件
+            video_stream = audio_stream = None
+            if download_type == 'video':
+                # 影片模式 (progressive 畫質不足時改用自適應串流)
+                stream, video_stream, audio_stream = select_video_stream(yt, quality, adaptive)
+                if video_stream:
+                    video_stream._task_id = task_id
+                    audio_stream._task_id = task_id
+            else:
+                # 音訊模式 - 獲取最高品質音訊 (依輸出格式優先選擇可直接封裝的編碼)
+                stream = select_audio_stream(yt, audio_format)
+            
+            if not stream and not video_stream:
+                raise Exception('找不到可用的串流')
+            
+            # 來源編碼與容器已知，轉換時直接告知 FFmpeg 以省略格式偵測
+            source_codec = None
+            target_format = 'mp3'
+            if download_type == 'audio':
+                source_codec = normalize_audio_codec(getattr(stream, 'audio_codec', None))
+                target_format = resolve_audio_format(audio_format, source_codec)
+            input_format = CONTAINER_DEMUXERS.get(getattr(stream, 'subtype', None))
+            
+            # 設定 task_id 與來源識別 (續傳時確認 .part 檔屬於同一個串流)
+            for selected in (stream, video_stream, audio_stream):
+                if selected:
+                    selected._source_id = f'{yt.video_id}:{selected.itag}'
+                    attempted_sources.add(selected._source_id)
+            if stream:
+                stream._task_id = task_id
+            stream_latency = time.monotonic() - attempt_start
+            
+            # 儲存影片資訊
+            update_task(
+                task_id,
+                title=yt.title,
+                author=yt.author,
+                length=yt.length
+            )
+            
+            # 自適應影片：影像與音訊同時下載後合併，合併失敗時改用 progressive 串流
+            file_path = None
+            if video_stream:
+                logger.info(f'使用自適應串流: {video_stream.resolution} (task_id={task_id})')
+                update_task(task_id, message=f'正在下載 {video_stream.resolution} 影像與音訊...')
+                try:
+                    if transcode_executor.is_async:
+                        # 下載完成後由轉換階段合併，下載執行緒立即處理下一個任務
+                        output_file = adaptive_output_file(video_stream)
+                        video_file, audio_file = fetch_adaptive(task_id, video_stream, audio_stream)
+                        fetched = True
+                        strategy_selector.record_success(strategy['name'], stream_latency)
+                        update_task(task_id, status='converting', message='等待合併影像與音訊...', progress=99)
+                        # 合併失敗時停用自適應串流重新下載 (有 progressive 串流時)
+                        fallback = {
+                            'url': url, 'type': download_type, 'quality': quality,
+                            'bitrate': bitrate, 'format': audio_format, 'adaptive': False
+                        } if stream else None
+                        return transcode_executor.submit(
+                            task_id,
+                            with_app_context(run_mux_job_async),
+                            task_id, video_file, audio_file, output_file,
+                            CONTAINER_DEMUXERS.get(video_stream.subtype),
+                            CONTAINER_DEMUXERS.get(audio_stream.subtype),
+                            fallback,
+                            block=True
+                        )
+                    file_path = download_adaptive(task_id, video_stream, audio_stream)
+                except TranscodeError as e:
+                    if not stream:
+                        raise
+                    logger.warning(f'影音合併失敗，改用 progressive 串流: {e}')
+            
+            # 串流模式：下載與 MP3 編碼同時進行，不產生原始音訊暫存檔
+            length = yt.length
+            # 長音訊改用下載後分段並行轉換 (單一 FFmpeg 的串流編碼會受限於單一核心)；
+            # 非同步轉換階段下載後再以 asyncio 子行程編碼，FFmpeg 不佔用下載執行緒
+            if (download_type == 'audio' and target_format == 'mp3' and config.AUDIO_STREAM_TRANSCODE
+                    and not transcode_executor.is_async
+                    and not use_segmented_transcode(length) and ffmpeg_available()):
+                file_path = stream_audio_to_mp3(task_id, stream, bitrate)
+            
+            needs_processing = not file_path
+            if needs_processing:
+                # 下載
+                file_path = download_stream(stream)
+                logger.info(f'下載完成: {os.path.basename(file_path)} ({format_file_size(os.path.getsize(file_path))})')
+            
+            # 檔案已取得，策略結果只在此記錄一次
+            fetched = True
+            strategy_selector.record_success(strategy['name'], stream_latency)
+            
+            if needs_processing:
+                # 來源編碼可直接封裝：只需複製串流，在下載階段完成即可 (非同步轉換階段則交給轉換階段的子行程)
+                if (download_type == 'audio' and can_stream_copy(target_format, source_codec)
+                        and not transcode_executor.is_async):
+                    logger.info(f'音訊模式 - 重新封裝為 {target_format} ({source_codec})')
+                    update_task(task_id, status='converting', message=f'正在封裝為 {target_format.upper()}...', progress=95)
+                    file_path = convert_to_format(
+                        file_path, target_format, bitrate,
+                        source_codec=source_codec, input_format=input_format
+                    )
+                
+                # 需要重新編碼 (或非同步重新封裝) 的音訊交給轉換階段 (轉換佇列已滿時在此等待)
+                elif download_type == 'audio':
+                    logger.info(f'音訊模式 - 排入 {target_format.upper()} 轉換')
+                    update_task(
+                        task_id,
+                        status='converting',
+                        message=f'等待轉換為 {target_format.upper()}...',
+                        progress=95
+                    )
+                    # 非同步轉換階段在事件迴圈上以 asyncio 子行程執行 FFmpeg
+                    return transcode_executor.submit(
+                        task_id,
+                        with_app_context(run_transcode_job_async if transcode_executor.is_async else run_transcode_job),
+                        task_id, file_path, bitrate, length, target_format, source_codec, input_format,
+                        block=True
+                    )
+            
+            # 下載完成
+            update_task(
+                task_id,
+                status='completed',
+                message='下載完成',
+                file_path=os.path.abspath(file_path),
+                filename=os.path.basename(file_path),
+                progress=100
+            )
+            
+            cache_completed_task(task_id)
+            
+            logger.info(f'任務完成: {os.path.basename(file_path)}')
+            return  # 成功，退出函數
+            
+        except Exception as e:
+            last_error = e
+            if fetched or isinstance(e, TranscodeError):
+                # 本機的 FFmpeg 或檔案錯誤，不計入策略的斷路器
+                logger.warning(f'{strategy["name"]} 策略的後續處理失敗: {e}')
+                continue
+            error_class = strategy_selector.record_failure(
+                strategy['name'], e, time.monotonic() - attempt_start
+            )
+            logger.warning(f'{strategy["name"]} 策略失敗 ({error_class}): {e}')
+            continue
+    
+    # pytubefix 所有策略都失敗，嘗試使用 yt-dlp 作為後備方案
+    # (yt-dlp 以自己的檔名重新下載，不沿用 pytubefix 留下的 .part；成功後刪除這些 .part)
+    if YTDLP_AVAILABLE:
+        try:
+            logger.info(f'嘗試使用 yt-dlp 後備方案 (task_id={task_id})')
+            update_task(task_id, message='正在使用 yt-dlp 後備方案下載...')
+            
+            if download_type == 'audio':
+                profile, params = 'audio', {'codec': audio_format, 'quality': bitrate.replace('k', '')}
+            else:
+                # 影片模式
+                if config.ADAPTIVE_VIDEO_ENABLED:
+                    # 分別下載最佳影像與 AAC 音訊，由 yt-dlp 以 FFmpeg 合併 (不重新編碼)
+                    height_filter = '' if quality == 'best' else f'[height<={resolution_height(quality) or 720}]'
+                    format_spec = (
+                        f'bestvideo{height_filter}[ext=mp4]+bestaudio[ext=m4a]/'
+                        f'bestvideo{height_filter}+bestaudio[ext=m4a]/'
+                        f'best{height_filter}[ext=mp4]/best{height_filter}'
+                    )
+                elif quality == 'best':
+                    format_spec = 'best[ext=mp4]/best'
+                else:
+                    height = quality.replace('p', '') if quality else '720'
+                    format_spec = f'best[height<={height}][ext=mp4]/best[height<={height}]'
+                profile, params = 'video', {'format': format_spec}
+            
+            # 在 yt-dlp 輔助行程中下載
+            result = ytdlp_service.download(url, profile, **params)
+            info = result['info']
+            
+            # 獲取下載的檔案路徑 (優先使用後處理後的檔案)
+            if result['filepath'] and os.path.exists(result['filepath']):
+                file_path = result['filepath']
+            elif download_type == 'audio':
+                audio_ext = 'mp3' if audio_format == 'auto' else audio_format
+                file_path = os.path.join(config.DOWNLOAD_FOLDER, result['filename'].rsplit('.', 1)[0] + '.' + audio_ext)
+            else:
+                file_path = os.path.join(config.DOWNLOAD_FOLDER, result['filename'])
+            
+            # 確認檔案存在
+            if not os.path.exists(file_path):
+                # 嘗試找到下載的檔案
+                for ext in ['mp3', 'm4a', 'opus', 'mp4', 'webm', 'mkv']:
+                    test_path = file_path.rsplit('.', 1)[0] + '.' + ext
+                    if os.path.exists(test_path):
+                        file_path = test_path
+                        break
+            
+            if os.path.exists(file_path):
+                update_task(
+                    task_id,
+                    title=info.get('title', 'Unknown'),
+                    author=info.get('uploader', info.get('channel', 'Unknown')),
+                    length=info.get('duration', 0),
+                    status='completed',
+                    message='下載完成 (yt-dlp)',
+                    file_path=os.path.abspath(file_path),
+                    filename=os.path.basename(file_path),
+                    progress=100
+                )
+                cache_completed_task(task_id)
+                
+                logger.info(f'yt-dlp 下載完成: {os.path.basename(file_path)}')
+                for part_file in discard_partial(config.DOWNLOAD_FOLDER, attempted_sources):
+                    logger.info(f'刪除未完成的下載: {os.path.basename(part_file)}')
+                return
+            else:
+                raise Exception(f'檔案未找到: {file_path}')
+                
+        except Exception as ytdlp_error:
+            logger.error(f'yt-dlp 後備方案也失敗: {ytdlp_error}')
+            last_error = f'pytubefix 和 yt-dlp 都失敗: {last_error} / {ytdlp_error}'
+    
+    # 所有方法都失敗
+    update_task(
+        task_id,
+        status='error',
+        message=f'下載失敗: {last_error}'
+    )
+    logger.error(f'下載錯誤 (task_id={task_id}): {last_error}', exc_info=True)
+
+
+@bp.route('/')
+def index():
+    """首頁"""
+    return render_template('index.html')
+
+
+# 安全性 Headers
+@bp.after_app_request
+def set_security_headers(response):
+    """設定安全性 Headers"""
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['X-Frame-Options'] = 'DENY'
+    response.headers['X-XSS-Protection'] = '1; mode=block'
+    return response
+
+
+# 錯誤處理器
+@bp.app_errorhandler(404)
+def not_found(error):
+    """404 錯誤處理"""
+    return error_response('找不到資源', code='NOT_FOUND', status_code=404)
+
+
+@bp.app_errorhandler(500)
+def internal_error(error):
+    """500 錯誤處理"""
+    logger.error(f'[{g.get("request_id", "unknown")}] 伺服器錯誤: {error}', exc_info=True)
+    return error_response('伺服器內部錯誤', code='INTERNAL_ERROR', status_code=500)
+
+
+@bp.app_errorhandler(413)
+def request_entity_too_large(error):
+    """413 錯誤處理（請求實體過大）"""
+    return error_response('檔案過大', code='FILE_TOO_LARGE', status_code=413)
+
+
+@bp.app_errorhandler(429)
+def ratelimit_handler(e):
+    """速率限制錯誤處理"""
+    return error_response(
+        f'請求過於頻繁，請稍後再試',
+        code='RATE_LIMIT_EXCEEDED',
+        status_code=429,
+        details={'retry_after': e.description}
+    )
+
+
+# 健康檢查端點
+@bp.route('/health')
+def health_check():
+    """健康檢查端點"""
+    total, used, free = get_disk_space(config.DOWNLOAD_FOLDER)
+    
+    checks = {
+        'status': 'healthy',
+        'ffmpeg': check_ffmpeg_available(),
+        'disk_space_mb': free,
+        'active_tasks': sum(count for status, count in download_tasks.count_by_status().items()
+                            if status in ['downloading', 'converting'])
+    }
+    
+    # 如果 FFmpeg 不可用或磁碟空間不足，返回 503
+    status_code = 200 if checks['ffmpeg'] and free > 100 else 503
+    return jsonify(checks), status_code
+
+
+# 系統監控端點
+@bp.route('/api/metrics')
+@limiter.exempt  # 監控端點不受速率限制
+def get_metrics():
+    """獲取系統效能指標"""
+    import psutil  # 只有監控端點使用，不在啟動時導入
+    
+    try:
+        # CPU 和記憶體使用
+        process = psutil.Process()
+        memory_info = process.memory_info()
+        
+        # 磁碟空間
+        total, used, free = get_disk_space(config.DOWNLOAD_FOLDER)
+        
+        # 任務統計
+        download_queue = get_services().download_queue
+        status_counts = download_tasks.count_by_status()
+        task_stats = {
+            'total': sum(count for status, count in status_counts.items() if status != BATCH_STATUS),
+            'pending': status_counts['pending'],
+            'downloading': status_counts['downloading'],
+            'converting': status_counts['converting'],
+            'completed': status_counts['completed'],
+            'error': status_counts['error'],
+            'batches': status_counts.get(BATCH_STATUS, 0)
+        }
+        
+        metrics = {
+            'timestamp': datetime.now().isoformat(),
+            'system': {
+                'cpu_percent': psutil.cpu_percent(interval=0.1),
+                'memory_mb': memory_info.rss // (1024 * 1024),
+                'threads': threading.active_count()
+            },
+            'disk': {
+                'total_mb': total,
+                'used_mb': used,
+                'free_mb': free,
+                'usage_percent': round((used / total) * 100, 2) if total > 0 else 0
+            },
             'tasks': task_stats,
+            'result_cache': result_cache.stats(),
+            'progress_streams': progress_notifier.stats(),
+            'info_cache': info_cache.stats(),
+            'strategies': strategy_selector.snapshot(),
+            'engines': engine_registry.stats(),
+            'ytdlp_service': ytdlp_service.stats(),
+            'job_queue': download_queue.stats() if download_queue is not None else None,
+            'batch_scheduler': batch_scheduler.stats(),
+            'file_eviction': file_evictor.stats(),
+            'pipeline': {
+                'fetch': download_executor.stats(),
+                'transcode': transcode_executor.stats()
+            },
             'downloads': {
-                'folder': DOWNLOAD_FOLDER,
-                'file_count': len([f for f in os.listdir(DOWNLOAD_FOLDER) if os.path.isfile(os.path.join(DOWNLOAD_FOLDER, f))])
+                'folder': config.DOWNLOAD_FOLDER,
+                'file_count': len([f for f in os.listdir(config.DOWNLOAD_FOLDER) if os.path.isfile(os.path.join(config.DOWNLOAD_FOLDER, f))])
             }
         }
         
         return success_response(data=metrics)
         
     except Exception as e:
-        app.logger.error(f'獲取監控指標失敗: {e}', exc_info=True)
+        logger.error(f'獲取監控指標失敗: {e}', exc_info=True)
         return error_response('無法獲取系統指標', code='METRICS_ERROR', status_code=500)
 
 
-@app.route('/api/info', methods=['POST'])
-@limiter.limit("30 per minute")  # 每分鐘最多 30 次
-def get_video_info():
-    """獲取影片資訊"""
+def build_video_info(yt):
+    """
+    從 pytubefix YouTube 物件整理影片資訊
+    
+    Args:
+        yt: pytubefix YouTube 物件
+    
+    Returns:
+        dict: 影片資訊
+    """
+    # 獲取可用的畫質選項 (啟用自適應串流時包含需要合併的高畫質)
+    progressive_resolutions = {
+        s.resolution for s in yt.streams.filter(progressive=True) if s.resolution
+    }
+    adaptive_resolutions = set()
+    if config.ADAPTIVE_VIDEO_ENABLED:
+        adaptive_resolutions = {
+            s.resolution for s in yt.streams.filter(adaptive=True, only_video=True) if s.resolution
+        }
+    resolutions = sorted(progressive_resolutions | adaptive_resolutions, key=resolution_height, reverse=True)
+    
+    # 獲取音訊串流資訊
+    audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+    
+    return {
+        'title': yt.title,
+        'author': yt.author,
+        'length': yt.length,
+        'views': yt.views,
+        'thumbnail_url': yt.thumbnail_url,
+        'description': yt.description[:200] + '...' if len(yt.description) > 200 else yt.description,
+        'publish_date': str(yt.publish_date) if yt.publish_date else None,
+        'resolutions': resolutions,
+        'adaptive_resolutions': sorted(adaptive_resolutions - progressive_resolutions, key=resolution_height, reverse=True),
+        'audio_bitrate': audio_stream.abr if audio_stream else None
+    }
+
+
+def fetch_info_with_strategy(url, strategy):
+    """
+    使用單一 pytubefix 策略獲取影片資訊，並回報結果給策略選擇器
+    
+    Args:
+        url: YouTube URL
+        strategy: 策略設定
+    
+    Returns:
+        dict: 影片資訊
+    """
+    attempt_start = time.monotonic()
+    try:
+        if strategy['use_po_token']:
+            # WEB 客戶端使用自動 PoToken 生成
+            yt = engine_registry.load('pytubefix').YouTube(url, 'WEB')
+        else:
+            # IOS/ANDROID 客戶端
+            yt = engine_registry.load('pytubefix').YouTube(url, client=strategy['client'])
+        # 嘗試獲取標題來驗證連接是否成功
+        _ = yt.title
+        strategy_selector.record_success(strategy['name'], time.monotonic() - attempt_start)
+    except Exception as e:
+        error_class = strategy_selector.record_failure(
+            strategy['name'], e, time.monotonic() - attempt_start
+        )
+        logger.warning(f'{strategy["name"]} 策略獲取資訊失敗 ({error_class}): {e}')
+        raise
+    
+    logger.info(f'{strategy["name"]} 策略成功獲取影片資訊')
+    return build_video_info(yt)
+
+
+def ytdlp_resolutions(yt_info):
+    """從 yt-dlp 格式列表整理可用解析度 (未啟用自適應時只列出含音訊的格式)"""
+    heights = {
+        f['height'] for f in yt_info.get('formats') or []
+        if f.get('height') and f.get('vcodec') != 'none'
+        and (config.ADAPTIVE_VIDEO_ENABLED or f.get('acodec') != 'none')
+    }
+    if not heights:
+        return ['720p', '480p', '360p']  # yt-dlp 預設支援的解析度
+    return [f'{h}p' for h in sorted(heights, reverse=True)]
+
+
+def fetch_info_with_ytdlp(url):
+    """
+    使用 yt-dlp 獲取影片資訊 (後備方案)
+    
+    Args:
+        url: YouTube URL
+    
+    Returns:
+        dict: 影片資訊
+    """
+    logger.info('嘗試使用 yt-dlp 獲取影片資訊')
+    yt_info = ytdlp_service.extract_info(url)
+    
+    info = {
+        'title': yt_info.get('title', 'Unknown'),
+        'author': yt_info.get('uploader', yt_info.get('channel', 'Unknown')),
+        'length': yt_info.get('duration', 0),
+        'views': yt_info.get('view_count', 0),
+        'thumbnail_url': yt_info.get('thumbnail', ''),
+        'description': (yt_info.get('description', '')[:200] + '...') if len(yt_info.get('description', '')) > 200 else yt_info.get('description', ''),
+        'publish_date': yt_info.get('upload_date', None),
+        'resolutions': ytdlp_resolutions(yt_info),
+        'adaptive_resolutions': [],
+        'audio_bitrate': '128kbps'
+    }
+    
+    logger.info(f'yt-dlp 獲取影片資訊成功: {info["title"]}')
+    return info
+
+
+def fetch_video_info_hedged(attempts):
+    """
+    對沖模式：先啟動第一個策略，若在 INFO_HEDGE_DELAY 秒內沒有結果
+    (或有策略失敗) 就再啟動下一個，返回最先成功的結果，其餘結果直接捨棄
+    
+    Args:
+        attempts: [(名稱, 無參數函數)] 依優先順序排列
+    
+    Returns:
+        dict: 影片資訊
+    
+    Raises:
+        Exception: 所有策略都失敗
+    """
+    remaining = list(attempts)
+    pending = set()
+    errors = [] if attempts else ['所有客戶端策略都在冷卻中']
+    
+    def launch():
+        name, attempt = remaining.pop(0)
+        future = info_hedge_executor.submit(with_app_context(attempt))
+        future.strategy_name = name
+        pending.add(future)
+    
+    if remaining:
+        launch()
+    try:
+        while pending:
+            timeout = config.INFO_HEDGE_DELAY if remaining else None
+            done, pending = futures_wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                try:
+                    info = future.result()
+                except Exception as e:
+                    errors.append(f'{future.strategy_name}: {e}')
+                    continue
+                logger.info(f'對沖查詢由 {future.strategy_name} 勝出')
+                return info
+            
+            # 逾時未回應或有策略失敗，啟動下一個策略
+            if remaining:
+                if not done:
+                    logger.info(f'{config.INFO_HEDGE_DELAY}s 內無回應，啟動對沖策略: {remaining[0][0]}')
+                launch()
+    finally:
+        # 捨棄仍在執行的落後者 (尚未開始的會被取消)
+        for future in pending:
+            future.cancel()
+    
+    raise Exception(f'所有策略都無法獲取影片資訊: {" / ".join(errors)}')
+
+
+def fetch_video_info(url):
+    """
+    從 YouTube 獲取影片資訊 (不經過快取)
+    
+    Args:
+        url: 已驗證並清理的 YouTube URL
+    
+    Returns:
+        dict: 影片資訊
+    
+    Raises:
+        Exception: 所有策略與 yt-dlp 後備方案都失敗
+    """
+    # 嘗試多個策略以避免 403 錯誤
+    strategies = strategy_selector.ordered()
+    
+    if config.INFO_HEDGE_ENABLED:
+        attempts = [
+            (strategy['name'], functools.partial(fetch_info_with_strategy, url, strategy))
+            for strategy in strategies
+        ]
+        if YTDLP_AVAILABLE:
+            attempts.append(('yt-dlp', functools.partial(fetch_info_with_ytdlp, url)))
+        return fetch_video_info_hedged(attempts)
+    
+    last_error = None if strategies else '所有客戶端策略都在冷卻中'
+    for strategy in strategies:
+        try:
+            return fetch_info_with_strategy(url, strategy)
+        except Exception as e:
+            last_error = e
+            continue
+    
+    # pytubefix 失敗，嘗試 yt-dlp
+    if YTDLP_AVAILABLE:
+        try:
+            return fetch_info_with_ytdlp(url)
+        except Exception as ytdlp_error:
+            logger.error(f'yt-dlp 也無法獲取影片資訊: {ytdlp_error}')
+            raise Exception(f'pytubefix 和 yt-dlp 都無法獲取影片資訊: {last_error} / {ytdlp_error}')
+    
+    raise Exception(f'無法獲取影片資訊: {last_error}')
+
+
+@bp.route('/api/info', methods=['POST'])
+@limiter.limit("30 per minute")  # 每分鐘最多 30 次
+def get_video_info():
+    """獲取影片資訊"""
+    try:
+        data = request.get_json()
+        url = data.get('url')
+        
+        if not url:
+            return error_response('請提供影片網址', code='MISSING_URL', status_code=400)
+        
+        # 驗證 URL 安全性
+        try:
+            url = validate_youtube_url(url)
+            url = clean_youtube_url(url)
+        except ValueError as e:
+            return error_response(str(e), code='INVALID_URL', status_code=400)
+        
+        # 以影片 ID 查詢資訊快取，並發的相同查詢只會請求一次
+        video_id = extract_video_id(url)
+        if video_id and config.INFO_CACHE_ENABLED:
+            info = info_cache.get_or_load(video_id, lambda: fetch_video_info(url))
+        else:
+            info = fetch_video_info(url)
+        
+        logger.info(f'[{g.request_id}] 獲取影片資訊成功: {info["title"]}')
+        return success_response(data=info)
+        
+    except ValueError as e:
+        logger.warning(f'[{g.request_id}] URL 驗證失敗: {e}')
+        return error_response(str(e), code='INVALID_URL', status_code=400)
+    except Exception as e:
+        logger.error(f'[{g.request_id}] 獲取影片資訊失敗: {e}', exc_info=True)
+        return error_response('無法獲取影片資訊，請確認網址是否正確', code='INFO_FETCH_ERROR', status_code=500)
+
+
+class DownloadRequestError(ValueError):
+    """下載請求參數無效"""
+    
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+def parse_download_request(data):
+    """
+    驗證並整理下載請求參數
+    
+    Args:
+        data: 請求內容 (url, type, quality, bitrate, format)
+    
+    Returns:
+        dict: 整理後的參數 (url, type, quality, bitrate, format)
+    
+    Raises:
+        DownloadRequestError: 參數無效 (附帶錯誤代碼)
+    """
+    if not isinstance(data, dict):
+        raise DownloadRequestError('請提供影片網址', 'MISSING_URL')
+    
+    url = data.get('url')
+    download_type = data.get('type', 'video')  # video 或 audio
+    quality = data.get('quality', 'best')      # best, 1080p, 720p, 480p, 360p
+    
+    if not url:
+        raise DownloadRequestError('請提供影片網址', 'MISSING_URL')
+    
+    # 驗證 URL 安全性
+    try:
+        url = validate_youtube_url(url)
+        url = clean_youtube_url(url)
+    except ValueError as e:
+        raise DownloadRequestError(str(e), 'INVALID_URL')
+    
+    # 驗證下載類型
+    if download_type not in ['video', 'audio']:
+        raise DownloadRequestError('無效的下載類型', 'INVALID_TYPE')
+    
+    # 音訊位元率 (前端以 quality 傳送 kbps 數值，如 '320')
+    bitrate = None
+    if download_type == 'audio':
+        bitrate = data.get('bitrate')
+        if not bitrate and str(quality).isdigit():
+            bitrate = f'{quality}k'
+        # JSON 中的數值 (如 320) 視為 kbps
+        bitrate = str(bitrate or config.MP3_DEFAULT_BITRATE)
+        if bitrate.isdigit():
+            bitrate = f'{bitrate}k'
+        try:
+            bitrate = validate_bitrate(bitrate)
+        except (TypeError, ValueError) as e:
+            raise DownloadRequestError(str(e), 'INVALID_BITRATE')
+    
+    # 音訊輸出格式：mp3 (預設)、m4a、opus，或 auto (依來源編碼選擇不需重新編碼的格式)
+    output_format = 'mp4'
+    if download_type == 'audio':
+        output_format = str(data.get('format') or 'mp3').lower()
+        if output_format not in AUDIO_OUTPUT_FORMATS:
+            raise DownloadRequestError(
+                f'無效的音訊格式，可用: {", ".join(AUDIO_OUTPUT_FORMATS)}',
+                'INVALID_FORMAT'
+            )
+    
+    return {
+        'url': url,
+        'type': download_type,
+        'quality': quality,
+        'bitrate': bitrate,
+        'format': output_format,
+    }
+
+
+def create_download_task(task_id, spec, batch_id=None, message='準備下載...'):
+    """
+    建立下載任務，並檢查結果快取與進行中的相同請求
+    
+    Args:
+        task_id: 任務 ID
+        spec: parse_download_request() 的結果
+        batch_id: 所屬批次 ID
+        message: 需要派送時的初始訊息
+    
+    Returns:
+        str: 'cached' (快取命中，已完成)、'attached' (已合併到進行中的任務) 或 'new' (需要派送)
+    
+    Raises:
+        TaskStoreFullError: 任務數量已達上限
+    """
+    video_id = extract_video_id(spec['url'])
+    cache_key = make_cache_key(
+        video_id, spec['type'], spec['quality'], spec['bitrate'], spec['format']
+    ) if video_id else None
+    
+    # 初始化任務狀態
+    task = {
+        'id': task_id,
+        'url': spec['url'],
+        'type': spec['type'],
+        'quality': spec['quality'],
+        'bitrate': spec['bitrate'],
+        'output_format': spec['format'],
+        'cache_key': cache_key,
+        'status': 'pending',
+        'progress': 0,
+        'message': message,
+        'created_at': datetime.now().isoformat(),
+        'request_id': g.request_id
+    }
+    if batch_id:
+        # 派送前只存在於此行程的批次派送器中，其他請求不可跟隨 (行程重啟後不會開始下載)
+        task['batch_id'] = batch_id
+        task['awaiting_dispatch'] = True
+    download_tasks.create(task)
+    
+    # 檢查結果快取，命中則直接完成任務
+    cached = result_cache.get(cache_key) if cache_key and config.RESULT_CACHE_ENABLED else None
+    if cached:
+        file_evictor.touch(cached['file_path'])
+        update_task(
+            task_id,
+            status='completed',
+            message='下載完成 (快取)',
+            title=cached.get('title'),
+            author=cached.get('author'),
+            length=cached.get('length'),
+            file_path=cached['file_path'],
+            filename=cached['filename'],
+            progress=100,
+            cached=True
+        )
+        logger.info(f'[{g.request_id}] 結果快取命中: task_id={task_id}, key={cache_key}')
+        return 'cached'
+    
+    # 相同請求正在下載中 (包含同一批次中較早的項目)，附加到既有任務而不重複下載
+    if cache_key:
+        leader_id = attach_to_inflight(task_id, cache_key, batch_id)
+        if leader_id:
+            logger.info(f'[{g.request_id}] 合併進行中任務: task_id={task_id}, leader={leader_id}')
+            return 'attached'
+    
+    return 'new'
+
+
+def download_payload(spec):
+    """派送到下載執行器或持久化佇列的工作參數"""
+    return {
+        'url': spec['url'],
+        'type': spec['type'],
+        'quality': spec['quality'],
+        'bitrate': spec['bitrate'] or config.MP3_DEFAULT_BITRATE,
+        'format': spec['format']
+    }
+
+
+def dispatch_download(task_id, payload, block=False):
+    """
+    將下載任務排入持久化佇列 (queue 模式) 或下載執行器
+    
+    Args:
+        task_id: 任務 ID
+        payload: download_payload() 的結果
+        block: 佇列已滿時等待空位 (批次派送使用)，
+               並保留 BATCH_RESERVED_SLOTS 個等待空位給單一下載請求
+    
+    Raises:
+        QueueFullError: 佇列已滿 (block=False)
+    """
+    reserve = min(config.BATCH_RESERVED_SLOTS, max(0, config.DOWNLOAD_QUEUE_DEPTH - 1)) if block else 0
+    
+    # queue 模式：排入持久化佇列，由 worker.py 執行
+    download_queue = get_services().download_queue
+    if download_queue is not None:
+        while download_queue.stats()['queued'] + reserve >= config.DOWNLOAD_QUEUE_DEPTH:
+            if not block:
+                raise QueueFullError(f'下載佇列已滿 ({config.DOWNLOAD_QUEUE_DEPTH} 個等待中)')
+            time.sleep(config.WORKER_POLL_INTERVAL)
+        job_id = download_queue.enqueue(task_id, payload)
+        update_task(task_id, job_id=job_id, message='排隊等待下載...')
+        return
+    
+    # 排入下載執行器
+    download_executor.submit(
+        task_id,
+        with_app_context(run_download_job),
+        task_id, payload['url'], payload['type'], payload['quality'], payload['bitrate'],
+        audio_format=payload['format'],
+        adaptive=payload.get('adaptive', True),
+        block=block,
+        reserve=reserve
+    )
+
+
+def dispatch_batch_task(task_id, payload):
+    """派送批次任務 (等待下載池空位)，送出後其他請求才可跟隨此任務"""
+    dispatch_download(task_id, payload, block=True)
+    update_task(task_id, awaiting_dispatch=False)
+
+
+def fail_batch_dispatch(task_id, error):
+    """批次任務派送失敗時標記錯誤"""
+    update_task(task_id, status='error', message=f'下載失敗: {error}')
+
+
+def summarize_batch(batch):
+    """
+    彙整批次中各任務的狀態
+    
+    Returns:
+        dict: 批次 ID、各狀態數量、整體進度與各任務摘要
+    """
+    counts = {'pending': 0, 'downloading': 0, 'converting': 0, 'completed': 0, 'error': 0}
+    items = []
+    progress_total = 0.0
+    for task_id in batch.get('task_ids', []):
+        task = download_tasks.get(task_id)
+        if task is None:
+            # 任務已過期被清理
+            items.append({'task_id': task_id, 'status': 'expired'})
+            counts['error'] += 1
+            progress_total += 100
+            continue
+        counts[task['status']] = counts.get(task['status'], 0) + 1
+        progress_total += 100 if task['status'] in ('completed', 'error') else task.get('progress') or 0
+        items.append({
+            'task_id': task_id,
+            'url': task.get('url'),
+            'status': task['status'],
+            'progress': task.get('progress', 0),
+            'message': task.get('message'),
+            'title': task.get('title'),
+            'filename': task.get('filename'),
+            'queue_position': get_queue_position(task)
+        })
+    
+    total = len(items)
+    return {
+        'batch_id': batch['id'],
+        'created_at': batch.get('created_at'),
+        'total': total,
+        'counts': counts,
+        'progress': round(progress_total / total, 1) if total else 100,
+        'finished': counts['pending'] + counts['downloading'] + counts['converting'] == 0,
+        'items': items
+    }
+
+
+@bp.route('/api/download', methods=['POST'])
+@limiter.limit("10 per hour")  # 每小時最多 10 次下載
+def download_video():
+    """開始下載任務"""
     try:
-        data = request.get_json()
-        url = data.get('url')
+        try:
+            spec = parse_download_request(request.get_json())
+        except DownloadRequestError as e:
+            if e.code == 'INVALID_URL':
+                logger.warning(f'[{g.request_id}] 下載請求 URL 無效: {e}')
+            return error_response(str(e), code=e.code, status_code=400)
         
-        if not url:
-            return error_response('請提供影片網址', code='MISSING_URL', status_code=400)
+        # 建立任務 ID
+        task_id = str(uuid.uuid4())
         
-        # 驗證 URL 安全性
         try:
-            url = validate_youtube_url(url)
-            url = clean_youtube_url(url)
-        except ValueError as e:
-            return error_response(str(e), code='INVALID_URL', status_code=400)
+            state = create_download_task(task_id, spec)
+        except TaskStoreFullError as e:
+            logger.warning(f'[{g.request_id}] {e}，拒絕任務')
+            return busy_response(task_id)
         
-        # 嘗試多個策略以避免 403 錯誤
-        strategies = [
-            {'name': 'WEB + PoToken', 'client': 'WEB', 'use_po_token': True},
-            {'name': 'IOS', 'client': 'IOS', 'use_po_token': False},
-            {'name': 'ANDROID', 'client': 'ANDROID', 'use_po_token': False},
-        ]
-        last_error = None
-        yt = None
+        if state == 'cached':
+            return success_response(
+                data={'task_id': task_id, 'cached': True},
+                message='下載任務已完成 (快取)'
+            )
+        if state == 'attached':
+            return success_response(
+                data={'task_id': task_id},
+                message='下載任務已建立'
+            )
         
-        for strategy in strategies:
-            try:
-                if strategy['use_po_token']:
-                    # WEB 客戶端使用自動 PoToken 生成
-                    yt = YouTube(url, 'WEB')
-                else:
-                    # IOS/ANDROID 客戶端
-                    yt = YouTube(url, client=strategy['client'])
-                # 嘗試獲取標題來驗證連接是否成功
-                _ = yt.title
-                app.logger.info(f'{strategy["name"]} 策略成功獲取影片資訊')
-                break
-            except Exception as e:
-                last_error = e
-                app.logger.warning(f'{strategy["name"]} 策略獲取資訊失敗: {e}')
-                yt = None
-                continue
+        logger.info(f'[{g.request_id}] 建立下載任務: task_id={task_id}, type={spec["type"]}, quality={spec["quality"]}')
         
-        if yt is None:
-            # pytubefix 失敗，嘗試 yt-dlp
-            if YTDLP_AVAILABLE:
-                try:
-                    app.logger.info('嘗試使用 yt-dlp 獲取影片資訊')
-                    ydl_opts = {
-                        'quiet': True,
-                        'no_warnings': True,
-                        'skip_download': True,
-                        'http_headers': {
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        },
-                        'extractor_args': {
-                            'youtube': {
-                                'player_client': ['ios', 'android', 'web'],
-                            }
-                        },
-                    }
-                    # 添加 cookies 設定以繞過 bot 檢測
-                    if COOKIES_PATH:
-                        ydl_opts['cookiefile'] = COOKIES_PATH
-                    
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        yt_info = ydl.extract_info(url, download=False)
-                        
-                        info = {
-                            'title': yt_info.get('title', 'Unknown'),
-                            'author': yt_info.get('uploader', yt_info.get('channel', 'Unknown')),
-                            'length': yt_info.get('duration', 0),
-                            'views': yt_info.get('view_count', 0),
-                            'thumbnail_url': yt_info.get('thumbnail', ''),
-                            'description': (yt_info.get('description', '')[:200] + '...') if len(yt_info.get('description', '')) > 200 else yt_info.get('description', ''),
-                            'publish_date': yt_info.get('upload_date', None),
-                            'resolutions': ['720p', '480p', '360p'],  # yt-dlp 預設支援的解析度
-                            'audio_bitrate': '128kbps'
-                        }
-                        
-                        app.logger.info(f'[{g.request_id}] yt-dlp 獲取影片資訊成功: {info["title"]}')
-                        return success_response(data=info)
-                        
-                except Exception as ytdlp_error:
-                    app.logger.error(f'yt-dlp 也無法獲取影片資訊: {ytdlp_error}')
-                    raise Exception(f'pytubefix 和 yt-dlp 都無法獲取影片資訊: {last_error} / {ytdlp_error}')
-            else:
-                raise Exception(f'無法獲取影片資訊: {last_error}')
-        
-        # 獲取可用的畫質選項
-        video_streams = yt.streams.filter(progressive=True).order_by('resolution').desc()
-        resolutions = []
-        seen = set()
-        for stream in video_streams:
-            if stream.resolution and stream.resolution not in seen:
-                resolutions.append(stream.resolution)
-                seen.add(stream.resolution)
-        
-        # 獲取音訊串流資訊
-        audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-        
-        info = {
-            'title': yt.title,
-            'author': yt.author,
-            'length': yt.length,
-            'views': yt.views,
-            'thumbnail_url': yt.thumbnail_url,
-            'description': yt.description[:200] + '...' if len(yt.description) > 200 else yt.description,
-            'publish_date': str(yt.publish_date) if yt.publish_date else None,
-            'resolutions': resolutions,
-            'audio_bitrate': audio_stream.abr if audio_stream else None
-        }
+        try:
+            dispatch_download(task_id, download_payload(spec))
+        except QueueFullError as e:
+            logger.warning(f'[{g.request_id}] {e}，拒絕任務: task_id={task_id}')
+            return busy_response(task_id)
         
-        app.logger.info(f'[{g.request_id}] 獲取影片資訊成功: {yt.title}')
-        return success_response(data=info)
+        return success_response(
+            data={'task_id': task_id},
+            message='下載任務已建立'
+        )
         
-    except ValueError as e:
-        app.logger.warning(f'[{g.request_id}] URL 驗證失敗: {e}')
-        return error_response(str(e), code='INVALID_URL', status_code=400)
     except Exception as e:
-        app.logger.error(f'[{g.request_id}] 獲取影片資訊失敗: {e}', exc_info=True)
-        return error_response('無法獲取影片資訊，請確認網址是否正確', code='INFO_FETCH_ERROR', status_code=500)
+        logger.error(f'[{g.request_id}] 建立下載任務失敗: {e}', exc_info=True)
+        return error_response('建立下載任務失敗', code='TASK_CREATE_ERROR', status_code=500)
 
 
-@app.route('/api/download', methods=['POST'])
-@limiter.limit("10 per hour")  # 每小時最多 10 次下載
-def download_video():
-    """開始下載任務"""
+def abort_batch(batch_id, task_ids):
+    """建立批次失敗時，將已建立的任務標記為失敗並刪除批次記錄"""
+    for task_id in task_ids:
+        try:
+            update_task(task_id, status='error', message='建立批次失敗')
+        except Exception as e:
+            logger.error(f'標記批次任務失敗時發生錯誤 (task_id={task_id}): {e}')
     try:
-        data = request.get_json()
-        url = data.get('url')
-        download_type = data.get('type', 'video')  # video 或 audio
-        quality = data.get('quality', 'best')      # best, 1080p, 720p, 480p, 360p
-        
-        if not url:
-            return error_response('請提供影片網址', code='MISSING_URL', status_code=400)
+        download_tasks.delete(batch_id)
+    except Exception as e:
+        logger.error(f'刪除批次記錄失敗 (batch_id={batch_id}): {e}')
+
+
+@bp.route('/api/batch', methods=['POST'])
+@limiter.limit("10 per hour")  # 每小時最多 10 個批次
+def create_batch():
+    """
+    建立批次下載
+    
+    請求內容:
+        items: URL 字串或 {url, type, quality, bitrate, format} 的列表
+        type / quality / bitrate / format: 各項目未指定時的預設值
+    
+    相同的項目 (或與進行中的下載相同) 會合併為同一個下載；
+    需要下載的任務交給批次派送器，在下載池有空位時與其他批次輪流送出。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return error_response('請提供下載項目列表 (items)', code='MISSING_ITEMS', status_code=400)
+        if len(items) > config.BATCH_MAX_ITEMS:
+            return error_response(
+                f'單一批次最多 {config.BATCH_MAX_ITEMS} 個項目',
+                code='BATCH_TOO_LARGE',
+                status_code=400
+            )
         
-        # 驗證 URL 安全性
+        defaults = {key: data[key] for key in ('type', 'quality', 'bitrate', 'format') if key in data}
+        batch_id = str(uuid.uuid4())
         try:
-            url = validate_youtube_url(url)
-            url = clean_youtube_url(url)
-        except ValueError as e:
-            app.logger.warning(f'[{g.request_id}] 下載請求 URL 無效: {e}')
-            return error_response(str(e), code='INVALID_URL', status_code=400)
-        
-        # 驗證下載類型
-        if download_type not in ['video', 'audio']:
-            return error_response('無效的下載類型', code='INVALID_TYPE', status_code=400)
+            download_tasks.create({
+                'id': batch_id,
+                'type': 'batch',
+                'status': BATCH_STATUS,
+                'task_ids': [],
+                'created_at': datetime.now().isoformat(),
+                'request_id': g.request_id
+            })
+        except TaskStoreFullError as e:
+            logger.warning(f'[{g.request_id}] {e}，拒絕批次')
+            body, status_code = error_response(
+                '伺服器忙碌中，請稍後再試',
+                code='QUEUE_FULL',
+                status_code=503,
+                details={'retry_after': config.DOWNLOAD_RETRY_AFTER}
+            )
+            return body, status_code, {'Retry-After': str(config.DOWNLOAD_RETRY_AFTER)}
         
-        # 建立任務 ID
-        task_id = str(uuid.uuid4())
-        
-        # 初始化任務狀態
-        download_tasks[task_id] = {
-            'id': task_id,
-            'url': url,
-            'type': download_type,
-            'quality': quality,
-            'status': 'pending',
-            'progress': 0,
-            'message': '準備下載...',
-            'created_at': datetime.now().isoformat(),
-            'request_id': g.request_id
-        }
+        results = []
+        pending = []
+        created = []
+        try:
+            for index, item in enumerate(items):
+                if isinstance(item, str):
+                    item = {'url': item}
+                try:
+                    spec = parse_download_request({**defaults, **item} if isinstance(item, dict) else None)
+                except DownloadRequestError as e:
+                    results.append({'index': index, 'error': {'code': e.code, 'message': str(e)}})
+                    continue
+                
+                task_id = str(uuid.uuid4())
+                try:
+                    state = create_download_task(task_id, spec, batch_id=batch_id, message='批次排隊中...')
+                except TaskStoreFullError:
+                    results.append({'index': index, 'error': {'code': 'QUEUE_FULL', 'message': '伺服器忙碌中，請稍後再試'}})
+                    continue
+                created.append(task_id)
+                
+                results.append({'index': index, 'task_id': task_id, 'url': spec['url'], 'state': state})
+                if state == 'new':
+                    pending.append((task_id, download_payload(spec)))
+            
+            task_ids = [result['task_id'] for result in results if 'task_id' in result]
+            if task_ids:
+                download_tasks.update(batch_id, {'task_ids': task_ids})
+        except Exception:
+            # 全部成功或全部放棄：已建立的任務尚未派送，標記失敗以免成為永遠不會開始的主任務
+            abort_batch(batch_id, created)
+            raise
         
-        app.logger.info(f'[{g.request_id}] 建立下載任務: task_id={task_id}, type={download_type}, quality={quality}')
+        if not task_ids:
+            download_tasks.delete(batch_id)
+            return error_response(
+                '沒有可建立的下載項目',
+                code='INVALID_ITEMS',
+                status_code=400,
+                details={'items': results}
+            )
         
-        # 啟動背景執行緒
-        thread = threading.Thread(
-            target=download_video_thread,
-            args=(task_id, url, download_type, quality)
+        batch_scheduler.add(batch_id, pending)
+        logger.info(
+            f'[{g.request_id}] 建立批次: batch_id={batch_id}, 任務={len(task_ids)}, '
+            f'需下載={len(pending)}, 無效={len(results) - len(task_ids)}'
         )
-        thread.daemon = True
-        thread.start()
         
         return success_response(
-            data={'task_id': task_id},
-            message='下載任務已建立'
+            data={
+                'batch_id': batch_id,
+                'items': results,
+                'progress': summarize_batch(download_tasks.get(batch_id))
+            },
+            message=f'批次已建立 ({len(task_ids)} 個任務)'
         )
         
     except Exception as e:
-        app.logger.error(f'[{g.request_id}] 建立下載任務失敗: {e}', exc_info=True)
-        return error_response('建立下載任務失敗', code='TASK_CREATE_ERROR', status_code=500)
+        logger.error(f'[{g.request_id}] 建立批次失敗: {e}', exc_info=True)
+        return error_response('建立批次失敗', code='BATCH_CREATE_ERROR', status_code=500)
+
+
+@bp.route('/api/batch/<batch_id>')
+@limiter.limit("60 per minute")
+def get_batch(batch_id):
+    """獲取批次整體進度與各任務狀態"""
+    try:
+        uuid.UUID(batch_id)
+    except ValueError:
+        return error_response('無效的批次 ID', code='INVALID_BATCH_ID', status_code=400)
+    
+    batch = download_tasks.get(batch_id)
+    if batch is None or batch.get('status') != BATCH_STATUS:
+        return error_response('批次不存在', code='BATCH_NOT_FOUND', status_code=404)
+    
+    return success_response(data=summarize_batch(batch))
 
 
-@app.route('/api/progress/<task_id>')
+@bp.route('/api/progress/<task_id>')
 @limiter.limit("60 per minute")  # 輪詢進度每分鐘最多 60 次
 def get_progress(task_id):
     """獲取下載進度"""
@@ -872,138 +2258,602 @@ def get_progress(task_id):
     except ValueError:
         return error_response('無效的任務 ID', code='INVALID_TASK_ID', status_code=400)
     
-    if task_id not in download_tasks:
+    task = load_progress(task_id)
+    if task is None:
         return error_response('任務不存在', code='TASK_NOT_FOUND', status_code=404)
     
-    task = download_tasks[task_id]
     return success_response(data=task)
 
 
-@app.route('/api/file/<task_id>')
-def download_file(task_id):
-    """下載檔案"""
-    app.logger.info(f'下載請求: task_id={task_id}')
+@bp.route('/api/progress/<task_id>/stream')
+@limiter.limit("30 per minute")
+def stream_progress(task_id):
+    """
+    以 Server-Sent Events 推送下載進度
     
-    # 驗證 task_id 格式
+    只在任務狀態或進度變化時送出事件，任務完成或失敗後關閉串流；
+    超過 SSE_MAX_DURATION 後結束連線，由瀏覽器依 retry 自動重新連線。
+    任務狀態由每個行程共用的 progress_notifier 推送，串流不各自輪詢任務儲存；
+    每個 worker 最多同時 SSE_MAX_STREAMS 個串流 (gunicorn 另受 stream_threads 限制)，超過時回應 503，前端改用輪詢
+    """
     try:
         uuid.UUID(task_id)
     except ValueError:
-        app.logger.warning(f'無效的任務 ID: {task_id}')
-        return jsonify({'error': '無效的任務 ID'}), 400
+        return error_response('無效的任務 ID', code='INVALID_TASK_ID', status_code=400)
     
     if task_id not in download_tasks:
-        app.logger.warning(f'任務不存在: {task_id}')
-        return jsonify({'error': '任務不存在'}), 404
+        return error_response('任務不存在', code='TASK_NOT_FOUND', status_code=404)
+    
+    # WSGI 伺服器的每個串流佔用一個執行緒，保留執行緒給其他請求
+    stream_threads = get_services().stream_threads
+    subscription = None
+    if stream_threads is None or stream_threads.acquire(blocking=False):
+        subscription = progress_notifier.subscribe(task_id)
+        if subscription is None and stream_threads is not None:
+            stream_threads.release()
+    if subscription is None:
+        body, status_code = error_response(
+            '進度串流已達上限，請改用輪詢',
+            code='SSE_UNAVAILABLE',
+            status_code=503
+        )
+        return body, status_code, {'Retry-After': str(config.DOWNLOAD_RETRY_AFTER)}
+    
+    def generate():
+        yield 'retry: 1000\n\n'
+        last_sent = time.monotonic()
+        deadline = last_sent + config.SSE_MAX_DURATION
+        
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            try:
+                task = subscription.get(timeout=min(
+                    deadline - now,
+                    max(0.0, last_sent + config.SSE_KEEPALIVE_SECONDS - now)
+                ))
+            except TimeoutError:
+                if time.monotonic() - last_sent >= config.SSE_KEEPALIVE_SECONDS:
+                    # 註解行，維持連線不被代理伺服器中斷
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                continue
+            
+            if task is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            yield f'data: {json.dumps(task, ensure_ascii=False, sort_keys=True)}\n\n'
+            last_sent = time.monotonic()
+            if task['status'] in ('completed', 'error'):
+                return
+    
+    def close():
+        subscription.close()
+        if stream_threads is not None:
+            stream_threads.release()
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 停用 nginx 緩衝
+        }
+    )
+    # 回應結束 (包含用戶端中斷) 時取消訂閱並歸還名額
+    response.call_on_close(close)
+    return response
+
+
+class FileLookupError(Exception):
+    """任務檔案無法下載 (附 HTTP 狀態碼與回應內容)"""
     
-    task = download_tasks[task_id]
+    def __init__(self, message, status_code, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body or {'error': message}
+
+
+def locate_task_file(task_id):
+    """
+    驗證任務並找出可下載的檔案 (/api/file 與 ASGI 版本共用)
+    
+    Returns:
+        tuple: (任務, 檔案路徑, 檔案大小)
+    
+    Raises:
+        FileLookupError: 任務 ID 無效、未完成、檔案不存在、不安全或過大
+    """
+    # 驗證 task_id 格式
+    try:
+        uuid.UUID(task_id)
+    except ValueError:
+        logger.warning(f'無效的任務 ID: {task_id}')
+        raise FileLookupError('無效的任務 ID', 400)
+    
+    task = download_tasks.get(task_id)
+    if task is None:
+        logger.warning(f'任務不存在: {task_id}')
+        raise FileLookupError('任務不存在', 404)
     
     if task['status'] != 'completed':
-        app.logger.warning(f'下載未完成: task_id={task_id}, status={task["status"]}')
-        return jsonify({'error': f'下載未完成 (狀態: {task["status"]})', 'status': task['status']}), 400
+        logger.warning(f'下載未完成: task_id={task_id}, status={task["status"]}')
+        message = f'下載未完成 (狀態: {task["status"]})'
+        raise FileLookupError(message, 400, {'error': message, 'status': task['status']})
     
     file_path = task.get('file_path')
     
     if not file_path:
-        app.logger.error(f'檔案路徑為空: task_id={task_id}')
-        return jsonify({'error': '檔案路徑不存在'}), 404
+        logger.error(f'檔案路徑為空: task_id={task_id}')
+        raise FileLookupError('檔案路徑不存在', 404)
     
     # 驗證檔案路徑安全性
-    if not validate_file_path(file_path, DOWNLOAD_FOLDER):
-        app.logger.error(f'檔案路徑不安全: {file_path}')
-        return jsonify({'error': '檔案路徑不安全'}), 403
+    if not validate_file_path(file_path, config.DOWNLOAD_FOLDER):
+        logger.error(f'檔案路徑不安全: {file_path}')
+        raise FileLookupError('檔案路徑不安全', 403)
     
     if not os.path.exists(file_path):
-        app.logger.error(f'檔案不存在: {file_path}')
-        return jsonify({'error': f'檔案不存在'}), 404
+        logger.error(f'檔案不存在: {file_path}')
+        raise FileLookupError('檔案不存在', 404)
     
     # 檢查檔案大小
     file_size = os.path.getsize(file_path)
     if file_size > config.MAX_FILE_SIZE:
-        app.logger.warning(f'檔案過大: {format_file_size(file_size)}')
-        return jsonify({'error': '檔案過大，無法下載'}), 413
+        logger.warning(f'檔案過大: {format_file_size(file_size)}')
+        raise FileLookupError('檔案過大，無法下載', 413)
+    
+    return task, file_path, file_size
+
+
+def fallback_download_name(task_id: str, filename: str) -> str:
+    """非 ASCII 檔名的 ASCII 替代檔名 (任務 ID 加副檔名)"""
+    return task_id + os.path.splitext(filename)[1]
+
+
+@bp.route('/api/file/<task_id>')
+def download_file(task_id):
+    """下載檔案"""
+    logger.info(f'下載請求: task_id={task_id}')
+    
+    try:
+        task, file_path, file_size = locate_task_file(task_id)
+    except FileLookupError as e:
+        return jsonify(e.body), e.status_code
     
-    app.logger.info(f'開始傳送檔案: {task["filename"]} ({format_file_size(file_size)})')
+    delivery_mode = get_services().delivery_mode
+    logger.info(f'開始傳送檔案: {task["filename"]} ({format_file_size(file_size)}, {delivery_mode})')
     
+    # 傳送期間釘選檔案，容量清理不會刪除 (前端代理傳送時只記錄存取時間)
+    pin = file_evictor.pin(file_path)
     try:
-        return send_file(
+        # 支援 Range 續傳；x-accel-redirect / x-sendfile 模式由前端代理傳送檔案內容
+        return send_download(
             file_path,
-            as_attachment=True,
-            download_name=task['filename']
+            task['filename'],
+            mode=delivery_mode,
+            base_folder=config.DOWNLOAD_FOLDER,
+            accel_prefix=config.X_ACCEL_REDIRECT_PREFIX,
+            on_close=pin.release,
+            fallback_name=fallback_download_name(task_id, task['filename'])
         )
     except Exception as e:
-        app.logger.error(f'傳送檔案失敗: {e}', exc_info=True)
+        pin.release()
+        logger.error(f'傳送檔案失敗: {e}', exc_info=True)
         return jsonify({'error': '傳送檔案失敗'}), 500
 
 
-def cleanup_old_files():
-    """清理超過指定時間的檔案"""
-    try:
-        now = datetime.now()
-        cleanup_count = 0
+def collect_archive_entries(task_ids):
+    """
+    整理可打包的已完成任務檔案
+    
+    Args:
+        task_ids: 任務 ID 列表
+    
+    Returns:
+        tuple: ((壓縮檔內名稱, 檔案路徑) 列表, 略過的任務 [{task_id, reason}])
+    """
+    files = []
+    skipped = []
+    seen_paths = set()
+    for task_id in task_ids:
+        task = download_tasks.get(task_id)
+        if task is None:
+            skipped.append({'task_id': task_id, 'reason': '任務不存在'})
+            continue
+        if task['status'] != 'completed':
+            skipped.append({'task_id': task_id, 'reason': f'下載未完成 (狀態: {task["status"]})'})
+            continue
         
-        for filename in os.listdir(DOWNLOAD_FOLDER):
-            try:
-                file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-                if not os.path.isfile(file_path):
-                    continue
-                
-                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if now - file_time > timedelta(hours=config.FILE_CLEANUP_HOURS):
-                    os.remove(file_path)
-                    cleanup_count += 1
-                    app.logger.info(f'清理舊檔案: {filename}')
-            except OSError as e:
-                app.logger.warning(f'無法刪除檔案 {filename}: {e}')
-                continue
+        file_path = task.get('file_path')
+        if not file_path or not validate_file_path(file_path, config.DOWNLOAD_FOLDER) or not os.path.isfile(file_path):
+            skipped.append({'task_id': task_id, 'reason': '檔案不存在'})
+            continue
         
-        if cleanup_count > 0:
-            app.logger.info(f'清理完成，刪除 {cleanup_count} 個檔案')
-            
-    except Exception as e:
-        app.logger.error(f'清理過程發生錯誤: {e}', exc_info=True)
+        # 合併的請求指向同一個檔案，只打包一次
+        if file_path in seen_paths:
+            continue
+        seen_paths.add(file_path)
+        files.append((task.get('filename') or os.path.basename(file_path), file_path))
+    
+    names = unique_names(name for name, _ in files)
+    return [(name, path) for name, (_, path) in zip(names, files)], skipped
+
+
+def archive_response(task_ids, archive_name):
+    """
+    以串流 ZIP (不壓縮) 傳送多個已完成任務的檔案
+    
+    Args:
+        task_ids: 任務 ID 列表
+        archive_name: 下載的壓縮檔名稱
+    """
+    entries, skipped = collect_archive_entries(task_ids)
+    if not entries:
+        return error_response(
+            '沒有可下載的檔案',
+            code='NO_COMPLETED_FILES',
+            status_code=404,
+            details={'skipped': skipped}
+        )
+    
+    total_size = sum(os.path.getsize(path) for _, path in entries)
+    if total_size > config.ARCHIVE_MAX_SIZE:
+        return error_response(
+            f'檔案總大小 {format_file_size(total_size)} 超過上限',
+            code='ARCHIVE_TOO_LARGE',
+            status_code=413
+        )
+    
+    logger.info(
+        f'[{g.request_id}] 開始傳送壓縮檔: {archive_name} '
+        f'({len(entries)} 個檔案, {format_file_size(total_size)}, 略過 {len(skipped)} 個)'
+    )
+    
+    def generate():
+        try:
+            yield from iter_zip(entries)
+        except OSError as e:
+            # 回應已開始傳送，只能中斷連線；重新拋出讓伺服器直接關閉連線，
+            # 用戶端不會把缺少中央目錄的壓縮檔當成完整下載
+            logger.error(f'壓縮檔傳送中斷: {e}')
+            raise
+    
+    # 打包期間釘選所有檔案，容量清理不會刪除
+    pins = [file_evictor.pin(path) for _, path in entries]
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{archive_name}"',
+            'X-Archive-Files': str(len(entries)),
+            'X-Archive-Skipped': str(len(skipped)),
+            'Cache-Control': 'no-cache'
+        }
+    )
+    for pin in pins:
+        response.call_on_close(pin.release)
+    return response
+
+
+@bp.route('/api/archive')
+@limiter.limit("30 per minute")
+def download_archive():
+    """將多個已完成任務的檔案打包為 ZIP 下載 (?tasks=id1,id2,...)"""
+    task_ids = [task_id.strip() for task_id in request.args.get('tasks', '').split(',') if task_id.strip()]
+    if not task_ids:
+        return error_response('請提供任務 ID (tasks)', code='MISSING_TASKS', status_code=400)
+    if len(task_ids) > config.BATCH_MAX_ITEMS:
+        return error_response(
+            f'單一壓縮檔最多 {config.BATCH_MAX_ITEMS} 個任務',
+            code='TOO_MANY_TASKS',
+            status_code=400
+        )
+    for task_id in task_ids:
+        try:
+            uuid.UUID(task_id)
+        except ValueError:
+            return error_response('無效的任務 ID', code='INVALID_TASK_ID', status_code=400)
+    
+    return archive_response(list(dict.fromkeys(task_ids)), 'downloads.zip')
+
+
+@bp.route('/api/batch/<batch_id>/archive')
+@limiter.limit("30 per minute")
+def download_batch_archive(batch_id):
+    """將批次中已完成的檔案打包為 ZIP 下載"""
+    try:
+        uuid.UUID(batch_id)
+    except ValueError:
+        return error_response('無效的批次 ID', code='INVALID_BATCH_ID', status_code=400)
+    
+    batch = download_tasks.get(batch_id)
+    if batch is None or batch.get('status') != BATCH_STATUS:
+        return error_response('批次不存在', code='BATCH_NOT_FOUND', status_code=404)
+    
+    return archive_response(batch.get('task_ids', []), f'batch-{batch_id[:8]}.zip')
 
 
 def cleanup_old_tasks():
     """清理過期的任務記錄"""
     try:
-        now = datetime.now()
-        expired_tasks = []
-        
-        for task_id, task in list(download_tasks.items()):
-            # 解析任務創建時間
-            created_at = datetime.fromisoformat(task['created_at'])
-            # 任務超過 2 小時就清理
-            if now - created_at > timedelta(hours=2):
-                expired_tasks.append(task_id)
+        # 任務超過 2 小時就清理
+        cutoff = (datetime.now() - timedelta(hours=2)).timestamp()
+        expired_tasks = download_tasks.delete_created_before(cutoff)
         
         for task_id in expired_tasks:
-            del download_tasks[task_id]
-            app.logger.info(f'清理過期任務: {task_id}')
+            logger.info(f'清理過期任務: {task_id}')
         
         if expired_tasks:
-            app.logger.info(f'清理 {len(expired_tasks)} 個過期任務')
+            logger.info(f'清理 {len(expired_tasks)} 個過期任務')
             
     except Exception as e:
-        app.logger.error(f'清理任務時發生錯誤: {e}', exc_info=True)
+        logger.error(f'清理任務時發生錯誤: {e}', exc_info=True)
+
 
+# 定期清理任務記錄的間隔 (秒)
+TASK_CLEANUP_INTERVAL = 3600
 
-# 啟動時清理舊檔案
-cleanup_old_files()
 
-# 定期清理 (每小時)
 def periodic_cleanup():
-    import time
+    """定期清理任務記錄與資訊快取 (每小時)"""
     while True:
-        time.sleep(3600)  # 1 小時
-        cleanup_old_files()
-        cleanup_old_tasks()
+        time.sleep(TASK_CLEANUP_INTERVAL)
+        info_cache.purge_expired()  # 各行程各自的快取
+        
+        # SQLite 任務儲存由所有 worker 共用，只由當選的清理行程處理
+        if config.TASK_STORE_BACKEND != 'sqlite' or cleaner_lock.acquire():
+            cleanup_old_tasks()
+
+
+class AppServices:
+    """
+    一個應用程式的設定與服務 (由 create_app() 建立，存放於 app.extensions['ymp3'])
+    
+    建立時不啟動執行緒，背景服務由 start_services() 在各行程中啟動
+    """
+    
+    def __init__(self, app, config, async_transcode=False):
+        self.config = config
+        
+        # 檔案傳送模式 (x-accel-redirect / x-sendfile 需要前端代理配合設定；未知的模式改用 app)
+        self.delivery_mode = config.FILE_DELIVERY_MODE if config.FILE_DELIVERY_MODE in DELIVERY_MODES else DELIVERY_APP
+        
+        # 儲存下載任務狀態 (SQLite 後端可讓多個 gunicorn worker 共用)
+        self.download_tasks = create_task_store(
+            config.TASK_STORE_BACKEND,
+            config.TASK_STORE_PATH,
+            max_tasks=config.TASK_STORE_MAX_TASKS
+        )
+        
+        # 進度串流 (SSE)：通知執行緒讀取被訂閱的任務並推送給所有串流，同時訂閱數上限為 SSE_MAX_STREAMS
+        self.progress_notifier = ProgressNotifier(
+            with_app_context(load_progress, app),
+            poll_interval=config.SSE_POLL_INTERVAL,
+            max_subscriptions=config.SSE_MAX_STREAMS
+        )
+        # WSGI 伺服器的串流執行緒名額 (由 limit_stream_threads() 依伺服器執行緒數設定，None = 不限制)
+        self.stream_threads = None
+        
+        # 下載管線：下載 (網路) 與轉換 (CPU) 兩個階段各自使用獨立的執行緒池
+        # 下載階段 (thread 模式的入口)：執行緒數即並發下載上限 (MAX_CONCURRENT_DOWNLOADS)，等待佇列有上限，佇列已滿時拒絕新任務
+        self.download_executor = BoundedExecutor(
+            max_workers=config.MAX_CONCURRENT_DOWNLOADS,
+            max_queue=config.DOWNLOAD_QUEUE_DEPTH,
+            thread_name_prefix='fetch'
+        )
+        
+        # 轉換階段：下載完成的檔案經由有上限的交接佇列排入，佇列已滿時下載階段會等待 (背壓)
+        # 非同步模式在專用事件迴圈上以 asyncio 子行程執行 FFmpeg，等待轉換不佔用執行緒
+        executor_class = AsyncBoundedExecutor if async_transcode else BoundedExecutor
+        self.transcode_executor = executor_class(
+            max_workers=config.TRANSCODE_WORKERS or os.cpu_count() or 1,
+            max_queue=config.TRANSCODE_QUEUE_DEPTH,
+            thread_name_prefix='transcode'
+        )
+        
+        # 下載目錄容量管理 (超過水位時依最近存取時間刪除檔案)
+        self.file_evictor = EvictionManager(
+            config.DOWNLOAD_FOLDER,
+            max_bytes=config.DOWNLOAD_FOLDER_MAX_MB * 1024 * 1024,
+            high_watermark=config.EVICTION_HIGH_WATERMARK,
+            low_watermark=config.EVICTION_LOW_WATERMARK,
+            min_free_bytes=config.EVICTION_MIN_FREE_MB * 1024 * 1024,
+            min_age=config.EVICTION_MIN_AGE,
+            max_idle=config.FILE_CLEANUP_HOURS * 3600,
+            poll_interval=config.EVICTION_CHECK_INTERVAL
+        )
+        
+        # 已完成下載的結果快取
+        self.result_cache = ResultCache(
+            config.DOWNLOAD_FOLDER,
+            max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+            loader=with_app_context(load_completed_result, app)
+        )
+        
+        # 持久化下載工作佇列 (queue 模式下由 worker.py 執行下載)
+        self.download_queue = None
+        if config.TASK_EXECUTION_MODE == 'queue':
+            if config.TASK_STORE_BACKEND == 'sqlite':
+                self.download_queue = JobQueue(config.JOB_QUEUE_PATH, max_attempts=config.JOB_MAX_ATTEMPTS)
+        
+        # 影片資訊快取 (/api/info)
+        self.info_cache = MetadataCache(max_entries=config.INFO_CACHE_MAX_ENTRIES, ttl=config.INFO_CACHE_TTL)
+        
+        # 對沖查詢使用的執行緒池 (被捨棄的落後者會在此執行完畢)
+        self.info_hedge_executor = ThreadPoolExecutor(
+            max_workers=config.INFO_HEDGE_MAX_WORKERS,
+            thread_name_prefix='info-hedge'
+        )
+        
+        # yt-dlp 輔助行程池 (第一次使用時啟動，web worker 不導入 yt-dlp)
+        self.ytdlp_service = YtdlpService(
+            helpers=config.YTDLP_HELPERS,
+            defaults=functools.partial(ytdlp_defaults, config.DOWNLOAD_FOLDER),
+            timeout=config.YTDLP_HELPER_TIMEOUT,
+            max_jobs=config.YTDLP_HELPER_MAX_JOBS,
+            idle_timeout=config.YTDLP_HELPER_IDLE_TIMEOUT,
+            enabled=config.YTDLP_HELPER_ENABLED,
+            info_helpers=config.YTDLP_INFO_HELPERS,
+            info_timeout=config.YTDLP_INFO_TIMEOUT,
+            info_acquire_timeout=config.YTDLP_INFO_ACQUIRE_TIMEOUT
+        )
+        
+        # 批次派送器：批次任務在下載池有空位時才送出，多個批次輪流派送
+        self.batch_scheduler = BatchScheduler(
+            dispatch=with_app_context(dispatch_batch_task, app),
+            on_error=with_app_context(fail_batch_dispatch, app)
+        )
+        
+        # 多個 worker 之間選出一個行程負責定期清理 (下載目錄與共用的任務儲存)
+        self.cleaner_lock = LeaderLock(os.path.join(config.DOWNLOAD_FOLDER, '.cleaner.lock'), name='清理行程')
+        
+        # 已啟動背景服務的行程
+        self.started_pid = None
+        self.start_lock = threading.Lock()
+
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init_process():
+    """
+    每個行程一次的初始化 (重複呼叫無作用)
+    
+    輸出下載引擎狀態並載入 cookies；不啟動任何執行緒，可在 gunicorn --preload 的主行程中執行
+    """
+    global COOKIES_PATH, _initialized
+    if _initialized:
+        return
+    
+    with _init_lock:
+        if _initialized:
+            return
+        
+        if YTDLP_AVAILABLE:
+            print('✅ yt-dlp 可用作為後備下載引擎')
+        else:
+            print('⚠️ yt-dlp 不可用，僅使用 pytubefix')
+        
+        COOKIES_PATH = get_cookies_path()
+        _initialized = True
+
+
+def start_services(app=None):
+    """
+    啟動應用程式在此行程的背景服務 (每個行程一次，重複呼叫無作用)
+    
+    gunicorn 由 gunicorn.conf.py 的 post_worker_init 在 worker 載入應用程式後呼叫，
+    不會有執行緒留在主行程；開發伺服器與其他入口則由第一個請求觸發。容量管理執行緒在超過水位時立即清理，
+    定期檢查 (含啟動時的第一次清理) 只由當選的清理行程執行
+    
+    Args:
+        app: 應用程式 (預設為目前的應用程式)
+    """
+    app = app or current_application()
+    services = app.extensions[EXTENSION_NAME]
+    if services.started_pid == os.getpid():
+        return
+    
+    with services.start_lock:
+        if services.started_pid == os.getpid():
+            return
+        
+        services.file_evictor.start(elected=services.cleaner_lock.acquire)
+        services.progress_notifier.start()
+        threading.Thread(
+            target=with_app_context(periodic_cleanup, app),
+            name='periodic-cleanup',
+            daemon=True
+        ).start()
+        services.started_pid = os.getpid()
+
+
+def limit_stream_threads(app, threads):
+    """
+    限制 WSGI 伺服器的進度串流佔用的執行緒數
+    
+    gunicorn 的每個串流在回應結束前佔用一個執行緒，最多使用一半的執行緒 (至少一個)，
+    其餘留給其他請求；ASGI 入口以協程推送，只受 SSE_MAX_STREAMS 限制
+    
+    Args:
+        app: 應用程式
+        threads: 伺服器每個 worker 的執行緒數
+    """
+    services = app.extensions[EXTENSION_NAME]
+    services.stream_threads = threading.BoundedSemaphore(max(1, threads // 2))
 
-cleanup_thread = threading.Thread(target=periodic_cleanup)
-cleanup_thread.daemon = True
-cleanup_thread.start()
+
+def create_app(config_object=None, async_transcode=None):
+    """
+    應用程式工廠 (gunicorn 'app_pytubefix:create_app()')
+    
+    每次呼叫建立新的應用程式與其服務 (任務儲存、執行緒池、容量管理、批次派送器等，
+    存放於 app.extensions['ymp3'])。導入本模組不會寫入檔案、輸出訊息或啟動執行緒，
+    建立應用程式也不啟動執行緒；背景服務由 start_services() 啟動
+    
+    Args:
+        config_object: 設定類別或實例 (如 TestingConfig)，預設依 FLASK_ENV 選擇
+        async_transcode: 轉換階段是否使用 asyncio 子行程 (asgi.py 使用)，
+                         None 則依 TRANSCODE_ASYNC 設定
+    
+    Returns:
+        Flask: 應用程式
+    """
+    global _default_app
+    if config_object is None:
+        config_object = get_config()
+    elif isinstance(config_object, type):
+        config_object = config_object()
+    
+    init_process()
+    
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.config['MAX_CONTENT_LENGTH'] = config_object.MAX_FILE_SIZE
+    app.config['RATELIMIT_ENABLED'] = getattr(config_object, 'RATE_LIMIT_ENABLED', True)
+    # 429 回應附 Retry-After 與 X-RateLimit-* 標頭
+    app.config['RATELIMIT_HEADERS_ENABLED'] = True
+    
+    CORS(app)
+    limiter.init_app(app)
+    app.register_blueprint(bp)
+    
+    print(f'📁 下載目錄: {config_object.DOWNLOAD_FOLDER}')
+    if not os.path.exists(config_object.DOWNLOAD_FOLDER):
+        os.makedirs(config_object.DOWNLOAD_FOLDER, exist_ok=True)
+        print(f'✅ 創建下載目錄: {config_object.DOWNLOAD_FOLDER}')
+    else:
+        print(f'✅ 下載目錄已存在: {config_object.DOWNLOAD_FOLDER}')
+    
+    if async_transcode is None:
+        async_transcode = config_object.TRANSCODE_ASYNC
+    services = AppServices(app, config_object, async_transcode)
+    app.extensions[EXTENSION_NAME] = services
+    
+    if config_object.FILE_DELIVERY_MODE not in DELIVERY_MODES:
+        print(f'⚠️ 未知的 FILE_DELIVERY_MODE: {config_object.FILE_DELIVERY_MODE}，改用 {DELIVERY_APP}')
+    elif services.delivery_mode != DELIVERY_APP:
+        print(f'📤 檔案由前端代理傳送: {services.delivery_mode}')
+    
+    if config_object.TASK_EXECUTION_MODE == 'queue' and services.download_queue is None:
+        print('⚠️ queue 模式需要 sqlite 任務儲存，改用執行緒模式')
+    
+    # 分段轉換的 FFmpeg 行程由此行程所有轉換執行緒共用名額
+    set_segment_budget(config_object.TRANSCODE_SEGMENT_BUDGET or os.cpu_count() or 1)
+    
+    try:
+        setup_logging(app, config_object)
+    except Exception as e:
+        print(f'日誌設定失敗: {e}')
+    
+    _default_app = app
+    return app
 
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    create_app().run(host='0.0.0.0', port=port, debug=debug)
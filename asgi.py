@@ -0,0 +1,373 @@
+"""
+ASGI 入口
+提供與 Flask 版本相同的 API。進度 (含 SSE 推送)、影片資訊與檔案下載是 Starlette 的原生端點，
+慢速或閒置的連線只佔用事件迴圈上的一個協程，不佔用 worker 執行緒；
+其餘端點經由 a2wsgi 的 WSGIMiddleware (有上限的執行緒池) 轉交 Flask 應用程式處理。
+Flask 應用程式以 create_app(async_transcode=True) 建立，轉換階段 (MP3 編碼、重新封裝與影音合併)
+在專用的事件迴圈上以 asyncio 子行程執行 FFmpeg。
+任務儲存 (SQLite 查詢與寫入可能等待鎖定)、影片資訊查詢與檔案讀取在執行緒中執行，不阻塞事件迴圈。
+
+啟動: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import json
+import math
+import time
+import uuid
+import asyncio
+import contextlib
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from a2wsgi import WSGIMiddleware
+from limits import RateLimitItem, parse_many
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app_pytubefix import (
+    EXTENSION_NAME,
+    create_app,
+    start_services,
+    with_app_context,
+    fetch_video_info,
+    load_progress,
+    locate_task_file,
+    fallback_download_name,
+    FileLookupError,
+    validate_youtube_url,
+    clean_youtube_url,
+    extract_video_id
+)
+from file_delivery import DELIVERY_APP, FALLBACK_BLOCK_SIZE, offload_response, plan_file_response
+
+logger = logging.getLogger(__name__)
+
+# 此入口服務的 Flask 應用程式 (原生端點使用其設定與服務)，轉換階段以 asyncio 子行程執行
+flask_app = create_app(async_transcode=True)
+services = flask_app.extensions[EXTENSION_NAME]
+config = services.config
+
+# 與 Flask 版本相同的安全性標頭
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+}
+
+# 請求內容上限 (API 只接受 JSON)
+MAX_BODY_SIZE = 1024 * 1024
+
+# 原生端點的速率限制 (與 Flask 版本的限制相同，計數存於此行程)
+rate_limiter = FixedWindowRateLimiter(MemoryStorage())
+
+
+async def blocking(fn: Callable[..., Any], *args: Any) -> Any:
+    """在執行緒中以 Flask 應用程式的情境執行同步呼叫"""
+    return await run_in_threadpool(with_app_context(fn, flask_app), *args)
+
+
+def success(request: Request, data: Any) -> JSONResponse:
+    return JSONResponse({'success': True, 'request_id': request.state.request_id, 'data': data})
+
+
+def error(request: Request, message: str, code: str, status: int,
+          details: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    body: Dict[str, Any] = {'code': code, 'message': message}
+    if details:
+        body['details'] = details
+    return JSONResponse(
+        {'success': False, 'error': body, 'request_id': request.state.request_id},
+        status_code=status,
+        headers=headers
+    )
+
+
+async def retry_after(scope_name: str, items: List[RateLimitItem], client: str) -> Optional[int]:
+    """記錄一次請求；超過任一限制時返回需等待的秒數 (Retry-After)"""
+    if not flask_app.config['RATELIMIT_ENABLED']:
+        return None
+    for item in items:
+        if not await rate_limiter.hit(item, 'asgi', scope_name, client):
+            stats = await rate_limiter.get_window_stats(item, 'asgi', scope_name, client)
+            return max(1, math.ceil(stats.reset_time - time.time()))
+    return None
+
+
+def native(limit: str):
+    """
+    原生端點：請求 ID、速率限制 (429 附 Retry-After)、安全性標頭與請求記錄
+
+    Args:
+        limit: 速率限制 (如 '30 per minute'，多個限制以逗號分隔)
+    """
+    items = parse_many(limit.replace(',', ';'))
+
+    def decorator(handler: Callable[..., Awaitable[Response]]):
+        @functools.wraps(handler)
+        async def endpoint(request: Request) -> Response:
+            start_services(flask_app)
+            request.state.request_id = str(uuid.uuid4())
+            started = time.monotonic()
+            status = 500
+            try:
+                client = request.client.host if request.client else '127.0.0.1'
+                wait = await retry_after(handler.__name__, items, client)
+                if wait is not None:
+                    response = error(
+                        request, '請求過於頻繁，請稍後再試', 'RATE_LIMIT_EXCEEDED', 429,
+                        details={'retry_after': limit}, headers={'Retry-After': str(wait)}
+                    )
+                else:
+                    response = await handler(request, **request.path_params)
+                response.headers.update(SECURITY_HEADERS)
+                status = response.status_code
+                return response
+            finally:
+                flask_app.logger.info(
+                    f'[{request.state.request_id}] {request.method} {request.url.path} '
+                    f'- {status} - {time.monotonic() - started:.3f}s'
+                )
+        return endpoint
+    return decorator
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    on_close 在回應結束時於執行緒中呼叫一次 (包含用戶端中斷)
+
+    Starlette 在用戶端中斷時不執行 background 工作，因此在 __call__ 的 finally 中釋放資源
+    """
+
+    def __init__(self, content: Any, on_close: Callable[[], None], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await blocking(self.on_close)
+
+
+# ---- 進度 ----
+
+@native('60 per minute')
+async def progress(request: Request, task_id: str) -> Response:
+    """獲取下載進度"""
+    try:
+        uuid.UUID(task_id)
+    except ValueError:
+        return error(request, '無效的任務 ID', 'INVALID_TASK_ID', 400)
+
+    task = await blocking(load_progress, task_id)
+    if task is None:
+        return error(request, '任務不存在', 'TASK_NOT_FOUND', 404)
+
+    return success(request, task)
+
+
+@native('30 per minute')
+async def progress_stream(request: Request, task_id: str) -> Response:
+    """
+    以 Server-Sent Events 推送下載進度 (與 Flask 版本相同的事件格式)
+
+    任務狀態由共用的 progress_notifier 推送，串流只在事件迴圈上等待自己的訂閱；
+    同時串流數上限為 SSE_MAX_STREAMS，超過時回應 503，前端改用輪詢
+    """
+    try:
+        uuid.UUID(task_id)
+    except ValueError:
+        return error(request, '無效的任務 ID', 'INVALID_TASK_ID', 400)
+
+    if await blocking(services.download_tasks.get, task_id) is None:
+        return error(request, '任務不存在', 'TASK_NOT_FOUND', 404)
+
+    subscription = services.progress_notifier.subscribe(task_id, asyncio.get_running_loop())
+    if subscription is None:
+        return error(
+            request, '進度串流已達上限，請改用輪詢', 'SSE_UNAVAILABLE', 503,
+            headers={'Retry-After': str(config.DOWNLOAD_RETRY_AFTER)}
+        )
+
+    async def generate():
+        yield 'retry: 1000\n\n'
+        last_sent = time.monotonic()
+        deadline = last_sent + config.SSE_MAX_DURATION
+
+        while not await request.is_disconnected():
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            try:
+                task = await subscription.get_async(min(
+                    deadline - now,
+                    max(0.0, last_sent + config.SSE_KEEPALIVE_SECONDS - now)
+                ))
+            except TimeoutError:
+                if time.monotonic() - last_sent >= config.SSE_KEEPALIVE_SECONDS:
+                    # 註解行，維持連線不被代理伺服器中斷
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                continue
+
+            if task is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            yield f'data: {json.dumps(task, ensure_ascii=False, sort_keys=True)}\n\n'
+            last_sent = time.monotonic()
+            if task['status'] in ('completed', 'error'):
+                return
+
+    return ClosingStreamingResponse(
+        generate(),
+        on_close=subscription.close,
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 停用 nginx 緩衝
+        }
+    )
+
+
+# ---- 影片資訊 ----
+
+@native('30 per minute')
+async def info(request: Request) -> Response:
+    """獲取影片資訊 (pytubefix 查詢在執行緒中進行，協程等待結果)"""
+    body = b''
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_BODY_SIZE:
+            return error(request, '請求內容過大', 'FILE_TOO_LARGE', 413)
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        data = None
+    url = data.get('url') if isinstance(data, dict) else None
+
+    if not url:
+        return error(request, '請提供影片網址', 'MISSING_URL', 400)
+
+    try:
+        url = validate_youtube_url(url)
+        url = clean_youtube_url(url)
+    except ValueError as e:
+        return error(request, str(e), 'INVALID_URL', 400)
+
+    # 以影片 ID 查詢資訊快取，並發的相同查詢只會請求一次
+    video_id = extract_video_id(url)
+    if video_id and config.INFO_CACHE_ENABLED:
+        load = lambda: services.info_cache.get_or_load(video_id, lambda: fetch_video_info(url))
+    else:
+        load = lambda: fetch_video_info(url)
+
+    try:
+        result = await blocking(load)
+    except ValueError as e:
+        flask_app.logger.warning(f'[{request.state.request_id}] URL 驗證失敗: {e}')
+        return error(request, str(e), 'INVALID_URL', 400)
+    except Exception as e:
+        flask_app.logger.error(f'[{request.state.request_id}] 獲取影片資訊失敗: {e}', exc_info=True)
+        return error(request, '無法獲取影片資訊，請確認網址是否正確', 'INFO_FETCH_ERROR', 500)
+
+    flask_app.logger.info(f'[{request.state.request_id}] 獲取影片資訊成功: {result["title"]}')
+    return success(request, result)
+
+
+# ---- 檔案下載 ----
+
+class FileStreamResponse(ClosingStreamingResponse):
+    """分段讀取檔案的串流回應"""
+
+    def __init__(self, file_path: str, start: int, length: int, status_code: int,
+                 headers: Dict[str, str], on_close: Callable[[], None]):
+        super().__init__(
+            self._read(file_path, start, length), on_close=on_close, status_code=status_code, headers=headers
+        )
+
+    @staticmethod
+    async def _read(file_path: str, start: int, length: int):
+        handle = await run_in_threadpool(open, file_path, 'rb')
+        try:
+            await run_in_threadpool(handle.seek, start)
+            remaining = length
+            while remaining > 0:
+                chunk = await run_in_threadpool(handle.read, min(FALLBACK_BLOCK_SIZE, remaining))
+                if not chunk:
+                    flask_app.logger.error(f'檔案在傳送中被截斷: {file_path}')
+                    break
+                remaining -= len(chunk)
+                # 伺服器的傳送緩衝已滿時在此等待 (慢速用戶端只佔用這個協程)
+                yield chunk
+        finally:
+            await run_in_threadpool(handle.close)
+
+
+@native(config.RATE_LIMIT_DEFAULT)
+async def download_file(request: Request, task_id: str) -> Response:
+    """
+    下載檔案
+
+    條件式請求與 Range 的判斷與 Flask 版本共用 plan_file_response()；檔案內容分段讀取後非同步送出，
+    送出時等待用戶端接收 (慢速連線不佔用執行緒)。x-accel-redirect / x-sendfile 模式由前端代理傳送
+    """
+    flask_app.logger.info(f'下載請求: task_id={task_id}')
+    try:
+        task, file_path, file_size = await blocking(locate_task_file, task_id)
+    except FileLookupError as e:
+        return JSONResponse(e.body, status_code=e.status_code)
+
+    delivery_mode = services.delivery_mode
+    download_name = task['filename']
+    fallback_name = fallback_download_name(task_id, download_name)
+    flask_app.logger.info(
+        f'開始傳送檔案: {download_name} ({file_size / 1024 / 1024:.2f} MB, {delivery_mode}, asgi)'
+    )
+
+    if delivery_mode != DELIVERY_APP:
+        await blocking(services.file_evictor.touch, file_path)
+        offloaded = offload_response(
+            file_path, download_name, delivery_mode,
+            config.DOWNLOAD_FOLDER, config.X_ACCEL_REDIRECT_PREFIX, fallback_name
+        )
+        return Response(status_code=offloaded.status_code, headers=dict(offloaded.headers))
+
+    # 傳送期間釘選檔案，容量清理不會刪除
+    pin = await blocking(services.file_evictor.pin, file_path)
+    try:
+        status, headers, start, length = await blocking(
+            plan_file_response, file_path, download_name, request.headers, fallback_name
+        )
+    except Exception:
+        await blocking(pin.release)
+        raise
+
+    if status in (304, 416) or request.method == 'HEAD' or length == 0:
+        await blocking(pin.release)
+        return Response(status_code=status, headers=headers)
+    return FileStreamResponse(file_path, start, length, status, headers, pin.release)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    """啟動此行程的背景服務"""
+    start_services(flask_app)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/api/progress/{task_id}', progress),
+        Route('/api/progress/{task_id}/stream', progress_stream),
+        Route('/api/info', info, methods=['POST']),
+        Route('/api/file/{task_id}', download_file),
+        # 其他端點交由 Flask 處理 (有上限的執行緒池，回應結束時關閉回應內容)
+        Mount('/', app=WSGIMiddleware(flask_app, workers=config.ASGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
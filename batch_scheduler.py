@@ -0,0 +1,104 @@
+"""
+批次下載派送器
+批次中的任務先留在派送器中，由單一派送執行緒在下載池有空位時逐一送出，
+多個批次之間輪流派送，避免大批次佔滿下載池
+"""
+import threading
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """
+    批次派送器 (執行緒安全)
+
+    - add() 登記批次中待派送的任務，派送時在各批次間輪流 (round-robin)，
+      新批次不需等待先前的大批次全部送出
+    - dispatch(task_id, payload) 由派送執行緒呼叫，應在下載池有空位前阻塞，
+      因此待派送的任務不會佔用下載佇列
+    - dispatch 失敗時呼叫 on_error(task_id, error)
+    - 待派送的任務只存在於此行程的記憶體中，行程結束時尚未派送的任務會停留在 pending，
+      由任務過期清理移除；這些任務標記為 awaiting_dispatch，不會被其他請求當作進行中的主任務
+    """
+
+    def __init__(self, dispatch: Callable[[str, Dict[str, Any]], None],
+                 on_error: Optional[Callable[[str, Exception], None]] = None,
+                 name: str = 'batch'):
+        self.name = name
+        self._dispatch = dispatch
+        self._on_error = on_error
+        self._batches: 'OrderedDict[str, deque]' = OrderedDict()  # batch_id -> (task_id, payload)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # 統計數字在鎖內更新 (/api/metrics 由其他執行緒讀取)
+        self.dispatched = 0
+        self.failed = 0
+
+    def add(self, batch_id: str, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        登記待派送的任務
+
+        Args:
+            batch_id: 批次 ID
+            items: (task_id, payload) 列表，依序派送
+        """
+        if not items:
+            return
+        with self._cond:
+            self._batches.setdefault(batch_id, deque()).extend(items)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def pending(self, batch_id: Optional[str] = None) -> int:
+        """待派送的任務數 (指定 batch_id 時只計算該批次)"""
+        with self._cond:
+            if batch_id is not None:
+                return len(self._batches.get(batch_id, ()))
+            return sum(len(items) for items in self._batches.values())
+
+    def stats(self) -> Dict[str, int]:
+        """返回派送器統計資訊"""
+        with self._cond:
+            return {
+                'batches': len(self._batches),
+                'pending': sum(len(items) for items in self._batches.values()),
+                'dispatched': self.dispatched,
+                'failed': self.failed,
+            }
+
+    def _ensure_thread(self) -> None:
+        """呼叫端需持有鎖；第一次使用時才啟動派送執行緒"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-dispatch', daemon=True)
+            self._thread.start()
+
+    def _next(self) -> Tuple[str, Dict[str, Any]]:
+        """呼叫端需持有鎖；從最前面的批次取出一個任務，並把該批次移到最後"""
+        batch_id, items = next(iter(self._batches.items()))
+        item = items.popleft()
+        if items:
+            self._batches.move_to_end(batch_id)
+        else:
+            del self._batches[batch_id]
+        return item
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._batches)
+                task_id, payload = self._next()
+
+            try:
+                self._dispatch(task_id, payload)
+            except Exception as e:
+                with self._cond:
+                    self.failed += 1
+                logger.error(f'批次任務派送失敗 (task_id={task_id}): {e}')
+                if self._on_error is not None:
+                    self._on_error(task_id, e)
+            else:
+                with self._cond:
+                    self.dispatched += 1
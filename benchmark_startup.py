@@ -0,0 +1,209 @@
+"""
+冷啟動基準測試
+以全新的直譯器 (python -X importtime) 重複啟動 web 應用程式，量測 導入 → create_app() → 第一個請求 的時間，
+並檢查導入模組沒有副作用 (輸出訊息、產生檔案、留下執行緒)、沒有導入延遲載入的下載引擎，
+以及 /health 正常回應。
+
+使用方式:
+    python benchmark_startup.py                 # 預設 5 次，冷啟動中位數超過 1.5 秒或導入超過 500 ms 即失敗
+    python benchmark_startup.py --runs 10 --budget 1.0 --import-budget 400
+
+自動擴展時新的 worker 要在這段時間內才能接手請求；超過預算、偵測到副作用或 /health 回應錯誤時以結束碼 1 結束，
+可加入部署前檢查；test_startup.py 以 pytest 執行相同的檢查。
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import List, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# web 入口模組
+ENTRY_POINT = 'app_pytubefix'
+
+# 預設的重複次數與預算 (冷啟動秒數、導入毫秒數)
+DEFAULT_RUNS = 5
+DEFAULT_BUDGET = 1.5
+DEFAULT_IMPORT_BUDGET = 500
+
+# 第一次使用時才導入的模組 (engines.py 與監控端點)，不可出現在入口的導入過程中
+LAZY_MODULES = ('pytubefix', 'yt_dlp', 'psutil')
+
+# 在子行程中執行：量測各階段並回報副作用 (最後一行輸出 JSON)
+PROBE = r'''
+import io, os, sys, json, time, threading
+started = time.perf_counter()
+captured = io.StringIO()
+stdout, sys.stdout = sys.stdout, captured
+import app_pytubefix
+sys.stdout = stdout
+imported = time.perf_counter()
+
+# 導入時只允許短暫的執行緒 (如速率限制儲存的一次性計時器)
+for thread in threading.enumerate():
+    if thread is not threading.current_thread():
+        thread.join(0.2)
+lingering = [t.name for t in threading.enumerate() if t is not threading.current_thread()]
+files = sorted(os.listdir('.'))
+
+waited = time.perf_counter()
+app = app_pytubefix.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/health')
+served = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - waited,
+    'first_request': served - created,
+    'status': response.status_code,
+    'health': response.get_json(silent=True),
+    'import_output': captured.getvalue(),
+    'import_threads': lingering,
+    'import_files': files,
+}))
+'''
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    解析 -X importtime 的輸出
+
+    Returns:
+        dict: 模組名稱 -> 累計導入時間 (微秒)
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # 標題列
+        modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+def health_error(sample: dict):
+    """
+    檢查 /health 的回應
+
+    Returns:
+        str: 錯誤說明；正常或只缺 FFmpeg (503) 時返回 None
+    """
+    status = sample['status']
+    if status == 200:
+        return None
+    health = sample.get('health') or {}
+    # 只缺 FFmpeg 時 /health 也回應 503，但應用程式本身已能處理請求
+    if status == 503 and health.get('ffmpeg') is False and health.get('disk_space_mb', 0) > 100:
+        return None
+    return f'/health 回應 {status}: {health}'
+
+
+def run_once(python: str) -> dict:
+    """以全新的直譯器執行一次探測，返回各階段時間 (秒)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [BASE_DIR, env.get('PYTHONPATH')]))
+        # 下載目錄、任務儲存與日誌都寫到暫存目錄：藉此確認導入時沒有建立檔案，
+        # 第一個請求啟動的背景服務 (如 downloads/.cleaner.lock) 也不會寫入專案目錄
+        env['DOWNLOAD_FOLDER'] = os.path.join(workdir, 'downloads')
+        env['TASK_STORE_PATH'] = os.path.join(workdir, 'data', 'tasks.db')
+        env['JOB_QUEUE_PATH'] = os.path.join(workdir, 'data', 'jobs.db')
+        env.setdefault('LOG_FILE', os.path.join('logs', 'app.log'))
+
+        started = time.perf_counter()
+        result = subprocess.run(
+            [python, '-X', 'importtime', '-c', PROBE], cwd=workdir, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120
+        )
+        total = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(f'啟動失敗:\n{result.stderr}')
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample['total'] = total
+        modules = parse_importtime(result.stderr)
+        sample['import_time'] = modules.get(ENTRY_POINT, 0) / 1e6
+        sample['lazy_imported'] = sorted(name for name in modules if name.split('.')[0] in LAZY_MODULES)
+        return sample
+
+
+def check_samples(samples: List[dict], budget: float = DEFAULT_BUDGET,
+                  import_budget: float = DEFAULT_IMPORT_BUDGET) -> Tuple[List[str], List[str]]:
+    """
+    檢查量測結果 (main() 與 test_startup.py 共用)
+
+    Args:
+        samples: run_once() 的結果
+        budget: 冷啟動時間中位數上限 (秒)
+        import_budget: 導入時間中位數上限 (毫秒)
+
+    Returns:
+        tuple: (失敗原因列表, 其他訊息列表)
+    """
+    failures = []
+    notes = []
+    first = samples[0]
+    if first['import_output']:
+        failures.append(f'導入時輸出訊息:\n{first["import_output"]}')
+    if first['import_threads']:
+        failures.append(f'導入時啟動執行緒: {", ".join(first["import_threads"])}')
+    if first['import_files']:
+        failures.append(f'導入時建立檔案: {", ".join(first["import_files"])}')
+    errors = {health_error(sample) for sample in samples} - {None}
+    if errors:
+        failures.append(f'第一個請求失敗: {"; ".join(sorted(errors))}')
+    elif any(sample['status'] != 200 for sample in samples):
+        notes.append('⚠️ /health 回應 503 (FFmpeg 不可用)，不影響啟動時間量測')
+    if first['lazy_imported']:
+        failures.append(f'導入時載入了應延遲載入的模組: {", ".join(first["lazy_imported"][:10])}')
+
+    import_median = statistics.median(sample['import_time'] for sample in samples) * 1000
+    if import_median > import_budget:
+        failures.append(f'{ENTRY_POINT} 導入時間中位數 {import_median:.0f} ms，超過預算 {import_budget:.0f} ms')
+    else:
+        notes.append(f'✅ {ENTRY_POINT} 導入時間中位數 {import_median:.0f} ms (預算 {import_budget:.0f} ms)')
+
+    median = statistics.median(sample['total'] for sample in samples)
+    if median > budget:
+        failures.append(f'冷啟動中位數 {median:.3f} 秒，超過預算 {budget:.3f} 秒')
+    else:
+        notes.append(f'✅ 冷啟動中位數 {median:.3f} 秒 (預算 {budget:.3f} 秒)')
+    return failures, notes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='量測 web 應用程式冷啟動時間')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help=f'重複次數 (預設 {DEFAULT_RUNS})')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help=f'冷啟動時間中位數上限，秒 (預設 {DEFAULT_BUDGET})')
+    parser.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET,
+                        help=f'{ENTRY_POINT} 導入時間 (-X importtime 累計) 中位數上限，毫秒 (預設 {DEFAULT_IMPORT_BUDGET})')
+    parser.add_argument('--python', default=sys.executable, help='使用的 Python 直譯器')
+    args = parser.parse_args()
+
+    samples = []
+    for index in range(max(1, args.runs)):
+        sample = run_once(args.python)
+        samples.append(sample)
+        print(
+            f'#{index + 1}: 總計 {sample["total"] * 1000:.0f} ms '
+            f'(導入 {sample["import_time"] * 1000:.0f} ms, create_app {sample["create_app"] * 1000:.0f} ms, '
+            f'第一個請求 {sample["first_request"] * 1000:.0f} ms → {sample["status"]})'
+        )
+
+    failures, notes = check_samples(samples, args.budget, args.import_budget)
+    for note in notes:
+        print(note)
+    for failure in failures:
+        print(f'❌ {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+有界下載執行器
+固定數量的執行緒加上有上限的等待佇列，佇列已滿時拒絕新工作 (或讓提交者等待) 而不是無限堆積執行緒；
+AsyncBoundedExecutor 以相同介面在 asyncio 事件迴圈上執行協程工作
+"""
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """等待佇列已滿"""
+
+
+class BoundedExecutor:
+    """
+    有界執行器 (執行緒安全)
+
+    - 最多 max_workers 個工作同時執行，最多 max_queue 個工作等待
+    - 佇列已滿時 submit() 預設拒絕；block=True 則讓提交者等待空位 (作為管線階段間的背壓)
+    - reserve 讓背景提交者 (如批次派送) 保留部分等待空位給其他請求
+    - 每個工作以 key (如任務 ID) 識別，可查詢其在等待佇列中的位置
+    - 記錄最近的忙碌區間，stats() 回報滑動視窗內的執行緒使用率
+    """
+
+    # 計算使用率的滑動視窗 (秒)
+    UTILISATION_WINDOW = 60.0
+
+    # 工作是否為協程函數 (AsyncBoundedExecutor)
+    is_async = False
+
+    def __init__(self, max_workers: int, max_queue: int, thread_name_prefix: str = 'download'):
+        self.name = thread_name_prefix
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=thread_name_prefix
+        )
+        self._waiting: 'OrderedDict[str, float]' = OrderedDict()  # key -> 提交時間
+        self._running = 0
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._active: Dict[int, float] = {}  # 執行緒 ID -> 開始時間
+        self._intervals: deque = deque(maxlen=4096)  # 已結束的 (開始, 結束)
+        self._created = time.monotonic()
+        self._wait_total = 0.0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, block: bool = False,
+               timeout: Optional[float] = None, reserve: int = 0, **kwargs) -> Future:
+        """
+        提交工作
+
+        Args:
+            key: 工作識別 (用於查詢佇列位置)
+            fn: 要執行的函數
+            *args, **kwargs: 函數參數
+            block: 佇列已滿時是否等待空位
+            timeout: 等待空位的秒數上限 (None 為無限等待)
+            reserve: 保留給其他提交者的空位數 (剩餘空位不超過此數時視為已滿)
+
+        Returns:
+            Future: 工作結果
+
+        Raises:
+            QueueFullError: 執行中與等待中的工作已達上限 (或等待逾時)
+        """
+        self._admit(key, block, timeout, reserve)
+        return self._executor.submit(self._run, key, fn, args, kwargs)
+
+    def _admit(self, key: str, block: bool, timeout: Optional[float], reserve: int) -> None:
+        """登記等待中的工作，佇列已滿時等待或拋出 QueueFullError"""
+        with self._lock:
+            if block:
+                self._space.wait_for(lambda: self._has_space(reserve), timeout=timeout)
+            if not self._has_space(reserve):
+                self.rejected += 1
+                raise QueueFullError(f'{self.name} 佇列已滿 ({self.max_queue} 個等待中)')
+            self._waiting[key] = time.monotonic()
+
+    def _has_space(self, reserve: int = 0) -> bool:
+        """呼叫端需持有鎖"""
+        return self._running + len(self._waiting) + reserve < self.max_workers + self.max_queue
+
+    def _begin(self, key: str, ident: int) -> None:
+        with self._lock:
+            started = time.monotonic()
+            submitted = self._waiting.pop(key, started)
+            self._wait_total += started - submitted
+            self._running += 1
+            self._active[ident] = started
+
+    def _end(self, ident: int) -> None:
+        with self._lock:
+            self._running -= 1
+            self._intervals.append((self._active.pop(ident), time.monotonic()))
+            self.completed += 1
+            self._space.notify_all()
+
+    def _run(self, key: str, fn: Callable[..., Any], args, kwargs) -> Any:
+        ident = threading.get_ident()
+        self._begin(key, ident)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._end(ident)
+
+    def position(self, key: str) -> Optional[int]:
+        """
+        查詢工作在等待佇列中的位置 (1 為下一個)
+
+        Returns:
+            Optional[int]: 位置，工作不在等待中則返回 None
+        """
+        with self._lock:
+            for index, waiting_key in enumerate(self._waiting, start=1):
+                if waiting_key == key:
+                    return index
+            return None
+
+    def utilisation(self) -> float:
+        """最近 UTILISATION_WINDOW 秒內執行緒忙碌時間的比例 (0-1)"""
+        with self._lock:
+            now = time.monotonic()
+            window_start = max(now - self.UTILISATION_WINDOW, self._created)
+            busy = sum(
+                end - max(start, window_start)
+                for start, end in self._intervals if end > window_start
+            )
+            busy += sum(now - max(start, window_start) for start in self._active.values())
+            capacity = self.max_workers * max(now - window_start, 1e-6)
+            return min(1.0, busy / capacity)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回執行器統計資訊"""
+        utilisation = self.utilisation()
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': len(self._waiting),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'utilisation': round(utilisation, 3),
+                'avg_wait_seconds': round(self._wait_total / self.completed, 3) if self.completed else 0,
+            }
+
+
+class AsyncBoundedExecutor(BoundedExecutor):
+    """
+    BoundedExecutor 的 asyncio 版本
+
+    submit() 可由任何執行緒呼叫 (背壓、佇列位置與統計與 BoundedExecutor 相同)，
+    fn 必須是協程函數，同時最多 max_workers 個；工作等待子行程或 I/O 時不佔用執行緒。
+    工作在執行器自己的事件迴圈上執行 (第一次提交時以一個專用執行緒啟動)，
+    不依賴伺服器的事件迴圈，可由 create_app() 建立
+    """
+
+    is_async = True
+
+    def __init__(self, max_workers: int, max_queue: int, thread_name_prefix: str = 'async'):
+        super().__init__(max_workers, max_queue, thread_name_prefix)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, block: bool = False,
+               timeout: Optional[float] = None, reserve: int = 0, **kwargs) -> Future:
+        self._admit(key, block, timeout, reserve)
+        return asyncio.run_coroutine_threadsafe(self._run_async(key, fn, args, kwargs), self._ensure_loop())
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """返回執行器的事件迴圈，第一次呼叫時在專用執行緒中啟動"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=f'{self.name}-loop', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def _run_async(self, key: str, fn: Callable[..., Any], args, kwargs) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        async with self._slots:
+            ident = id(asyncio.current_task())
+            self._begin(key, ident)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self._end(ident)
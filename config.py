@@ -13,21 +13,136 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     
     # 下載配置
-    DOWNLOAD_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), 'downloads'))
+    DOWNLOAD_FOLDER = os.path.abspath(
+        os.environ.get('DOWNLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'downloads'))
+    )
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB
     MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
+    # 檔案傳送模式：'app' (應用程式以 sendfile 傳送)、'x-accel-redirect' (nginx) 或 'x-sendfile' (Apache)
+    FILE_DELIVERY_MODE = os.environ.get('FILE_DELIVERY_MODE', 'app').lower()
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-downloads/')
     
     # FFmpeg 配置
     FFMPEG_TIMEOUT = int(os.environ.get('FFMPEG_TIMEOUT', '300'))  # 5 分鐘
     MP3_DEFAULT_BITRATE = os.environ.get('MP3_DEFAULT_BITRATE', '192k')
+    # 音訊邊下載邊轉換 (串流餵給 FFmpeg stdin)，失敗時自動改用下載後轉換
+    AUDIO_STREAM_TRANSCODE = os.environ.get('AUDIO_STREAM_TRANSCODE', 'true').lower() == 'true'
+    # 長音訊分段並行轉換 (超過 MIN_DURATION 秒時切段，以多個 FFmpeg 行程同時編碼)
+    TRANSCODE_SEGMENTED_ENABLED = os.environ.get('TRANSCODE_SEGMENTED_ENABLED', 'true').lower() == 'true'
+    TRANSCODE_SEGMENT_MIN_DURATION = int(os.environ.get('TRANSCODE_SEGMENT_MIN_DURATION', '1200'))  # 20 分鐘
+    TRANSCODE_SEGMENT_WORKERS = int(os.environ.get('TRANSCODE_SEGMENT_WORKERS', '0'))  # 0 = CPU 數
+    # 整個行程同時執行的分段 FFmpeg 行程總數 (所有轉換執行緒共用，0 = CPU 數)
+    TRANSCODE_SEGMENT_BUDGET = int(os.environ.get('TRANSCODE_SEGMENT_BUDGET', '0'))
+    # 自適應 (DASH) 影片：分別下載純影像與純音訊串流後以 -c copy 合併，可取得 1080p 以上畫質
+    ADAPTIVE_VIDEO_ENABLED = os.environ.get('ADAPTIVE_VIDEO_ENABLED', 'true').lower() == 'true'
+    # 轉換階段執行緒數 (0 = CPU 數) 與下載→轉換交接佇列的上限
+    TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', '0'))
+    TRANSCODE_QUEUE_DEPTH = int(os.environ.get('TRANSCODE_QUEUE_DEPTH', '4'))
+    # 轉換階段以 asyncio 子行程執行 FFmpeg (MP3 編碼、重新封裝與影音合併都在下載後交給轉換階段)，
+    # 等待 FFmpeg 不佔用執行緒。ASGI 入口 (asgi.py) 一律啟用
+    TRANSCODE_ASYNC = os.environ.get('TRANSCODE_ASYNC', 'false').lower() == 'true'
     
-    # 檔案清理配置
+    # 檔案清理配置 (FILE_CLEANUP_HOURS：超過此時數未被存取的檔案會被刪除，0 = 不依時間清理)
     FILE_CLEANUP_HOURS = int(os.environ.get('FILE_CLEANUP_HOURS', '1'))
     CLEANUP_INTERVAL_SECONDS = 3600  # 1 小時
+    # 下載目錄容量上限：超過高水位時依最近存取時間刪除到低水位 (0 = 只依磁碟剩餘空間)
+    DOWNLOAD_FOLDER_MAX_MB = int(os.environ.get('DOWNLOAD_FOLDER_MAX_MB', '5120'))
+    EVICTION_HIGH_WATERMARK = float(os.environ.get('EVICTION_HIGH_WATERMARK', '0.9'))
+    EVICTION_LOW_WATERMARK = float(os.environ.get('EVICTION_LOW_WATERMARK', '0.7'))
+    # 磁碟剩餘空間低於此值也觸發清理 (需高於 /health 的 100 MB 門檻)
+    EVICTION_MIN_FREE_MB = int(os.environ.get('EVICTION_MIN_FREE_MB', '512'))
+    EVICTION_MIN_AGE = int(os.environ.get('EVICTION_MIN_AGE', '600'))  # 此秒數內修改過的檔案視為寫入中
+    EVICTION_CHECK_INTERVAL = int(os.environ.get('EVICTION_CHECK_INTERVAL', '60'))
     
-    # 任務配置
+    # 任務配置 (MAX_CONCURRENT_DOWNLOADS 為下載階段的執行緒數，轉換另由 TRANSCODE_WORKERS 控制)
     MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', '3'))
     TASK_TIMEOUT = int(os.environ.get('TASK_TIMEOUT', '600'))  # 10 分鐘
+    # 等待佇列上限 (執行中的下載已達 MAX_CONCURRENT_DOWNLOADS 時最多排隊的數量，超過則返回 503)
+    DOWNLOAD_QUEUE_DEPTH = int(os.environ.get('DOWNLOAD_QUEUE_DEPTH', '20'))
+    DOWNLOAD_RETRY_AFTER = int(os.environ.get('DOWNLOAD_RETRY_AFTER', '30'))  # 秒
+    
+    # 批次下載 (/api/batch)：單一批次的項目上限，以及批次派送時保留給單一下載請求的等待空位
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '50'))
+    BATCH_RESERVED_SLOTS = int(os.environ.get('BATCH_RESERVED_SLOTS', '5'))
+    # 多檔案 ZIP 下載 (/api/archive) 的總大小上限
+    ARCHIVE_MAX_SIZE = int(os.environ.get('ARCHIVE_MAX_SIZE', str(4 * 1024 * 1024 * 1024)))  # 4GB
+    
+    # 任務儲存配置 ('sqlite' 可讓多個 gunicorn worker 共用任務狀態，'memory' 僅限單一 worker)
+    TASK_STORE_BACKEND = os.environ.get('TASK_STORE_BACKEND', 'sqlite')
+    TASK_STORE_PATH = os.environ.get(
+        'TASK_STORE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tasks.db')
+    )
+    TASK_STORE_MAX_TASKS = int(os.environ.get('TASK_STORE_MAX_TASKS', '10000'))  # 保留的任務上限 (SQLite 為所有 worker 合計)
+    
+    # 下載執行模式 ('thread': 在 web 行程內以執行緒下載；'queue': 排入持久化佇列，由 worker.py 執行)
+    TASK_EXECUTION_MODE = os.environ.get('TASK_EXECUTION_MODE', 'thread')
+    JOB_QUEUE_PATH = os.environ.get(
+        'JOB_QUEUE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jobs.db')
+    )
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+    JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '120'))  # worker 心跳逾時
+    # 單一工作的執行時間上限 (秒，0 = 不限制)；子行程卡住時心跳仍由主行程更新，需以此終止
+    JOB_TIMEOUT_SECONDS = int(os.environ.get('JOB_TIMEOUT_SECONDS', '3600'))
+    
+    # worker 行程池配置 (WORKER_PROCESSES 為 0 時依 CPU 數與網路頻寬預算自動計算)
+    WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', '0'))
+    WORKER_NETWORK_BUDGET_MBPS = int(os.environ.get('WORKER_NETWORK_BUDGET_MBPS', '100'))
+    WORKER_JOB_MBPS = int(os.environ.get('WORKER_JOB_MBPS', '10'))  # 每個下載工作預估佔用頻寬
+    WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', '1.0'))  # 秒
+    
+    # 進度推送 (Server-Sent Events) 配置
+    # 每個 worker 一個通知執行緒讀取被訂閱任務的間隔 (秒)；此行程內的更新立即推送，
+    # 此間隔只影響其他行程 (queue 模式的 worker、其他 gunicorn worker) 寫入的更新
+    SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', '0.5'))
+    SSE_KEEPALIVE_SECONDS = int(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', '300'))  # 單一連線最長時間，之後由瀏覽器重新連線
+    # 每個 worker 同時推送的串流上限，超過時回應 503 由前端改用輪詢 (0 = 不提供串流)。
+    # gunicorn 的每個串流另佔用一個執行緒，最多使用 worker 一半的執行緒 (gunicorn.conf.py)
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', '500'))
+    
+    # ASGI 入口 (uvicorn asgi:app)：執行 Flask 端點 (a2wsgi) 與原生端點中阻塞呼叫的執行緒數
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '16'))
+    
+    # 多連線分段下載配置 (CONNECTIONS 設為 1 即停用)
+    RANGED_DOWNLOAD_CONNECTIONS = int(os.environ.get('RANGED_DOWNLOAD_CONNECTIONS', '4'))
+    RANGED_DOWNLOAD_SEGMENT_SIZE = int(os.environ.get('RANGED_DOWNLOAD_SEGMENT_SIZE', str(4 * 1024 * 1024)))  # 4MB
+    RANGED_DOWNLOAD_MIN_SIZE = int(os.environ.get('RANGED_DOWNLOAD_MIN_SIZE', str(8 * 1024 * 1024)))  # 8MB
+    RANGED_DOWNLOAD_RETRIES = int(os.environ.get('RANGED_DOWNLOAD_RETRIES', '3'))
+    # 續傳：下載中的檔案保留為 .part 並記錄進度，重試 (含切換策略、重啟後) 從中斷處繼續
+    RESUMABLE_DOWNLOADS = os.environ.get('RESUMABLE_DOWNLOADS', 'true').lower() == 'true'
+    
+    # 結果快取配置
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '500'))
+    
+    # 客戶端策略選擇配置
+    STRATEGY_WINDOW_SIZE = int(os.environ.get('STRATEGY_WINDOW_SIZE', '20'))
+    STRATEGY_FAILURE_THRESHOLD = int(os.environ.get('STRATEGY_FAILURE_THRESHOLD', '3'))
+    STRATEGY_COOLDOWN_SECONDS = int(os.environ.get('STRATEGY_COOLDOWN_SECONDS', '60'))
+    STRATEGY_MAX_COOLDOWN_SECONDS = int(os.environ.get('STRATEGY_MAX_COOLDOWN_SECONDS', '900'))
+    
+    # 影片資訊快取配置
+    INFO_CACHE_ENABLED = os.environ.get('INFO_CACHE_ENABLED', 'true').lower() == 'true'
+    INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', '1800'))  # 30 分鐘
+    INFO_CACHE_MAX_ENTRIES = int(os.environ.get('INFO_CACHE_MAX_ENTRIES', '1000'))
+    
+    # 影片資訊對沖查詢 (逾時未回應即並行啟動下一個策略)
+    INFO_HEDGE_ENABLED = os.environ.get('INFO_HEDGE_ENABLED', 'false').lower() == 'true'
+    INFO_HEDGE_DELAY = float(os.environ.get('INFO_HEDGE_DELAY', '2.5'))  # 秒
+    INFO_HEDGE_MAX_WORKERS = int(os.environ.get('INFO_HEDGE_MAX_WORKERS', '8'))
+    
+    # yt-dlp 輔助行程 (後備下載與資訊查詢在常駐行程中執行，重用已初始化的 YoutubeDL)
+    YTDLP_HELPER_ENABLED = os.environ.get('YTDLP_HELPER_ENABLED', 'true').lower() == 'true'
+    YTDLP_HELPERS = int(os.environ.get('YTDLP_HELPERS', '2'))  # 每個 web worker 的輔助行程數
+    YTDLP_HELPER_TIMEOUT = int(os.environ.get('YTDLP_HELPER_TIMEOUT', '900'))  # 單一工作的秒數上限
+    YTDLP_HELPER_MAX_JOBS = int(os.environ.get('YTDLP_HELPER_MAX_JOBS', '100'))  # 處理此數量的工作後重啟 (0 = 不重啟)
+    YTDLP_HELPER_IDLE_TIMEOUT = int(os.environ.get('YTDLP_HELPER_IDLE_TIMEOUT', '600'))  # 閒置秒數後結束 (0 = 不結束)
+    # 影片資訊查詢 (/api/info 後備) 使用獨立的輔助行程，不與後備下載排隊
+    YTDLP_INFO_HELPERS = int(os.environ.get('YTDLP_INFO_HELPERS', '1'))  # 0 = 在 web worker 內查詢
+    YTDLP_INFO_TIMEOUT = int(os.environ.get('YTDLP_INFO_TIMEOUT', '60'))  # 單一查詢的秒數上限
+    YTDLP_INFO_ACQUIRE_TIMEOUT = float(os.environ.get('YTDLP_INFO_ACQUIRE_TIMEOUT', '5'))  # 等待空出行程的秒數，逾時後在 web worker 內查詢
     
     # 速率限制配置
     RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
@@ -72,6 +187,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     DOWNLOAD_FOLDER = '/tmp/test_downloads'
+    TASK_STORE_BACKEND = 'memory'
     RATE_LIMIT_ENABLED = False
     FILE_CLEANUP_HOURS = 0  # 測試環境不清理
 
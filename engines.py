@@ -0,0 +1,118 @@
+"""
+下載引擎註冊表
+pytubefix 與 yt-dlp 在第一次使用時才導入 (yt-dlp 會載入數百個 extractor 模組)，
+只處理首頁、/health 或靜態檔案的行程不需要付出導入成本；
+available() 只查詢套件是否已安裝，不會導入引擎
+"""
+import time
+import importlib
+import importlib.util
+import threading
+import logging
+from types import ModuleType
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EngineUnavailableError(ImportError):
+    """引擎未安裝或導入失敗"""
+
+
+class Engine:
+    """單一延遲載入的引擎 (執行緒安全)"""
+
+    def __init__(self, name: str, module: str, description: str = ''):
+        self.name = name
+        self.module_name = module
+        self.description = description
+        self._module: Optional[ModuleType] = None
+        self._installed: Optional[bool] = None
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def available(self) -> bool:
+        """套件是否已安裝 (只查詢模組位置，不導入)"""
+        if self._installed is None:
+            try:
+                self._installed = importlib.util.find_spec(self.module_name) is not None
+            except (ImportError, ValueError):
+                self._installed = False
+        return self._installed and self._error is None
+
+    def load(self) -> ModuleType:
+        """
+        導入並返回引擎模組 (只有第一次呼叫會導入)
+
+        Raises:
+            EngineUnavailableError: 未安裝或導入失敗
+        """
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is not None:
+                return self._module
+            if self._error is not None:
+                raise EngineUnavailableError(f'{self.name} 無法使用: {self._error}')
+            started = time.perf_counter()
+            try:
+                module = importlib.import_module(self.module_name)
+            except ImportError as e:
+                self._error = str(e)
+                raise EngineUnavailableError(f'{self.name} 無法使用: {e}') from e
+            self.load_seconds = time.perf_counter() - started
+            self._module = module
+            logger.info(f'載入下載引擎 {self.name} ({self.load_seconds * 1000:.0f} ms)')
+            return module
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'module': self.module_name,
+            'available': self.available(),
+            'loaded': self.loaded,
+            'load_ms': round(self.load_seconds * 1000, 1) if self.load_seconds is not None else None,
+            'error': self._error,
+        }
+
+
+class EngineRegistry:
+    """依名稱管理下載引擎"""
+
+    def __init__(self):
+        self._engines: Dict[str, Engine] = {}
+
+    def register(self, name: str, module: str, description: str = '') -> Engine:
+        """註冊引擎 (不導入)"""
+        engine = Engine(name, module, description)
+        self._engines[name] = engine
+        return engine
+
+    def get(self, name: str) -> Engine:
+        try:
+            return self._engines[name]
+        except KeyError:
+            raise EngineUnavailableError(f'未註冊的下載引擎: {name}') from None
+
+    def available(self, name: str) -> bool:
+        """引擎是否已安裝 (不導入)"""
+        return name in self._engines and self._engines[name].available()
+
+    def load(self, name: str) -> ModuleType:
+        """導入並返回引擎模組"""
+        return self.get(name).load()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各引擎的安裝與載入狀態"""
+        return {name: engine.stats() for name, engine in self._engines.items()}
+
+
+# 預設註冊表
+registry = EngineRegistry()
+registry.register('pytubefix', 'pytubefix', 'YouTube 下載主要引擎')
+registry.register('yt-dlp', 'yt_dlp', '後備下載引擎')
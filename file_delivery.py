@@ -0,0 +1,234 @@
+"""
+下載檔案傳送模組
+支援 ETag / Last-Modified 條件式請求、Range (206) 續傳、WSGI 伺服器的 sendfile() 零複製傳送，
+以及交由前端代理 (nginx X-Accel-Redirect / Apache X-Sendfile) 傳送檔案內容。
+條件式請求與 Range 的判斷 (plan_file_response) 由 Flask 與 ASGI 入口共用
+"""
+import os
+import mimetypes
+import unicodedata
+import logging
+from typing import Callable, Dict, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import dump_options_header, http_date, parse_range_header, quote_etag
+from werkzeug.sansio.http import is_resource_modified
+from werkzeug.wsgi import FileWrapper
+
+logger = logging.getLogger(__name__)
+
+# 傳送模式
+DELIVERY_APP = 'app'                        # 由應用程式傳送 (sendfile 零複製)
+DELIVERY_X_ACCEL = 'x-accel-redirect'       # nginx：internal location 傳送
+DELIVERY_X_SENDFILE = 'x-sendfile'          # Apache mod_xsendfile / lighttpd
+DELIVERY_MODES = (DELIVERY_APP, DELIVERY_X_ACCEL, DELIVERY_X_SENDFILE)
+
+# sendfile() 無法使用時 (如 TLS 由 gunicorn 終止) 每次讀取的大小
+FALLBACK_BLOCK_SIZE = 256 * 1024
+
+
+
+class FileRange:
+    """
+    檔案中的一段 (start 起 length 位元組)
+
+    read() 不會超出範圍；fileno() 與目前位置讓 gunicorn 以 sendfile() 直接傳送該段，
+    傳送長度由回應的 Content-Length 決定。on_close 在伺服器關閉回應內容時呼叫一次
+    """
+
+    def __init__(self, path: str, start: int, length: int,
+                 on_close: Optional[Callable[[], None]] = None):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+        self._on_close = on_close
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b''
+        size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self) -> None:
+        self._file.close()
+        if self._on_close is not None:
+            callback, self._on_close = self._on_close, None
+            callback()
+
+
+def disposition_header(download_name: str, fallback_name: Optional[str] = None) -> str:
+    """
+    附件的 Content-Disposition 標頭值 (非 ASCII 檔名另以 RFC 5987 filename* 提供)
+
+    非 ASCII 檔名的 filename= 使用去除重音後的 ASCII 檔名；檔名主體沒有剩下任何英數字時
+    (如全中文標題只剩副檔名) 改用 fallback_name，未提供時為 download 加上副檔名
+    """
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        stem, ext = os.path.splitext(download_name)
+        simple = unicodedata.normalize('NFKD', stem).encode('ascii', 'ignore').decode('ascii').strip()
+        if any(char.isalnum() for char in simple):
+            simple += ext
+        else:
+            simple = fallback_name or f'download{ext}'
+        names = {
+            'filename': simple,
+            'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~"),
+        }
+    return dump_options_header('attachment', names)
+
+
+def content_disposition(response: Response, download_name: str, fallback_name: Optional[str] = None) -> None:
+    """設定附件檔名"""
+    response.headers['Content-Disposition'] = disposition_header(download_name, fallback_name)
+
+
+def plan_file_response(file_path: str, download_name: str, request_headers: Mapping[str, str],
+                       fallback_name: Optional[str] = None) -> Tuple[int, Dict[str, str], int, int]:
+    """
+    依請求標頭決定檔案回應的狀態、標頭與傳送範圍
+
+    - If-None-Match / If-Modified-Since 相符時為 304
+    - 單一 Range 且 If-Range (若有) 與目前的 ETag / 修改時間相符時為 206；
+      範圍超出檔案大小時為 416 (附 Content-Range: bytes */大小)，讓用戶端重新下載
+    - 無法解析或多段的 Range 傳送整個檔案 (200)
+
+    Args:
+        file_path: 檔案路徑 (呼叫端需先驗證安全性)
+        download_name: 下載檔名
+        request_headers: 請求標頭 (不分大小寫的 get()，如 werkzeug 或 Starlette 的 Headers)
+        fallback_name: 非 ASCII 檔名無法轉成 ASCII 時使用的 filename= 檔名
+
+    Returns:
+        tuple: (狀態碼, 回應標頭, 起始位置, 傳送長度)，304 與 416 的傳送長度為 0
+    """
+    stat = os.stat(file_path)
+    size = stat.st_size
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{size:x}')
+    last_modified = http_date(stat.st_mtime)
+    headers = {
+        'Content-Disposition': disposition_header(download_name, fallback_name),
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+    }
+
+    if not is_resource_modified(
+        http_if_modified_since=request_headers.get('If-Modified-Since'),
+        http_if_none_match=request_headers.get('If-None-Match'),
+        etag=etag,
+        last_modified=last_modified
+    ):
+        return 304, headers, 0, 0
+
+    headers['Content-Type'] = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    start, length, status = 0, size, 200
+    range_header = request_headers.get('Range')
+    if_range = request_headers.get('If-Range')
+    # If-Range 與目前的檔案不符 (檔案已更新) 時忽略 Range，傳送整個檔案
+    if range_header and (not if_range or not is_resource_modified(
+        http_range=range_header,
+        http_if_range=if_range,
+        etag=etag,
+        last_modified=last_modified,
+        ignore_if_range=False
+    )):
+        parsed = parse_range_header(range_header)
+        byte_range = parsed.range_for_length(size) if parsed else None
+        if parsed is not None and byte_range is None and len(parsed.ranges) == 1:
+            headers['Content-Range'] = f'bytes */{size}'
+            headers['Content-Length'] = '0'
+            return 416, headers, 0, 0
+        if byte_range is not None:
+            start, stop = byte_range
+            length, status = stop - start, 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    headers['Content-Length'] = str(length)
+    return status, headers, start, length
+
+
+def offload_response(file_path: str, download_name: str, mode: str,
+                     base_folder: str, accel_prefix: str,
+                     fallback_name: Optional[str] = None) -> Response:
+    """
+    只驗證權限，檔案內容 (含 Range 與條件式請求) 交由前端代理傳送
+
+    Args:
+        file_path: 檔案路徑 (已驗證位於 base_folder 內)
+        download_name: 下載檔名
+        mode: DELIVERY_X_ACCEL 或 DELIVERY_X_SENDFILE
+        base_folder: 下載目錄 (對應 nginx internal location)
+        accel_prefix: nginx internal location 前綴
+        fallback_name: 非 ASCII 檔名無法轉成 ASCII 時使用的 filename= 檔名
+    """
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    response = Response(status=200, mimetype=mimetype)
+    content_disposition(response, download_name, fallback_name)
+
+    if mode == DELIVERY_X_ACCEL:
+        relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(base_folder))
+        response.headers['X-Accel-Redirect'] = (
+            accel_prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+        )
+    else:
+        # HTTP 標頭只能是 ASCII，路徑以百分比編碼 (mod_xsendfile 的 XSendFileUnescape 預設會解碼)
+        response.headers['X-Sendfile'] = quote(os.path.abspath(file_path))
+    return response
+
+
+def send_download(file_path: str, download_name: str, mode: str = DELIVERY_APP,
+                  base_folder: str = '', accel_prefix: str = '/protected-downloads/',
+                  on_close: Optional[Callable[[], None]] = None,
+                  fallback_name: Optional[str] = None) -> Response:
+    """
+    傳送下載檔案
+
+    - app 模式依 plan_file_response() 回應 (ETag / If-Range 與單一 Range 的 206)；
+      回應內容是只涵蓋傳送範圍的 wsgi.file_wrapper，gunicorn 以 sendfile() 傳送，
+      檔案內容不經過 Python，續傳也能使用 sendfile()
+    - x-accel-redirect / x-sendfile 模式由前端代理傳送，應用程式的執行緒立即釋放
+
+    Args:
+        file_path: 檔案路徑 (呼叫端需先驗證安全性)
+        download_name: 下載檔名
+        mode: 傳送模式 (DELIVERY_MODES)
+        base_folder: 下載目錄 (x-accel-redirect 模式用於計算相對路徑)
+        accel_prefix: nginx internal location 前綴
+        on_close: 回應傳送結束 (或連線中斷) 時呼叫。direct_passthrough 的回應不會執行
+                  Response.call_on_close()，因此由回應內容的 close() 觸發
+        fallback_name: 非 ASCII 檔名無法轉成 ASCII 時使用的 filename= 檔名 (如任務 ID 加副檔名)
+
+    Returns:
+        Response: 檔案回應 (Range 超出檔案大小時為 416)
+    """
+    if mode in (DELIVERY_X_ACCEL, DELIVERY_X_SENDFILE):
+        response = offload_response(file_path, download_name, mode, base_folder, accel_prefix, fallback_name)
+        if on_close is not None:
+            response.call_on_close(on_close)
+        return response
+
+    status, headers, start, length = plan_file_response(file_path, download_name, request.headers, fallback_name)
+    if status in (304, 416):
+        response = Response(status=status, headers=headers)
+        if on_close is not None:
+            response.call_on_close(on_close)
+        return response
+
+    # 無 file_wrapper 的伺服器：由 werkzeug 的 FileWrapper 逐段讀取
+    file_wrapper = request.environ.get('wsgi.file_wrapper', FileWrapper)
+    return Response(
+        file_wrapper(FileRange(file_path, start, length, on_close), FALLBACK_BLOCK_SIZE),
+        status=status,
+        headers=headers,
+        direct_passthrough=True
+    )
@@ -0,0 +1,340 @@
+"""
+下載目錄容量管理模組
+下載目錄超過容量預算的高水位 (或磁碟剩餘空間不足) 時，依最近存取時間 (LRU) 刪除檔案直到低水位；
+下載中或傳送中的檔案不會被刪除
+"""
+import os
+import time
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有同一行程內的釘選有效
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 多個行程共用下載目錄時，同一時間只由一個行程執行刪除
+LOCK_FILENAME = '.eviction.lock'
+
+
+class FilePin:
+    """
+    釘選中的檔案 (release() 後才可被刪除)
+
+    同一行程內以參考計數記錄；支援 fcntl 的平台另持有共享鎖定，
+    其他行程的 EvictionManager 也會略過此檔案
+    """
+
+    def __init__(self, manager: 'EvictionManager', path: str):
+        self._manager = manager
+        self.path = path
+        self._handle = None
+        if fcntl is not None:
+            try:
+                self._handle = open(path, 'rb')
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_SH)
+            except OSError:
+                self._close()
+
+    def release(self) -> None:
+        """解除釘選 (可重複呼叫)"""
+        if self._manager is None:
+            return
+        self._manager._unpin(self.path)
+        self._manager = None
+        self._close()
+
+    def _close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self) -> 'FilePin':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class EvictionManager:
+    """
+    下載目錄容量管理 (執行緒安全)
+
+    - 目錄總大小超過 max_bytes * high_watermark，或磁碟剩餘空間低於 min_free_bytes 時觸發刪除，
+      直到總大小低於 max_bytes * low_watermark 且剩餘空間回到 min_free_bytes 的兩倍
+    - 刪除順序依最近存取時間；touch() 以 os.utime 更新存取時間，
+      不受 noatime 掛載選項影響，重啟後與其他行程也能看到
+    - 略過：pin() 釘選中的檔案、其他行程持有鎖定的檔案 (下載中的 .part 與傳送中的檔案)、
+      min_age 秒內修改過的檔案 (寫入中的暫存檔)
+    - added() 登記新完成的檔案，超過高水位時立即喚醒刪除執行緒；
+      另每 poll_interval 秒檢查一次 (多個行程時只由當選的行程執行)，涵蓋下載中持續變大的檔案
+    - max_idle 大於 0 時，超過該秒數未被存取的檔案也會被刪除
+    """
+
+    def __init__(self, folder: str, max_bytes: int, high_watermark: float = 0.9,
+                 low_watermark: float = 0.7, min_free_bytes: int = 512 * 1024 * 1024,
+                 min_age: float = 600, max_idle: float = 0, poll_interval: float = 60,
+                 name: str = 'eviction'):
+        if not 0 < low_watermark <= high_watermark <= 1:
+            raise ValueError('水位必須符合 0 < low_watermark <= high_watermark <= 1')
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.min_free_bytes = min_free_bytes
+        self.min_age = min_age
+        self.max_idle = max_idle
+        self.poll_interval = poll_interval
+        self.name = name
+
+        self._pins: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._wake = False
+        self._thread: Optional[threading.Thread] = None
+        self._elected: Optional[Callable[[], bool]] = None
+        self._usage: Optional[int] = None  # 上次掃描的總大小加上之後登記的檔案
+        self.runs = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_run: Optional[float] = None
+
+    # ---- 存取與釘選 ----
+
+    def touch(self, path: str) -> None:
+        """記錄檔案被使用 (只更新存取時間，保留修改時間供快取驗證)"""
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    def pin(self, path: str) -> FilePin:
+        """
+        釘選檔案直到 release()，並記錄為最近存取
+
+        Args:
+            path: 檔案路徑
+
+        Returns:
+            FilePin: 可作為 context manager 使用
+        """
+        path = os.path.abspath(path)
+        with self._cond:
+            self._pins[path] = self._pins.get(path, 0) + 1
+        self.touch(path)
+        return FilePin(self, path)
+
+    def _unpin(self, path: str) -> None:
+        with self._cond:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    def added(self, path: str) -> None:
+        """登記新完成的檔案，超過水位時喚醒刪除執行緒"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._cond:
+            if self._usage is not None:
+                self._usage += size
+            if self._usage is None or self._over_high(self._usage):
+                self._wake = True
+                self._cond.notify()
+
+    # ---- 背景執行緒 ----
+
+    def start(self, elected: Optional[Callable[[], bool]] = None) -> None:
+        """
+        啟動刪除執行緒 (重複呼叫無作用)
+
+        Args:
+            elected: 返回此行程是否負責定期檢查 (如 LeaderLock.acquire)；
+                     未當選的行程只在 added() 喚醒時檢查。None 表示一律檢查
+        """
+        with self._cond:
+            self._elected = elected
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-thread', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        woken = False  # 啟動時當選的行程立即檢查一次
+        while True:
+            if woken or self._elected is None or self._elected():
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f'下載目錄容量檢查失敗: {e}', exc_info=True)
+            with self._cond:
+                woken = self._cond.wait_for(lambda: self._wake, timeout=self.poll_interval)
+                self._wake = False
+
+    # ---- 檢查與刪除 ----
+
+    def _over_high(self, usage: int) -> bool:
+        return self.max_bytes > 0 and usage > self.max_bytes * self.high_watermark
+
+    def _free_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.folder).free
+        except OSError:
+            return self.min_free_bytes * 2
+
+    def check(self) -> int:
+        """
+        檢查水位與閒置檔案，需要時刪除
+
+        Returns:
+            int: 刪除的檔案數
+        """
+        entries = self._scan()
+        usage = sum(entry['size'] for entry in entries)
+        free = self._free_bytes()
+        with self._cond:
+            self._usage = usage
+
+        now = time.time()
+        idle = [e for e in entries if self.max_idle > 0 and now - e['accessed'] > self.max_idle]
+        idle_paths = {e['path'] for e in idle}
+        pressure = self._over_high(usage) or free < self.min_free_bytes
+        if not idle and not pressure:
+            return 0
+
+        with self._exclusive() as acquired:
+            if not acquired:
+                return 0  # 其他行程正在刪除
+            self.runs += 1
+            self.last_run = now
+            removed = removed_bytes = 0
+
+            for entry in idle:
+                if self._evict(entry, now):
+                    removed += 1
+                    removed_bytes += entry['size']
+                    usage -= entry['size']
+                    logger.info(f'清理閒置檔案: {entry["name"]}')
+
+            if pressure:
+                # 刪除到低水位 (依最近存取時間，由舊到新)
+                target_usage = self.max_bytes * self.low_watermark if self.max_bytes > 0 else None
+                target_free = self.min_free_bytes * 2
+                freed = removed_bytes
+                for entry in sorted(entries, key=lambda e: e['accessed']):
+                    if ((target_usage is None or usage <= target_usage)
+                            and free + freed >= target_free):
+                        break
+                    if entry['path'] in idle_paths or not self._evict(entry, now):
+                        continue
+                    removed += 1
+                    removed_bytes += entry['size']
+                    usage -= entry['size']
+                    freed += entry['size']
+                    logger.info(f'容量不足，刪除最久未使用的檔案: {entry["name"]}')
+
+            with self._cond:
+                self._usage = usage
+            self.evicted_files += removed
+            self.evicted_bytes += removed_bytes
+            if removed:
+                logger.info(
+                    f'下載目錄清理完成: 刪除 {removed} 個檔案 ({removed_bytes / 1024 / 1024:.1f} MB)，'
+                    f'目前 {usage / 1024 / 1024:.1f} MB'
+                )
+            elif pressure:
+                logger.warning('下載目錄超過容量上限，但沒有可刪除的檔案 (皆在使用中)')
+            return removed
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        entries = []
+        try:
+            with os.scandir(self.folder) as it:
+                for item in it:
+                    if item.name.startswith('.'):
+                        continue
+                    try:
+                        if not item.is_file(follow_symlinks=False):
+                            continue
+                        stat = item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append({
+                        'name': item.name,
+                        'path': item.path,
+                        'size': stat.st_size,
+                        'modified': stat.st_mtime,
+                        'accessed': max(stat.st_atime, stat.st_mtime),
+                    })
+        except OSError as e:
+            logger.warning(f'無法掃描下載目錄: {e}')
+        return entries
+
+    def _evict(self, entry: Dict[str, Any], now: float) -> bool:
+        """刪除單一檔案；使用中或剛修改過的檔案返回 False"""
+        path = entry['path']
+        if now - entry['modified'] < self.min_age:
+            return False
+        with self._cond:
+            if path in self._pins:
+                return False
+        try:
+            if fcntl is None:
+                os.remove(path)
+                return True
+            with open(path, 'rb') as handle:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False  # 其他行程下載或傳送中
+                os.remove(path)
+                return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f'無法刪除檔案 {entry["name"]}: {e}')
+            return False
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[bool]:
+        """多個行程之間只有一個執行刪除；無法取得時返回 False"""
+        if fcntl is None:
+            yield True
+            return
+        try:
+            handle = open(os.path.join(self.folder, LOCK_FILENAME), 'a')
+        except OSError:
+            yield False
+            return
+        with handle:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            yield True
+
+    def stats(self) -> Dict[str, Any]:
+        """返回容量管理統計資訊"""
+        with self._cond:
+            usage = self._usage
+            pinned = len(self._pins)
+        return {
+            'usage_bytes': usage,
+            'max_bytes': self.max_bytes,
+            'high_watermark': self.high_watermark,
+            'low_watermark': self.low_watermark,
+            'min_free_bytes': self.min_free_bytes,
+            'pinned': pinned,
+            'runs': self.runs,
+            'evicted_files': self.evicted_files,
+            'evicted_bytes': self.evicted_bytes,
+            'last_run': self.last_run,
+        }
@@ -0,0 +1,17 @@
+"""
+gunicorn 設定
+gunicorn 啟動時自動讀取目前目錄下的 gunicorn.conf.py；啟動腳本也以 -c 明確指定
+"""
+
+
+def post_worker_init(worker):
+    """
+    worker 載入應用程式後立即啟動此行程的背景服務 (容量管理、定期清理、進度通知)
+
+    --preload 時主行程只建立應用程式、不啟動執行緒，背景服務在此於各 worker 中啟動，
+    不必等到第一個請求；沒有 --preload 時應用程式在 worker 中建立，同樣在此啟動
+    """
+    import app_pytubefix
+    app_pytubefix.start_services(worker.wsgi)
+    # 每個進度串流佔用一個執行緒，依此 worker 的執行緒數限制串流數
+    app_pytubefix.limit_stream_threads(worker.wsgi, worker.cfg.threads)
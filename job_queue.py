@@ -0,0 +1,255 @@
+"""
+持久化下載工作佇列
+以 SQLite (WAL) 儲存待執行的下載工作，讓 web 行程只負責排入工作，
+由獨立的 worker 行程 (worker.py) 取出執行
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 工作狀態
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    SQLite 持久化工作佇列 (多行程安全)
+
+    - enqueue() 排入工作；claim() 以 BEGIN IMMEDIATE 原子性地取出最舊的工作
+    - 執行中的工作需定期 heartbeat()，worker 當機後 requeue_stale() 會把逾時的工作重新排入
+    - 超過 max_attempts 的工作標記為失敗
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_id TEXT,
+            last_error TEXT,
+            enqueued_at REAL NOT NULL,
+            heartbeat_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+        CREATE INDEX IF NOT EXISTS idx_jobs_task_id ON jobs(task_id);
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, busy_timeout: float = 10.0):
+        self.path = os.path.abspath(path)
+        self.max_attempts = max_attempts
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._schema_ready = False  # 第一次連線時才建立目錄與資料表 (導入時不產生檔案)
+
+    def _connect(self) -> sqlite3.Connection:
+        """取得目前執行緒 (與行程) 專用的連線"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None and local.pid == os.getpid():
+            return conn
+
+        if not self._schema_ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._schema_ready:
+            conn.executescript(self.SCHEMA)
+            self._schema_ready = True
+        local.conn = conn
+        local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, task_id: str, payload: Dict[str, Any]) -> int:
+        """
+        排入工作
+
+        Args:
+            task_id: 對應的任務 ID
+            payload: 執行工作所需的參數
+
+        Returns:
+            int: 工作 ID
+        """
+        cursor = self._connect().execute(
+            'INSERT INTO jobs (task_id, payload, status, enqueued_at) VALUES (?, ?, ?, ?)',
+            (task_id, json.dumps(payload, ensure_ascii=False), JOB_QUEUED, time.time())
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取出最舊的待執行工作並標記為執行中
+
+        Args:
+            worker_id: 執行者識別 (如 hostname:pid)
+
+        Returns:
+            Optional[dict]: 工作 (id, task_id, payload, attempts)，佇列為空時返回 None
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, task_id, payload, attempts FROM jobs WHERE status = ? ORDER BY id LIMIT 1',
+                (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute(
+                'UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, heartbeat_at = ? '
+                'WHERE id = ?',
+                (JOB_RUNNING, worker_id, now, row['id'])
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+        return {
+            'id': row['id'],
+            'task_id': row['task_id'],
+            'payload': json.loads(row['payload']),
+            'attempts': row['attempts'] + 1,
+        }
+
+    def heartbeat(self, worker_id: str) -> None:
+        """更新此 worker 所有執行中工作的心跳時間"""
+        self._connect().execute(
+            'UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND worker_id = ?',
+            (time.time(), JOB_RUNNING, worker_id)
+        )
+
+    def complete(self, job_id: int) -> None:
+        """標記工作完成"""
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, heartbeat_at = ? WHERE id = ?',
+            (JOB_DONE, time.time(), job_id)
+        )
+
+    def fail(self, job_id: int, error: str, retry: bool = True) -> bool:
+        """
+        標記工作失敗
+
+        Args:
+            job_id: 工作 ID
+            error: 錯誤訊息
+            retry: 未超過嘗試次數時是否重新排入
+
+        Returns:
+            bool: 是否已重新排入佇列
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        requeue = retry and row is not None and row['attempts'] < self.max_attempts
+        conn.execute(
+            'UPDATE jobs SET status = ?, last_error = ?, worker_id = NULL WHERE id = ?',
+            (JOB_QUEUED if requeue else JOB_FAILED, str(error)[:500], job_id)
+        )
+        return requeue
+
+    def release(self, job_id: int) -> None:
+        """
+        將執行中的工作放回佇列，不計入嘗試次數
+
+        用於 worker 為了回收行程池而中斷、但本身沒有失敗的工作
+        """
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, worker_id = NULL, attempts = MAX(0, attempts - 1) '
+            'WHERE id = ? AND status = ?',
+            (JOB_QUEUED, job_id, JOB_RUNNING)
+        )
+
+    def requeue_stale(self, stale_seconds: float) -> List[Dict[str, Any]]:
+        """
+        將心跳逾時的執行中工作重新排入 (worker 當機或被終止)
+
+        Args:
+            stale_seconds: 心跳逾時秒數
+
+        Returns:
+            list: 逾時的工作 (id, task_id, requeued)；requeued 為 False 表示超過嘗試次數而標記為失敗
+        """
+        conn = self._connect()
+        cutoff = time.time() - stale_seconds
+        stale = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT id, task_id, attempts FROM jobs WHERE status = ? AND heartbeat_at < ?',
+                (JOB_RUNNING, cutoff)
+            ).fetchall()
+            for row in rows:
+                if row['attempts'] < self.max_attempts:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, worker_id = NULL, last_error = ? WHERE id = ?',
+                        (JOB_QUEUED, 'worker 心跳逾時', row['id'])
+                    )
+                    logger.warning(f'重新排入逾時工作: job={row["id"]}, task={row["task_id"]}')
+                else:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, last_error = ? WHERE id = ?',
+                        (JOB_FAILED, 'worker 心跳逾時，超過重試次數', row['id'])
+                    )
+                stale.append({
+                    'id': row['id'],
+                    'task_id': row['task_id'],
+                    'requeued': row['attempts'] < self.max_attempts,
+                })
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return stale
+
+    def position(self, job_id: int) -> Optional[int]:
+        """
+        查詢工作在佇列中的位置 (1 為下一個)
+
+        Returns:
+            Optional[int]: 位置，工作不在等待中則返回 None
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row['status'] != JOB_QUEUED:
+            return None
+        return conn.execute(
+            'SELECT COUNT(*) FROM jobs WHERE status = ? AND id <= ?', (JOB_QUEUED, job_id)
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """返回各狀態的工作數量"""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        for row in self._connect().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status'):
+            counts[row['status']] = row['n']
+        return counts
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """
+        刪除已結束 (完成或失敗) 的舊工作
+
+        Returns:
+            int: 刪除筆數
+        """
+        cursor = self._connect().execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND enqueued_at < ?',
+            (JOB_DONE, JOB_FAILED, time.time() - older_than_seconds)
+        )
+        return cursor.rowcount
@@ -0,0 +1,84 @@
+"""
+行程選舉模組
+多個 gunicorn worker 共用同一台機器時，以檔案鎖定選出唯一一個執行定期清理的行程；
+該行程結束後鎖定自動釋放，其他行程下次檢查時接手
+"""
+import os
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有單一行程，永遠當選
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    以 flock 選出的領導行程 (執行緒安全)
+
+    - acquire() 不會等待：已持有或成功取得鎖定時返回 True
+    - 鎖定持有到行程結束 (或 release())，不需心跳
+    - fork 後子行程不沿用父行程的身分，需自行 acquire()
+    """
+
+    def __init__(self, path: str, name: str = 'leader'):
+        self.path = os.path.abspath(path)
+        self.name = name
+        self._handle = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """
+        嘗試成為領導行程
+
+        Returns:
+            bool: 此行程是否為領導行程
+        """
+        if fcntl is None:
+            return True
+        with self._lock:
+            if self._handle is not None and self._pid == os.getpid():
+                return True
+            self._close()
+            try:
+                handle = open(self.path, 'a')
+            except OSError as e:
+                logger.warning(f'無法開啟選舉鎖定檔案 {self.path}: {e}')
+                return False
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            self._handle = handle
+            self._pid = os.getpid()
+            logger.info(f'行程 {self._pid} 當選 {self.name}')
+            return True
+
+    @property
+    def is_leader(self) -> bool:
+        """此行程目前是否持有鎖定 (不嘗試取得)"""
+        with self._lock:
+            return fcntl is None or (self._handle is not None and self._pid == os.getpid())
+
+    def release(self) -> None:
+        """放棄領導身分"""
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._handle is None:
+            return
+        if self._pid == os.getpid():
+            try:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            except OSError:
+                pass
+        # fork 繼承的檔案描述子只關閉，鎖定仍屬於父行程
+        self._handle.close()
+        self._handle = None
+        self._pid = None
@@ -0,0 +1,163 @@
+"""
+影片資訊快取模組
+提供有上限的 LRU + TTL 快取，並合併同一影片 ID 的並發查詢
+"""
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingLoad:
+    """進行中的查詢，讓並發的相同請求共用結果"""
+
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class MetadataCache:
+    """
+    影片資訊快取 (執行緒安全)
+
+    - 最多保留 max_entries 筆，超過時淘汰最久未使用者
+    - 每筆記錄在 ttl 秒後過期
+    - 同一個鍵同時只會有一次查詢，其餘請求等待並共用結果
+    - 查詢失敗不會被快取
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 1800):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._pending: Dict[Hashable, _PendingLoad] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        查詢快取 (不觸發載入)
+
+        Args:
+            key: 快取鍵 (影片 ID)
+
+        Returns:
+            Optional[Any]: 未過期的快取值，否則返回 None
+        """
+        with self._lock:
+            return self._get_locked(key)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        取得快取值，未命中時呼叫 loader 載入
+
+        Args:
+            key: 快取鍵 (影片 ID)
+            loader: 載入函數，失敗時拋出例外
+
+        Returns:
+            Any: 快取值或 loader 的返回值
+
+        Raises:
+            Exception: loader 拋出的例外 (並發等待者也會收到相同例外)
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                return value
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                pending = _PendingLoad()
+                self._pending[key] = pending
+                is_leader = True
+
+        if not is_leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = loader()
+            pending.value = value
+            self.set(key, value)
+            return value
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.event.set()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """寫入快取"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """移除單筆快取"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self) -> int:
+        """
+        清除所有過期記錄
+
+        Returns:
+            int: 清除的筆數
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回快取統計資訊"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _get_locked(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
@@ -0,0 +1,206 @@
+"""
+進度通知模組
+每個行程一個通知執行緒讀取被訂閱任務的狀態，變化時推送給所有訂閱者；
+進度串流 (SSE) 只等待自己的訂閱，不各自輪詢任務儲存
+"""
+import json
+import asyncio
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 尚未推送任何狀態
+_EMPTY = object()
+
+
+class Subscription:
+    """
+    一個進度串流對單一任務的訂閱
+
+    只保留最新的任務狀態 (慢速的串流略過中間的進度)；任務已被刪除時為 None。
+    以 loop 建立的訂閱在該事件迴圈上以 get_async() 等待，其餘以 get() 在執行緒中等待
+    """
+
+    def __init__(self, notifier: 'ProgressNotifier', task_id: str,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.task_id = task_id
+        self._notifier: Optional['ProgressNotifier'] = notifier
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._latest: Any = _EMPTY
+        self._event = asyncio.Event() if loop is not None else threading.Event()
+
+    def _publish(self, task: Optional[Dict[str, Any]]) -> None:
+        """由通知執行緒呼叫"""
+        with self._lock:
+            self._latest = task
+        if self._loop is None:
+            self._event.set()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # 事件迴圈已關閉
+
+    def _take(self) -> Any:
+        with self._lock:
+            task, self._latest = self._latest, _EMPTY
+            self._event.clear()
+        return task
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        等待任務狀態變化
+
+        Returns:
+            dict | None: 最新的任務狀態 (含排隊位置)，任務已被刪除時為 None
+
+        Raises:
+            TimeoutError: timeout 秒內沒有變化
+        """
+        self._event.wait(timeout)
+        task = self._take()
+        if task is _EMPTY:
+            raise TimeoutError
+        return task
+
+    async def get_async(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """get() 的協程版本 (訂閱時需傳入 loop)"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        task = self._take()
+        if task is _EMPTY:
+            raise TimeoutError
+        return task
+
+    def close(self) -> None:
+        """取消訂閱 (可重複呼叫)"""
+        if self._notifier is not None:
+            notifier, self._notifier = self._notifier, None
+            notifier._unsubscribe(self)
+
+    def __enter__(self) -> 'Subscription':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ProgressNotifier:
+    """
+    任務進度的共用通知 (執行緒安全)
+
+    - 通知執行緒每 poll_interval 秒以 load 讀取一次被訂閱的任務 (同一任務不論有多少訂閱者只讀取一次)，
+      涵蓋其他行程 (queue 模式的 worker.py、其他 gunicorn worker) 寫入的變化
+    - notify() 在此行程更新任務後立即喚醒通知執行緒，不必等到下一次輪詢
+    - 狀態 (JSON 序列化後比較) 有變化時才推送；新的訂閱立即收到目前狀態
+    - 沒有訂閱時通知執行緒只等待，不讀取任務儲存
+    """
+
+    def __init__(self, load: Callable[[str], Optional[Dict[str, Any]]], poll_interval: float = 0.5,
+                 max_subscriptions: int = 500, name: str = 'progress-notifier'):
+        """
+        Args:
+            load: 讀取任務狀態 (在通知執行緒中呼叫)，任務不存在時返回 None
+            poll_interval: 讀取被訂閱任務的間隔 (秒)
+            max_subscriptions: 同時訂閱的上限 (0 = 不提供訂閱)
+            name: 通知執行緒名稱
+        """
+        self.load = load
+        self.poll_interval = poll_interval
+        self.max_subscriptions = max_subscriptions
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._count = 0
+        self._latest: Dict[str, Tuple[Optional[str], Optional[Dict[str, Any]]]] = {}
+        self._dirty: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """啟動通知執行緒 (重複呼叫無作用)"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def subscribe(self, task_id: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[Subscription]:
+        """
+        訂閱任務進度
+
+        Args:
+            task_id: 任務 ID
+            loop: 以協程等待時所在的事件迴圈
+
+        Returns:
+            Subscription | None: 訂閱 (使用完畢需 close())，已達 max_subscriptions 時為 None
+        """
+        subscription = Subscription(self, task_id, loop)
+        with self._cond:
+            if self._count >= self.max_subscriptions:
+                return None
+            self._count += 1
+            self._subscriptions.setdefault(task_id, set()).add(subscription)
+            latest = self._latest.get(task_id)
+            if latest is None:
+                self._dirty.add(task_id)
+                self._cond.notify_all()
+        if latest is not None:
+            subscription._publish(latest[1])
+        return subscription
+
+    def notify(self, task_id: str) -> None:
+        """任務已更新：若有訂閱則立即重新讀取"""
+        with self._cond:
+            if task_id in self._subscriptions:
+                self._dirty.add(task_id)
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        """訂閱數與被訂閱的任務數"""
+        with self._cond:
+            return {'subscriptions': self._count, 'tasks': len(self._subscriptions)}
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        with self._cond:
+            subscriptions = self._subscriptions.get(subscription.task_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            self._count -= 1
+            if not subscriptions:
+                del self._subscriptions[subscription.task_id]
+                self._latest.pop(subscription.task_id, None)
+                self._dirty.discard(subscription.task_id)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscriptions, timeout=None)
+                if not self._dirty:
+                    self._cond.wait_for(lambda: self._dirty, timeout=self.poll_interval)
+                self._dirty.clear()
+                task_ids = list(self._subscriptions)
+
+            for task_id in task_ids:
+                try:
+                    task = self.load(task_id)
+                    payload = None if task is None else json.dumps(task, ensure_ascii=False, sort_keys=True)
+                except Exception as e:
+                    logger.error(f'讀取任務進度失敗 (task_id={task_id}): {e}', exc_info=True)
+                    continue
+
+                with self._cond:
+                    subscriptions = self._subscriptions.get(task_id)
+                    previous = self._latest.get(task_id)
+                    if not subscriptions or (previous is not None and previous[0] == payload):
+                        continue
+                    self._latest[task_id] = (payload, task)
+                    subscriptions = list(subscriptions)
+                for subscription in subscriptions:
+                    subscription._publish(task)
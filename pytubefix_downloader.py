@@ -5,6 +5,9 @@
 from pytubefix import YouTube
 import os
 import subprocess
+import time
+
+from strategy_selector import default_selector as strategy_selector
 
 def convert_to_mp3(input_file, output_file=None, bitrate='192k'):
     """
@@ -90,17 +93,12 @@ def download_video(url, output_path='downloads', quality='highest'):
     print(f'   畫質: {quality}')
     
     # 嘗試多個策略以避免 403 錯誤
-    # 策略 1: WEB 客戶端 + 自動 PoToken (需要 Node.js)
-    # 策略 2: IOS 客戶端 (不需要 PoToken)
-    # 策略 3: ANDROID 客戶端 (不需要 PoToken)
-    strategies = [
-        {'name': 'WEB + PoToken', 'client': 'WEB', 'use_po_token': True},
-        {'name': 'IOS', 'client': 'IOS', 'use_po_token': False},
-        {'name': 'ANDROID', 'client': 'ANDROID', 'use_po_token': False},
-    ]
+    # 策略順序由共用的策略選擇器決定，斷路器開啟中的策略會被跳過
+    strategies = strategy_selector.ordered()
     last_error = None
     
     for strategy in strategies:
+        attempt_start = time.monotonic()
         try:
             print(f'   嘗試策略: {strategy["name"]}...')
             # 建立 YouTube 物件
@@ -126,16 +124,19 @@ def download_video(url, output_path='downloads', quality='highest'):
                 raise Exception('找不到可用的影片串流')
             
             print(f'   選擇串流: {stream}')
+            stream_latency = time.monotonic() - attempt_start
             
             # 下載
             os.makedirs(output_path, exist_ok=True)
             file_path = stream.download(output_path=output_path)
+            strategy_selector.record_success(strategy['name'], stream_latency)
             
             print(f'✅ 影片下載完成: {os.path.basename(file_path)}')
             return file_path
             
         except Exception as e:
             last_error = e
+            strategy_selector.record_failure(strategy['name'], e, time.monotonic() - attempt_start)
             print(f'⚠️  {strategy["name"]} 策略失敗: {e}')
             continue
     
@@ -159,15 +160,12 @@ def download_audio(url, output_path='downloads', bitrate='192k'):
     print(f'   位元率: {bitrate}')
     
     # 嘗試多個策略以避免 403 錯誤
-    strategies = [
-        {'name': 'WEB + PoToken', 'client': 'WEB', 'use_po_token': True},
-        {'name': 'IOS', 'client': 'IOS', 'use_po_token': False},
-        {'name': 'ANDROID', 'client': 'ANDROID', 'use_po_token': False},
-    ]
+    strategies = strategy_selector.ordered()
     last_error = None
     audio_file = None
     
     for strategy in strategies:
+        attempt_start = time.monotonic()
         try:
             print(f'   嘗試策略: {strategy["name"]}...')
             # 建立 YouTube 物件
@@ -188,17 +186,20 @@ def download_audio(url, output_path='downloads', bitrate='192k'):
             print(f'   音訊格式: {stream.mime_type}')
             print(f'   音訊編碼: {stream.audio_codec}')
             print(f'   位元率: {stream.abr}')
+            stream_latency = time.monotonic() - attempt_start
             
             # 下載音訊
             os.makedirs(output_path, exist_ok=True)
             audio_file = stream.download(output_path=output_path)
+            strategy_selector.record_success(strategy['name'], stream_latency)
             
             print(f'✅ 音訊下載完成: {os.path.basename(audio_file)}')
             break
             
         except Exception as e:
             last_error = e
-            print(f'⚠️  {client} 客戶端失敗: {e}')
+            strategy_selector.record_failure(strategy['name'], e, time.monotonic() - attempt_start)
+            print(f'⚠️  {strategy["name"]} 策略失敗: {e}')
             continue
     
     if not audio_file:
@@ -0,0 +1,460 @@
+"""
+多連線分段下載模組
+將已知大小的串流切成多個位元組範圍，以多條連線並行下載並寫入預先配置的檔案；
+下載中的檔案為 .part，並以旁置的狀態檔記錄進度，失敗後 (包含行程重啟) 可從中斷處續傳
+"""
+import os
+import json
+import time
+import threading
+import logging
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.request import Request, urlopen
+
+try:
+    import fcntl
+except ImportError:  # Windows：不鎖定 .part 檔
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 範圍請求方式
+RANGE_STYLE_HEADER = 'header'  # 標準 HTTP Range 標頭 (回應 206)
+RANGE_STYLE_QUERY = 'query'    # googlevideo 的 &range=start-end 查詢參數
+
+READ_BLOCK_SIZE = 64 * 1024
+
+# 下載中的檔案與進度狀態檔
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.json'
+STATE_VERSION = 1
+
+# 進度狀態檔的寫入間隔 (秒)；每個範圍完成時也會寫入
+STATE_SAVE_INTERVAL = 1.0
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0',
+    'Accept-Language': 'en-US,en',
+}
+
+
+class RangedDownloadError(Exception):
+    """
+    分段下載失敗
+
+    Attributes:
+        bytes_done: 已保存在 .part 檔的位元組數 (大於 0 時之後的重試可續傳)
+    """
+
+    def __init__(self, message: str, bytes_done: int = 0):
+        super().__init__(message)
+        self.bytes_done = bytes_done
+
+
+def split_ranges(total_size: int, segment_size: int) -> List[Tuple[int, int]]:
+    """
+    將檔案切成包含頭尾的位元組範圍
+
+    Args:
+        total_size: 檔案大小
+        segment_size: 每段大小
+
+    Returns:
+        list: [(start, end)]，end 為包含
+    """
+    return [
+        (start, min(start + segment_size, total_size) - 1)
+        for start in range(0, total_size, segment_size)
+    ]
+
+
+def part_paths(output_file: str) -> Tuple[str, str]:
+    """返回 (.part 檔, 進度狀態檔) 路徑"""
+    part_file = output_file + PART_SUFFIX
+    return part_file, part_file + STATE_SUFFIX
+
+
+def _load_state(state_file: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state_file: str, state: Dict[str, Any]) -> None:
+    """先寫入暫存檔再取代，行程中斷時不會留下不完整的狀態檔"""
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def discard_partial(directory: str, sources: Set[str]) -> List[str]:
+    """
+    刪除指定來源的未完成下載 (.part 與狀態檔)
+
+    由其他方式 (如 yt-dlp 後備) 完成下載後呼叫，不必等到容量清理才移除；
+    其他任務正在寫入 (持有鎖定) 的 .part 會略過
+
+    Args:
+        directory: 下載目錄
+        sources: 來源識別 (與 download() 的 source_id 相同)
+
+    Returns:
+        list: 被刪除的 .part 檔路徑
+    """
+    removed = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return removed
+    for name in names:
+        if not name.endswith(PART_SUFFIX + STATE_SUFFIX):
+            continue
+        state_file = os.path.join(directory, name)
+        state = _load_state(state_file)
+        if not state or state.get('source') not in sources:
+            continue
+        part_file = state_file[:-len(STATE_SUFFIX)]
+        try:
+            handle = open(part_file, 'a+b')
+        except OSError:
+            _remove_quietly(state_file)
+            continue
+        with handle:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+            _remove_quietly(part_file)
+            _remove_quietly(state_file)
+        removed.append(part_file)
+    return removed
+
+
+def _same_file(handle, path: str) -> bool:
+    """已開啟的檔案代碼是否仍對應到 path (等待鎖定期間可能已被其他任務改名)"""
+    try:
+        return os.path.samestat(os.fstat(handle.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+class RangedDownloader:
+    """
+    多連線分段下載器
+
+    - 寫入 <輸出檔>.part，先以 truncate 預先配置為完整大小，各連線以獨立檔案代碼 seek 後寫入
+    - 每個範圍失敗時從已寫入的位置續傳，超過重試次數則整體失敗
+    - 指定 source_id 時以 <輸出檔>.part.json 記錄來源、大小與各範圍已寫入的位元組數；
+      失敗時保留 .part，之後相同來源與大小的下載 (其他策略或重啟後的行程) 從中斷處繼續
+    - 同一個 .part 以檔案鎖定避免多個任務同時寫入 (僅限支援 fcntl 的平台)
+    - 完成後才改名為輸出檔，並刪除狀態檔
+    - 進度回調會被序列化，呼叫端不需自行加鎖
+    """
+
+    def __init__(self, connections: int = 4, segment_size: int = 4 * 1024 * 1024,
+                 max_retries: int = 3, timeout: float = 30,
+                 range_style: str = RANGE_STYLE_HEADER,
+                 headers: Optional[Dict[str, str]] = None):
+        self.connections = max(1, connections)
+        self.segment_size = segment_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.range_style = range_style
+        self.headers = dict(DEFAULT_HEADERS)
+        if headers:
+            self.headers.update(headers)
+
+    def download(self, url: str, output_file: str, total_size: int,
+                 on_progress: Optional[Callable[[int, int], None]] = None,
+                 source_id: Optional[str] = None) -> str:
+        """
+        下載檔案
+
+        Args:
+            url: 來源網址 (續傳時可與上次不同，例如換了客戶端策略)
+            output_file: 輸出檔案路徑
+            total_size: 檔案大小 (必須已知)
+            on_progress: 進度回調 on_progress(已下載位元組, 總位元組)
+            source_id: 來源識別 (如 影片 ID + itag)；指定時保存進度供續傳
+
+        Returns:
+            str: 輸出檔案路徑
+
+        Raises:
+            RangedDownloadError: 任一範圍在重試後仍失敗 (bytes_done 為已保存的位元組數)
+        """
+        if total_size <= 0:
+            raise RangedDownloadError('分段下載需要已知的檔案大小')
+
+        part_file, state_file = part_paths(output_file)
+        with open(part_file, 'a+b') as lock_handle:
+            if fcntl is not None:
+                # 其他任務正在下載相同檔案時等待其結束
+                fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+                if not _same_file(lock_handle, part_file):
+                    # 等待期間其他任務已完成並改名
+                    if os.path.exists(output_file) and os.path.getsize(output_file) == total_size:
+                        logger.info(f'其他任務已完成下載: {os.path.basename(output_file)}')
+                        return output_file
+                    raise RangedDownloadError('下載檔案已被其他任務移除')
+            return self._download_part(url, output_file, part_file, state_file, total_size,
+                                       on_progress, source_id)
+
+    def _download_part(self, url: str, output_file: str, part_file: str, state_file: str,
+                       total_size: int, on_progress: Optional[Callable[[int, int], None]],
+                       source_id: Optional[str]) -> str:
+        """呼叫端需持有 .part 檔的鎖定"""
+        ranges = split_ranges(total_size, self.segment_size)
+
+        # 續傳：來源、大小與切分方式都相同才沿用既有進度
+        saved = _load_state(state_file) if source_id else None
+        if (saved and saved.get('version') == STATE_VERSION and saved.get('source') == source_id
+                and saved.get('size') == total_size and saved.get('segment_size') == self.segment_size
+                and len(saved.get('done', [])) == len(ranges)
+                and os.path.getsize(part_file) == total_size):
+            done = [min(int(n), end - start + 1) for n, (start, end) in zip(saved['done'], ranges)]
+        else:
+            done = [0] * len(ranges)
+            # 預先配置檔案
+            with open(part_file, 'r+b') as f:
+                f.truncate(0)
+                f.truncate(total_size)
+
+        resumed = sum(done)
+        if resumed:
+            logger.info(
+                f'續傳: {os.path.basename(output_file)} 從 {resumed / 1024 / 1024:.1f} MB '
+                f'({resumed * 100 // total_size}%) 繼續'
+            )
+
+        work: Queue = Queue()
+        for index, (start, end) in enumerate(ranges):
+            if done[index] <= end - start:
+                work.put(index)
+
+        state = {'downloaded': resumed, 'error': None, 'saved_at': time.monotonic()}
+        state_lock = threading.Lock()
+        abort = threading.Event()
+
+        def persist() -> None:
+            """呼叫端需持有 state_lock"""
+            if source_id:
+                _save_state(state_file, {
+                    'version': STATE_VERSION,
+                    'source': source_id,
+                    'size': total_size,
+                    'segment_size': self.segment_size,
+                    'done': done,
+                    'updated_at': time.time(),
+                })
+                state['saved_at'] = time.monotonic()
+
+        def report(index: int, length: int) -> None:
+            with state_lock:
+                done[index] += length
+                state['downloaded'] += length
+                segment_complete = done[index] > ranges[index][1] - ranges[index][0]
+                if segment_complete or time.monotonic() - state['saved_at'] >= STATE_SAVE_INTERVAL:
+                    persist()
+                if on_progress:
+                    on_progress(state['downloaded'], total_size)
+
+        def worker() -> None:
+            # 不使用緩衝：寫入後才更新進度，狀態檔記錄的位元組必定已交給作業系統
+            with open(part_file, 'r+b', buffering=0) as fh:
+                while not abort.is_set():
+                    try:
+                        index = work.get_nowait()
+                    except Empty:
+                        return
+                    start, end = ranges[index]
+                    try:
+                        self._fetch_range(url, fh, start + done[index], end,
+                                          lambda length, i=index: report(i, length), abort)
+                    except Exception as e:
+                        with state_lock:
+                            if state['error'] is None:
+                                state['error'] = e
+                        abort.set()
+                        return
+
+        if on_progress and resumed:
+            on_progress(resumed, total_size)
+
+        worker_count = min(self.connections, work.qsize())
+        threads = [
+            threading.Thread(target=worker, name=f'ranged-{i}', daemon=True)
+            for i in range(worker_count)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if state['error'] is not None:
+            with state_lock:
+                if source_id and state['downloaded']:
+                    # 保留 .part 與進度供下次續傳
+                    persist()
+                else:
+                    _remove_quietly(part_file)
+                    _remove_quietly(state_file)
+            raise RangedDownloadError(f'分段下載失敗: {state["error"]}', bytes_done=state['downloaded'])
+
+        os.replace(part_file, output_file)
+        _remove_quietly(state_file)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        fetched = total_size - resumed
+        logger.info(
+            f'分段下載完成: {os.path.basename(output_file)} '
+            f'({total_size / 1024 / 1024:.1f} MB, 續傳 {resumed / 1024 / 1024:.1f} MB, {worker_count} 連線, '
+            f'{fetched / 1024 / 1024 / elapsed:.1f} MB/s)'
+        )
+        return output_file
+
+    def _fetch_range(self, url: str, fh, start: int, end: int,
+                     report: Callable[[int], None], abort: threading.Event) -> None:
+        """下載單一範圍 (從 start 開始)，失敗時從已寫入的位置重試"""
+        position = start
+        attempt = 0
+
+        while position <= end:
+            if abort.is_set():
+                return
+            try:
+                with urlopen(self._build_request(url, position, end), timeout=self.timeout) as response:
+                    if self.range_style == RANGE_STYLE_HEADER and position > 0 and response.status != 206:
+                        raise RangedDownloadError(f'伺服器不支援範圍請求 (HTTP {response.status})')
+                    fh.seek(position)
+                    while position <= end:
+                        block = response.read(min(READ_BLOCK_SIZE, end - position + 1))
+                        if not block:
+                            break
+                        view = memoryview(block)
+                        while view:
+                            view = view[fh.write(view):]
+                        position += len(block)
+                        report(len(block))
+                if position <= end:
+                    raise RangedDownloadError(f'範圍 {start}-{end} 提前結束於 {position}')
+            except RangedDownloadError:
+                if position <= end and attempt < self.max_retries:
+                    attempt += 1
+                    continue
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f'範圍 {position}-{end} 下載失敗，第 {attempt} 次重試: {e}')
+                time.sleep(min(2 ** attempt * 0.5, 8))
+
+    def _build_request(self, url: str, start: int, end: int) -> Request:
+        headers = dict(self.headers)
+        if self.range_style == RANGE_STYLE_QUERY:
+            separator = '&' if '?' in url else '?'
+            url = f'{url}{separator}range={start}-{end}'
+        else:
+            headers['Range'] = f'bytes={start}-{end}'
+        return Request(url, headers=headers)
+
+
+# 測試程式碼：以本機支援 Range 的 HTTP 伺服器驗證分段下載
+if __name__ == '__main__':
+    import hashlib
+    import random
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    payload = os.urandom(10 * 1024 * 1024 + 12345)
+    flaky = {'count': 0, 'sent': 0, 'cut_after': None}
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # 模擬來源中斷：送出指定位元組數後所有請求都失敗
+            if flaky['cut_after'] is not None and flaky['sent'] >= flaky['cut_after']:
+                self.send_error(503)
+                return
+            start, end = 0, len(payload) - 1
+            range_header = self.headers.get('Range')
+            if range_header:
+                start_s, end_s = range_header.replace('bytes=', '').split('-')
+                start, end = int(start_s), int(end_s or end)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+            else:
+                self.send_response(200)
+            body = payload[start:end + 1]
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            # 模擬不穩定的連線：偶爾只送出一半資料
+            flaky['count'] += 1
+            if random.random() < 0.2:
+                body = body[:len(body) // 2]
+            flaky['sent'] += len(body)
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/stream'
+
+    print('=' * 60)
+    print('🧪 分段下載測試 (本機 HTTP 伺服器)')
+    print('=' * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'out.bin')
+        last = {'pct': -10}
+
+        def show(done, total):
+            pct = done * 100 // total
+            if pct >= last['pct'] + 10:
+                last['pct'] = pct
+                print(f'   進度: {pct}%')
+
+        downloader = RangedDownloader(connections=4, segment_size=1024 * 1024, max_retries=5)
+        downloader.download(url, output, len(payload), on_progress=show)
+
+        with open(output, 'rb') as f:
+            ok = hashlib.sha256(f.read()).digest() == hashlib.sha256(payload).digest()
+        print(f'   請求次數: {flaky["count"]}')
+        print('✅ 內容一致' if ok else '❌ 內容不一致')
+
+        # 續傳：第一次下載中途失敗，保留 .part 後由新的下載器 (模擬重啟後的行程) 繼續
+        output = os.path.join(tmp, 'resume.bin')
+        flaky.update(sent=0, cut_after=len(payload) // 2)
+        try:
+            RangedDownloader(connections=4, segment_size=1024 * 1024, max_retries=0).download(
+                url, output, len(payload), source_id='test:140')
+            print('❌ 預期下載失敗')
+        except RangedDownloadError as e:
+            print(f'   中斷: 已保存 {e.bytes_done / 1024 / 1024:.1f} MB，.part 存在: '
+                  f'{os.path.exists(output + PART_SUFFIX)}')
+
+        flaky.update(sent=0, cut_after=None)
+        RangedDownloader(connections=4, segment_size=1024 * 1024, max_retries=5).download(
+            url, output, len(payload), source_id='test:140')
+        with open(output, 'rb') as f:
+            ok = hashlib.sha256(f.read()).digest() == hashlib.sha256(payload).digest()
+        leftovers = [name for name in os.listdir(tmp) if name.startswith('resume.bin.')]
+        print(f'   續傳下載: {flaky["sent"] / 1024 / 1024:.1f} MB，殘留檔案: {leftovers}')
+        print('✅ 續傳內容一致' if ok and not leftovers else '❌ 續傳失敗')
+
+    server.shutdown()
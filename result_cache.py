@@ -0,0 +1,156 @@
+"""
+下載結果快取模組
+以 (影片 ID, 類型, 畫質, 位元率, 輸出格式) 為鍵，重用已完成且仍存在於下載目錄的檔案
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(video_id: str, download_type: str, quality: str,
+                   bitrate: Optional[str], output_format: str) -> str:
+    """
+    產生結果快取鍵
+
+    Args:
+        video_id: 影片 ID (來自 clean_youtube_url)
+        download_type: 下載類型 ('video' 或 'audio')
+        quality: 畫質
+        bitrate: 音訊位元率 (影片模式可為 None)
+        output_format: 輸出格式 (如 'mp3', 'mp4')
+
+    Returns:
+        str: 快取鍵
+    """
+    return ':'.join([video_id, download_type, quality or '', bitrate or '', output_format])
+
+
+class ResultCache:
+    """
+    已完成下載的結果快取 (執行緒安全，LRU 上限)
+
+    每筆記錄保存檔案大小與修改時間，取用時會重新驗證，
+    若檔案已被清理或被同名檔案覆蓋則視為失效。
+    loader 可在本地未命中時查詢其他來源 (如其他行程完成的任務)，
+    返回與 put() 相同格式的記錄 (需包含 file_path / size / mtime)。
+    """
+
+    def __init__(self, download_folder: str, max_entries: int = 500,
+                 loader: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        self.download_folder = os.path.abspath(download_folder)
+        self.max_entries = max_entries
+        self.loader = loader
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢快取
+
+        Args:
+            key: 快取鍵
+
+        Returns:
+            Optional[dict]: 命中時返回記錄副本，否則返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_valid(entry):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry)
+                del self._entries[key]
+                logger.info(f'結果快取失效: {key}')
+
+        # 本地未命中，查詢外部來源 (不持有鎖，避免阻塞其他查詢)
+        entry = self._load(key)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(key, entry)
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, key: str, file_path: str, **metadata) -> None:
+        """
+        寫入快取
+
+        Args:
+            key: 快取鍵
+            file_path: 已完成的檔案路徑
+            **metadata: 額外資訊 (title, author, length 等)
+        """
+        try:
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.warning(f'無法寫入結果快取 {key}: {e}')
+            return
+
+        entry = dict(metadata)
+        entry.update({
+            'file_path': file_path,
+            'filename': os.path.basename(file_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        })
+
+        with self._lock:
+            self._store(key, entry)
+
+    def invalidate(self, key: str) -> None:
+        """移除單筆快取"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """返回快取統計資訊"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """透過 loader 取得並驗證記錄"""
+        if self.loader is None:
+            return None
+        try:
+            entry = self.loader(key)
+        except Exception as e:
+            logger.warning(f'結果快取載入失敗 {key}: {e}')
+            return None
+        if not entry or not {'file_path', 'size', 'mtime'} <= entry.keys():
+            return None
+        entry = dict(entry)
+        entry['file_path'] = os.path.abspath(entry['file_path'])
+        entry.setdefault('filename', os.path.basename(entry['file_path']))
+        return entry if self._is_valid(entry) else None
+
+    def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        """寫入記錄並維持 LRU 上限 (呼叫端需持有鎖)"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _is_valid(self, entry: Dict[str, Any]) -> bool:
+        """驗證檔案仍存在且未被覆蓋"""
+        file_path = entry['file_path']
+        if not file_path.startswith(self.download_folder + os.sep):
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']
@@ -42,4 +42,7 @@ echo "=========================================="
 echo ""
 
 # 啟動 Gunicorn
-exec gunicorn app_pytubefix:app --bind 0.0.0.0:$PORT --workers 1 --timeout 300
+# 任務狀態存放在共用的 SQLite (TASK_STORE_BACKEND=sqlite)，可使用多個 worker
+# 使用 gthread (--threads)，進度推送 (SSE) 的長連線不會佔滿所有 worker
+# --preload：主行程只導入一次，worker 由 fork 產生；背景服務由 gunicorn.conf.py 的 post_worker_init 在各 worker 啟動
+exec gunicorn 'app_pytubefix:create_app()' -c gunicorn.conf.py --preload --bind 0.0.0.0:$PORT --workers ${WEB_CONCURRENCY:-2} --threads ${GUNICORN_THREADS:-16} --timeout 300
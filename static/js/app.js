@@ -9,6 +9,8 @@ const progressBar = document.getElementById('progress-bar');
 const downloadFileBtn = document.getElementById('download-file-btn');
 const videoInfo = document.getElementById('video-info');
 const qualitySelect = document.getElementById('quality-select');
+const formatGroup = document.getElementById('format-group');
+const formatSelect = document.getElementById('format-select');
 
 // 音訊品質選項
 const audioQualities = [
@@ -32,6 +34,7 @@ const videoQualities = [
 
 let currentTaskId = null;
 let progressCheckInterval = null;
+let progressSource = null;
 
 // 貼上按鈕
 pasteBtn.addEventListener('click', async () => {
@@ -72,6 +75,9 @@ function updateQualityOptions(type) {
     });
     
     qualitySelect.appendChild(optgroup);
+    
+    // 音訊格式只在音訊模式顯示
+    formatGroup.style.display = type === 'audio' ? 'block' : 'none';
 }
 
 // 檢查是否為 YouTube 網址
@@ -167,6 +173,7 @@ downloadBtn.addEventListener('click', async () => {
     
     const type = document.querySelector('input[name="type"]:checked').value;
     const quality = qualitySelect.value;
+    const format = type === 'audio' ? formatSelect.value : undefined;
     
     // 重置 UI
     progressSection.style.display = 'block';
@@ -178,7 +185,7 @@ downloadBtn.addEventListener('click', async () => {
         const response = await fetch('/api/download', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ url, type, quality })
+            body: JSON.stringify({ url, type, quality, format })
         });
         
         const result = await response.json();
@@ -192,6 +199,9 @@ downloadBtn.addEventListener('click', async () => {
             // 處理速率限制錯誤
             if (result.error.code === 'RATE_LIMIT_EXCEEDED') {
                 alert('請求過於頻繁，請稍後再試');
+            } else if (result.error.code === 'QUEUE_FULL') {
+                const retryAfter = response.headers.get('Retry-After');
+                alert(retryAfter ? `伺服器忙碌中，請於 ${retryAfter} 秒後再試` : errorMsg);
             } else {
                 alert('下載失敗: ' + errorMsg);
             }
@@ -203,8 +213,56 @@ downloadBtn.addEventListener('click', async () => {
     }
 });
 
-// 開始檢查進度
+// 開始檢查進度 (優先使用 Server-Sent Events，不支援或連線失敗時改用輪詢)
 function startProgressCheck() {
+    stopProgressCheck();
+    
+    if (window.EventSource) {
+        startProgressStream();
+    } else {
+        startProgressPolling();
+    }
+}
+
+// 停止檢查進度
+function stopProgressCheck() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
+    }
+    if (progressCheckInterval) {
+        clearInterval(progressCheckInterval);
+        progressCheckInterval = null;
+    }
+}
+
+// 以 Server-Sent Events 接收進度 (伺服器只在狀態或進度變化時推送)
+function startProgressStream() {
+    const source = new EventSource(`/api/progress/${currentTaskId}/stream`);
+    progressSource = source;
+    
+    source.onmessage = (event) => {
+        handleProgress(JSON.parse(event.data));
+    };
+    
+    source.addEventListener('gone', () => {
+        stopProgressCheck();
+        alert('下載失敗: 任務不存在');
+        resetUI();
+    });
+    
+    source.onerror = () => {
+        // 連線被拒絕 (如 429，或串流名額已滿的 503) 時 EventSource 不會重連，改用輪詢；
+        // 伺服器正常結束串流時瀏覽器會自動重新連線
+        if (source.readyState === EventSource.CLOSED && progressSource === source) {
+            progressSource = null;
+            startProgressPolling();
+        }
+    };
+}
+
+// 以輪詢接收進度
+function startProgressPolling() {
     if (progressCheckInterval) {
         clearInterval(progressCheckInterval);
     }
@@ -212,6 +270,20 @@ function startProgressCheck() {
     progressCheckInterval = setInterval(checkProgress, 1000);
 }
 
+// 處理進度更新
+function handleProgress(data) {
+    updateProgress(data);
+    
+    if (data.status === 'completed') {
+        stopProgressCheck();
+        showDownloadButton();
+    } else if (data.status === 'error') {
+        stopProgressCheck();
+        alert('下載失敗: ' + (data.message || '未知錯誤'));
+        resetUI();
+    }
+}
+
 // 檢查下載進度
 async function checkProgress() {
     if (!currentTaskId) return;
@@ -221,17 +293,7 @@ async function checkProgress() {
         const result = await response.json();
         
         if (result.success && result.data) {
-            const data = result.data;
-            updateProgress(data);
-            
-            if (data.status === 'completed') {
-                clearInterval(progressCheckInterval);
-                showDownloadButton();
-            } else if (data.status === 'error') {
-                clearInterval(progressCheckInterval);
-                alert('下載失敗: ' + (data.message || '未知錯誤'));
-                resetUI();
-            }
+            handleProgress(result.data);
         } else if (result.error) {
             console.error('進度查詢失敗:', result.error.message);
         }
@@ -252,7 +314,10 @@ function updateProgress(data) {
     
     statusText.textContent = statusMap[data.status] || data.message || data.status;
     
-    if (data.status === 'downloading') {
+    if (data.status === 'pending' && data.queue_position) {
+        statusText.textContent = '排隊中...';
+        progressDetails.textContent = `前方還有 ${data.queue_position - 1} 個下載任務`;
+    } else if (data.status === 'downloading') {
         const percent = data.progress || 0;
         progressDetails.textContent = `進度: ${percent.toFixed(1)}%`;
         progressBar.style.width = percent + '%';
@@ -0,0 +1,289 @@
+"""
+pytubefix 客戶端策略選擇模組
+依各策略近期的成功率與延遲動態排序，並以斷路器暫時跳過持續失敗的策略
+"""
+import time
+import threading
+import logging
+from collections import deque
+from urllib.error import URLError
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+# 預設策略 (依原始優先順序)
+# 策略 1: WEB 客戶端 + 自動 PoToken (需要 Node.js)
+# 策略 2: IOS 客戶端 (不需要 PoToken)
+# 策略 3: ANDROID 客戶端 (不需要 PoToken)
+DEFAULT_STRATEGIES = [
+    {'name': 'WEB + PoToken', 'client': 'WEB', 'use_po_token': True},
+    {'name': 'IOS', 'client': 'IOS', 'use_po_token': False},
+    {'name': 'ANDROID', 'client': 'ANDROID', 'use_po_token': False},
+]
+
+# 錯誤分類
+ERROR_FORBIDDEN = '403'
+ERROR_BOT_CHECK = 'bot_check'
+ERROR_NETWORK = 'network'
+ERROR_OTHER = 'other'
+
+# 會計入斷路器的錯誤類型 (影片不存在等與策略無關的錯誤不計入)
+BREAKER_ERROR_CLASSES = {ERROR_FORBIDDEN, ERROR_BOT_CHECK, ERROR_NETWORK}
+
+# 斷路器狀態
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    將例外分類為 403 / bot 檢測 / 網路 / 其他
+
+    Args:
+        error: 策略執行時拋出的例外
+
+    Returns:
+        str: 錯誤類型
+    """
+    message = str(error).lower()
+    code = getattr(error, 'code', None) or getattr(error, 'status', None)
+
+    if code == 403 or '403' in message or 'forbidden' in message:
+        return ERROR_FORBIDDEN
+
+    bot_markers = ('not a bot', 'bot detection', 'botdetection', 'sign in to confirm',
+                   'po token', 'potoken', 'captcha')
+    if any(marker in message for marker in bot_markers) or 'BotDetection' in type(error).__name__:
+        return ERROR_BOT_CHECK
+
+    network_types = (ConnectionError, TimeoutError, URLError)
+    network_markers = ('timed out', 'timeout', 'connection', 'urlopen error', 'temporary failure',
+                       'name resolution', 'network', 'incompleteread', 'max retries')
+    if isinstance(error, network_types) or any(marker in message for marker in network_markers):
+        return ERROR_NETWORK
+
+    return ERROR_OTHER
+
+
+class _StrategyStats:
+    """單一策略的滾動統計與斷路器狀態"""
+
+    __slots__ = ('name', 'window', 'consecutive_failures', 'state', 'open_until',
+                 'cooldown', 'error_counts', 'last_error', 'probe_until')
+
+    def __init__(self, name: str, window_size: int, cooldown: float):
+        self.name = name
+        # (成功與否, 延遲秒數, 錯誤類型)
+        self.window = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.cooldown = cooldown
+        self.error_counts: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+        # half-open 試探的租約到期時間；期間不放行其他呼叫端
+        self.probe_until = 0.0
+
+    def success_rate(self) -> float:
+        if not self.window:
+            return 1.0
+        return sum(1 for ok, _, _ in self.window if ok) / len(self.window)
+
+    def avg_latency(self) -> Optional[float]:
+        latencies = [latency for ok, latency, _ in self.window if ok]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+
+class StrategySelector:
+    """
+    策略選擇器 (執行緒安全)
+
+    - 以滾動視窗記錄每個策略的成功率、成功延遲與各類錯誤次數
+    - ordered() 依成功率 (高到低) 與平均延遲 (低到高) 排序
+    - 連續失敗達門檻時開啟斷路器，冷卻期間跳過該策略；
+      冷卻結束後只放行一個呼叫端試探 (half-open)，成功即關閉，失敗則加倍冷卻時間；
+      試探者在 probe_timeout 秒內沒有回報結果 (例如較前面的策略已成功) 時，再放行下一個呼叫端
+    """
+
+    def __init__(self, strategies: Optional[List[Dict[str, Any]]] = None,
+                 window_size: int = 20, failure_threshold: int = 3,
+                 cooldown: float = 60, max_cooldown: float = 900,
+                 probe_timeout: Optional[float] = None):
+        self.strategies = list(strategies or DEFAULT_STRATEGIES)
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = cooldown if probe_timeout is None else probe_timeout
+        self._stats = {
+            s['name']: _StrategyStats(s['name'], window_size, cooldown)
+            for s in self.strategies
+        }
+        self._lock = threading.Lock()
+
+    def ordered(self) -> List[Dict[str, Any]]:
+        """
+        返回本次應嘗試的策略順序 (已跳過斷路器開啟中、或已有呼叫端在試探的策略)
+
+        Returns:
+            list: 策略列表；所有策略都在冷卻且試探已被其他呼叫端取得時為空列表
+        """
+        now = time.monotonic()
+        with self._lock:
+            available = []
+            for index, strategy in enumerate(self.strategies):
+                stats = self._stats[strategy['name']]
+                if stats.state == CIRCUIT_OPEN and now < stats.open_until:
+                    continue
+                if stats.state != CIRCUIT_CLOSED:
+                    # 冷卻結束，只放行一個試探者
+                    if not self._take_probe(stats, now):
+                        continue
+                available.append((index, strategy, stats))
+
+            if not available:
+                # 全部策略都在冷卻中，放行最快恢復的一個作為試探
+                _, strategy = min(
+                    enumerate(self.strategies),
+                    key=lambda item: self._stats[item[1]['name']].open_until
+                )
+                if not self._take_probe(self._stats[strategy['name']], now):
+                    return []
+                return [strategy]
+
+            available.sort(key=lambda item: self._sort_key(item[0], item[2]))
+            return [strategy for _, strategy, _ in available]
+
+    def record_success(self, name: str, latency: float) -> None:
+        """
+        記錄策略成功
+
+        Args:
+            name: 策略名稱
+            latency: 取得可用串流所花費的秒數
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return
+            stats.window.append((True, latency, None))
+            stats.consecutive_failures = 0
+            if stats.state != CIRCUIT_CLOSED:
+                logger.info(f'策略 {name} 恢復，關閉斷路器')
+            stats.state = CIRCUIT_CLOSED
+            stats.cooldown = self.base_cooldown
+            stats.probe_until = 0.0
+
+    def record_failure(self, name: str, error: BaseException, latency: float) -> str:
+        """
+        記錄策略失敗
+
+        Args:
+            name: 策略名稱
+            error: 失敗的例外
+            latency: 失敗前花費的秒數
+
+        Returns:
+            str: 錯誤類型
+        """
+        error_class = classify_error(error)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return error_class
+            stats.window.append((False, latency, error_class))
+            stats.error_counts[error_class] = stats.error_counts.get(error_class, 0) + 1
+            stats.last_error = str(error)[:200]
+            # 試探者已回報結果，釋放試探租約
+            stats.probe_until = 0.0
+
+            if error_class not in BREAKER_ERROR_CLASSES:
+                return error_class
+
+            stats.consecutive_failures += 1
+            if stats.state == CIRCUIT_HALF_OPEN:
+                # 試探失敗，加倍冷卻時間
+                stats.cooldown = min(stats.cooldown * 2, self.max_cooldown)
+                self._open(stats)
+            elif stats.consecutive_failures >= self.failure_threshold:
+                self._open(stats)
+
+        return error_class
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回各策略狀態 (供 /api/metrics 使用)"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for strategy in self.strategies:
+                stats = self._stats[strategy['name']]
+                latency = stats.avg_latency()
+                result[stats.name] = {
+                    'state': stats.state,
+                    'samples': len(stats.window),
+                    'success_rate': round(stats.success_rate(), 3),
+                    'avg_latency_seconds': round(latency, 3) if latency is not None else None,
+                    'consecutive_failures': stats.consecutive_failures,
+                    'errors': dict(stats.error_counts),
+                    'last_error': stats.last_error,
+                    'retry_in_seconds': round(max(0.0, stats.open_until - now), 1)
+                    if stats.state == CIRCUIT_OPEN else 0,
+                }
+            return {
+                'order': [s['name'] for s in self._peek_order()],
+                'strategies': result,
+            }
+
+    def _peek_order(self) -> List[Dict[str, Any]]:
+        """不改變狀態的排序，開啟中的策略排在最後 (呼叫端需持有鎖)"""
+        def key(item):
+            index, strategy = item
+            stats = self._stats[strategy['name']]
+            return (stats.state == CIRCUIT_OPEN,) + self._sort_key(index, stats)
+        return [strategy for _, strategy in sorted(enumerate(self.strategies), key=key)]
+
+    @staticmethod
+    def _sort_key(index: int, stats: _StrategyStats) -> tuple:
+        """依成功率 (四捨五入到 10%) 與平均延遲排序，相同時保持原始順序"""
+        latency = stats.avg_latency()
+        return (
+            -round(stats.success_rate(), 1),
+            latency if latency is not None else float('inf'),
+            index,
+        )
+
+    def _take_probe(self, stats: _StrategyStats, now: float) -> bool:
+        """
+        取得 half-open 試探資格 (呼叫端需持有鎖)
+
+        Returns:
+            bool: 取得時返回 True 並將策略設為 half-open；其他呼叫端的試探租約未到期時返回 False
+        """
+        if stats.state == CIRCUIT_HALF_OPEN and now < stats.probe_until:
+            return False
+        stats.state = CIRCUIT_HALF_OPEN
+        stats.probe_until = now + self.probe_timeout
+        return True
+
+    def _open(self, stats: _StrategyStats) -> None:
+        stats.state = CIRCUIT_OPEN
+        stats.probe_until = 0.0
+        stats.open_until = time.monotonic() + stats.cooldown
+        logger.warning(
+            f'策略 {stats.name} 連續失敗 {stats.consecutive_failures} 次，'
+            f'斷路器開啟 {stats.cooldown:.0f} 秒'
+        )
+
+
+# 行程內共用的策略選擇器
+default_selector = StrategySelector(
+    window_size=Config.STRATEGY_WINDOW_SIZE,
+    failure_threshold=Config.STRATEGY_FAILURE_THRESHOLD,
+    cooldown=Config.STRATEGY_COOLDOWN_SECONDS,
+    max_cooldown=Config.STRATEGY_MAX_COOLDOWN_SECONDS,
+)
@@ -0,0 +1,501 @@
+"""
+任務狀態儲存模組
+提供行程內記憶體儲存與可跨 gunicorn worker 共用的 SQLite (WAL) 儲存
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 進行中的任務狀態
+ACTIVE_STATUSES = ('pending', 'downloading', 'converting')
+
+# 所有任務狀態
+TASK_STATUSES = ('pending', 'downloading', 'converting', 'completed', 'error')
+
+
+def _created_ts(task: Dict[str, Any]) -> float:
+    """將任務的 created_at (ISO 字串) 轉為 timestamp"""
+    created_at = task.get('created_at')
+    if created_at:
+        try:
+            return datetime.fromisoformat(created_at).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class TaskStoreFullError(Exception):
+    """任務數量已達上限且沒有可淘汰的已結束任務"""
+
+
+# 未設定欄位的標記 (與值為 None 的欄位區分)
+_UNSET = object()
+
+
+class _TaskRecord:
+    """
+    精簡的任務記錄
+
+    常用欄位以 __slots__ 儲存，其餘欄位放在 extra；
+    未設定的欄位不會出現在 to_dict() 的結果中。
+    """
+
+    FIELDS = (
+        'id', 'status', 'url', 'type', 'quality', 'bitrate', 'output_format', 'cache_key',
+        'progress', 'message', 'created_at', 'request_id', 'title', 'author', 'length',
+        'downloaded', 'total', 'file_path', 'filename', 'file_size', 'file_mtime',
+        'follows', 'followers', 'job_id', 'cached', 'batch_id',
+    )
+
+    _FIELD_SET = frozenset(FIELDS)
+
+    __slots__ = FIELDS + ('created_ts', 'extra')
+
+    def __init__(self, task: Dict[str, Any], created_ts: float):
+        self.created_ts = created_ts
+        self.extra: Optional[Dict[str, Any]] = None
+        self.update(task)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        if name in self._FIELD_SET:
+            return getattr(self, name, default)
+        return self.extra.get(name, default) if self.extra else default
+
+    def update(self, fields: Dict[str, Any]) -> None:
+        for name, value in fields.items():
+            if name in self._FIELD_SET:
+                setattr(self, name, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        task = {}
+        for name in self.FIELDS:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                # 列表欄位 (followers) 複製一份，避免呼叫端修改到記錄
+                task[name] = list(value) if isinstance(value, list) else value
+        if self.extra:
+            task.update(self.extra)
+        return task
+
+
+class MemoryTaskStore:
+    """
+    行程內記憶體任務儲存 (單一 worker 使用)
+
+    - 任務以 __slots__ 記錄保存，依建立順序排列，過期清理只需從最舊的一端掃描
+    - 各狀態的任務數量在狀態轉換時更新，count_by_status() 不需掃描所有任務
+    - 以 cache_key 建立索引，合併請求與結果查詢不需掃描所有任務
+    - 任務數量達 max_tasks 時淘汰最舊的已結束任務
+    - 所有操作都在同一把可重入鎖下執行，transaction() 可讓多個操作保持原子性
+    """
+
+    def __init__(self, max_tasks: int = 10000):
+        self.max_tasks = max_tasks
+        self._tasks: 'OrderedDict[str, _TaskRecord]' = OrderedDict()
+        self._status_counts: Dict[str, int] = {status: 0 for status in TASK_STATUSES}
+        self._by_cache_key: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+        self.evicted = 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """讓區塊內的多個操作保持原子性"""
+        with self._lock:
+            yield
+
+    def create(self, task: Dict[str, Any]) -> None:
+        """
+        建立任務
+
+        Raises:
+            TaskStoreFullError: 任務數量已達上限，且所有任務都仍在進行中
+        """
+        with self._lock:
+            if task['id'] in self._tasks:
+                self._remove(task['id'])
+            if len(self._tasks) >= self.max_tasks:
+                self._evict(len(self._tasks) - self.max_tasks + 1)
+
+            record = _TaskRecord(task, _created_ts(task))
+            self._tasks[task['id']] = record
+            self._count(record.status, 1)
+            self._index(record)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._tasks.get(task_id)
+            return record.to_dict() if record is not None else None
+
+    def update(self, task_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        更新任務欄位
+
+        Returns:
+            Optional[dict]: 更新後的任務副本，任務不存在時返回 None
+        """
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return None
+
+            old_status = record.status
+            old_cache_key = record.get('cache_key')
+            record.update(fields)
+
+            if record.status != old_status:
+                self._count(old_status, -1)
+                self._count(record.status, 1)
+            if record.get('cache_key') != old_cache_key:
+                self._unindex(task_id, old_cache_key)
+                self._index(record)
+            return record.to_dict()
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            if task_id in self._tasks:
+                self._remove(task_id)
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._tasks
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._status_counts)
+
+    def find_leader(self, cache_key: str, batch_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        找出相同快取鍵、仍在進行中且非跟隨任務的主任務
+
+        尚未派送 (awaiting_dispatch) 的批次任務只能由同一批次的任務跟隨
+        """
+        with self._lock:
+            candidates = [
+                record for record in (self._tasks[task_id] for task_id in self._by_cache_key.get(cache_key, ()))
+                if record.status in ACTIVE_STATUSES
+                and not record.get('follows')
+                and (not record.get('awaiting_dispatch') or (batch_id and record.get('batch_id') == batch_id))
+            ]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda record: record.created_ts).to_dict()
+
+    def find_completed(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """找出相同快取鍵、最近完成且非跟隨任務的任務"""
+        with self._lock:
+            candidates = [
+                self._tasks[task_id] for task_id in self._by_cache_key.get(cache_key, ())
+                if self._tasks[task_id].status == 'completed'
+                and not self._tasks[task_id].get('follows')
+            ]
+            if not candidates:
+                return None
+            return max(candidates, key=lambda record: record.created_ts).to_dict()
+
+    def delete_created_before(self, cutoff: float) -> List[str]:
+        """
+        刪除建立時間早於 cutoff (timestamp) 的任務
+
+        任務依建立順序排列，從最舊的一端刪除到第一個未過期的任務為止。
+
+        Returns:
+            list: 被刪除的任務 ID
+        """
+        with self._lock:
+            expired = []
+            for task_id, record in self._tasks.items():
+                if record.created_ts >= cutoff:
+                    break
+                expired.append(task_id)
+            for task_id in expired:
+                self._remove(task_id)
+            return expired
+
+    def _evict(self, count: int) -> None:
+        """淘汰最舊的已結束任務 (呼叫端需持有鎖)"""
+        victims = []
+        for task_id, record in self._tasks.items():
+            if len(victims) >= count:
+                break
+            if record.status not in ACTIVE_STATUSES:
+                victims.append(task_id)
+
+        if len(victims) < count:
+            raise TaskStoreFullError(f'任務數量已達上限 ({self.max_tasks})')
+
+        for task_id in victims:
+            self._remove(task_id)
+        self.evicted += len(victims)
+        logger.warning(f'任務數量已達上限，淘汰 {len(victims)} 個已結束的任務')
+
+    def _remove(self, task_id: str) -> None:
+        record = self._tasks.pop(task_id)
+        self._count(record.status, -1)
+        self._unindex(task_id, record.get('cache_key'))
+
+    def _count(self, status: str, delta: int) -> None:
+        self._status_counts[status] = self._status_counts.get(status, 0) + delta
+
+    def _index(self, record: _TaskRecord) -> None:
+        cache_key = record.get('cache_key')
+        if cache_key:
+            self._by_cache_key.setdefault(cache_key, set()).add(record.id)
+
+    def _unindex(self, task_id: str, cache_key: Optional[str]) -> None:
+        if not cache_key:
+            return
+        ids = self._by_cache_key.get(cache_key)
+        if ids is not None:
+            ids.discard(task_id)
+            if not ids:
+                del self._by_cache_key[cache_key]
+
+
+class SQLiteTaskStore:
+    """
+    SQLite 任務儲存 (WAL 模式)，多個 gunicorn worker 可共用同一個資料庫檔案
+
+    - 任務內容以 JSON 儲存，id / status / cache_key / created_at 另存欄位並建立索引
+    - 各狀態的任務數量由觸發器在同一交易內維護於 task_counts，count_by_status() 與 len() 不需掃描所有任務
+    - 任務數量達 max_tasks 時淘汰最舊的已結束任務 (所有 worker 共用同一個上限)
+    - 每個執行緒使用獨立連線，fork 後自動重新連線
+    - transaction() 以 BEGIN IMMEDIATE 取得寫入鎖，區塊內的讀寫保持原子性
+    """
+
+    SCHEMA = """
+        BEGIN IMMEDIATE;
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            cache_key TEXT,
+            follows TEXT,
+            created_at REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+        CREATE INDEX IF NOT EXISTS idx_tasks_cache_key ON tasks(cache_key, status);
+        CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at);
+        CREATE TABLE IF NOT EXISTS task_counts (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        );
+        -- 既有資料庫第一次建立計數表時，以目前的任務初始化
+        INSERT INTO task_counts (status, count)
+            SELECT status, COUNT(*) FROM tasks WHERE NOT EXISTS (SELECT 1 FROM task_counts) GROUP BY status;
+        CREATE TRIGGER IF NOT EXISTS tasks_count_insert AFTER INSERT ON tasks BEGIN
+            INSERT OR IGNORE INTO task_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE task_counts SET count = count + 1 WHERE status = NEW.status;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tasks_count_delete AFTER DELETE ON tasks BEGIN
+            UPDATE task_counts SET count = count - 1 WHERE status = OLD.status;
+        END;
+        CREATE TRIGGER IF NOT EXISTS tasks_count_update AFTER UPDATE OF status ON tasks
+        WHEN OLD.status != NEW.status BEGIN
+            UPDATE task_counts SET count = count - 1 WHERE status = OLD.status;
+            INSERT OR IGNORE INTO task_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE task_counts SET count = count + 1 WHERE status = NEW.status;
+        END;
+        COMMIT;
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 10.0, max_tasks: int = 10000):
+        self.path = os.path.abspath(path)
+        self.busy_timeout = busy_timeout
+        self.max_tasks = max_tasks
+        self.evicted = 0  # 此行程淘汰的任務數
+        self._local = threading.local()
+        self._schema_ready = False  # 第一次連線時才建立目錄與資料表 (導入時不產生檔案)
+
+    def _connect(self) -> sqlite3.Connection:
+        """取得目前執行緒 (與行程) 專用的連線"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None and local.pid == os.getpid():
+            return conn
+
+        if not self._schema_ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        if not self._schema_ready:
+            conn.executescript(self.SCHEMA)
+            self._schema_ready = True
+        local.conn = conn
+        local.pid = os.getpid()
+        local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """讓區塊內的多個操作保持原子性 (可巢狀)"""
+        conn = self._connect()
+        local = self._local
+        if local.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        local.depth += 1
+        try:
+            yield
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        else:
+            local.depth -= 1
+            if local.depth == 0:
+                conn.execute('COMMIT')
+
+    def create(self, task: Dict[str, Any]) -> None:
+        """
+        建立任務
+
+        Raises:
+            TaskStoreFullError: 任務數量已達上限，且所有任務都仍在進行中
+        """
+        with self.transaction():
+            conn = self._connect()
+            # 先刪除再插入 (INSERT OR REPLACE 的隱含刪除不會觸發計數觸發器)
+            conn.execute('DELETE FROM tasks WHERE id = ?', (task['id'],))
+            total = len(self)
+            if total >= self.max_tasks:
+                self._evict(total - self.max_tasks + 1)
+            conn.execute(
+                'INSERT INTO tasks (id, status, cache_key, follows, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (task['id'], task['status'], task.get('cache_key'), task.get('follows'),
+                 _created_ts(task), json.dumps(task, ensure_ascii=False))
+            )
+
+    def _evict(self, count: int) -> None:
+        """淘汰最舊的已結束任務 (呼叫端需在交易中)"""
+        placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+        conn = self._connect()
+        victims = [row[0] for row in conn.execute(
+            f'SELECT id FROM tasks WHERE status NOT IN ({placeholders}) ORDER BY created_at LIMIT ?',
+            ACTIVE_STATUSES + (count,)
+        )]
+        if len(victims) < count:
+            raise TaskStoreFullError(f'任務數量已達上限 ({self.max_tasks})')
+
+        conn.executemany('DELETE FROM tasks WHERE id = ?', [(task_id,) for task_id in victims])
+        self.evicted += len(victims)
+        logger.warning(f'任務數量已達上限，淘汰 {len(victims)} 個已結束的任務')
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        更新任務欄位 (讀取-修改-寫入在同一交易內完成)
+
+        Returns:
+            Optional[dict]: 更新後的任務，任務不存在時返回 None
+        """
+        with self.transaction():
+            task = self.get(task_id)
+            if task is None:
+                return None
+            task.update(fields)
+            self._connect().execute(
+                'UPDATE tasks SET status = ?, cache_key = ?, follows = ?, data = ? WHERE id = ?',
+                (task['status'], task.get('cache_key'), task.get('follows'),
+                 json.dumps(task, ensure_ascii=False), task_id)
+            )
+            return task
+
+    def delete(self, task_id: str) -> None:
+        self._connect().execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+    def __contains__(self, task_id: str) -> bool:
+        row = self._connect().execute('SELECT 1 FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connect().execute('SELECT COALESCE(SUM(count), 0) FROM task_counts').fetchone()[0]
+
+    def count_by_status(self) -> Dict[str, int]:
+        counts = {status: 0 for status in TASK_STATUSES}
+        for status, count in self._connect().execute('SELECT status, count FROM task_counts'):
+            counts[status] = count
+        return counts
+
+    def find_leader(self, cache_key: str, batch_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        找出相同快取鍵、仍在進行中且非跟隨任務的主任務
+
+        尚未派送 (awaiting_dispatch) 的批次任務只能由同一批次的任務跟隨
+        """
+        placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+        row = self._connect().execute(
+            f'SELECT data FROM tasks WHERE cache_key = ? AND status IN ({placeholders}) '
+            f'AND follows IS NULL '
+            f"AND (COALESCE(json_extract(data, '$.awaiting_dispatch'), 0) = 0 "
+            f"OR json_extract(data, '$.batch_id') = ?) "
+            f'ORDER BY created_at LIMIT 1',
+            (cache_key,) + ACTIVE_STATUSES + (batch_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_completed(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """找出相同快取鍵、最近完成且非跟隨任務的任務"""
+        row = self._connect().execute(
+            'SELECT data FROM tasks WHERE cache_key = ? AND status = ? AND follows IS NULL '
+            'ORDER BY created_at DESC LIMIT 1',
+            (cache_key, 'completed')
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_created_before(self, cutoff: float) -> List[str]:
+        """
+        刪除建立時間早於 cutoff (timestamp) 的任務
+
+        Returns:
+            list: 被刪除的任務 ID
+        """
+        with self.transaction():
+            conn = self._connect()
+            expired = [row[0] for row in conn.execute(
+                'SELECT id FROM tasks WHERE created_at < ?', (cutoff,))]
+            conn.execute('DELETE FROM tasks WHERE created_at < ?', (cutoff,))
+            return expired
+
+
+def create_task_store(backend: str, path: Optional[str] = None, max_tasks: int = 10000):
+    """
+    依設定建立任務儲存
+
+    Args:
+        backend: 'memory' 或 'sqlite'
+        path: SQLite 資料庫路徑
+        max_tasks: 保留的任務數量上限 (SQLite 儲存由所有 worker 共用)
+
+    Returns:
+        MemoryTaskStore | SQLiteTaskStore
+    """
+    if backend == 'sqlite':
+        logger.info(f'使用 SQLite 任務儲存: {path}')
+        return SQLiteTaskStore(path, max_tasks=max_tasks)
+    return MemoryTaskStore(max_tasks=max_tasks)
@@ -0,0 +1,20 @@
+"""
+冷啟動檢查 (pytest)
+以 benchmark_startup.py 在全新的直譯器中啟動應用程式，確認導入沒有副作用、
+/health 正常回應，且啟動時間在預算內
+
+使用方式:
+    python -m pytest test_startup.py
+"""
+import sys
+
+from benchmark_startup import check_samples, run_once
+
+# 測試只執行少數幾次，取中位數降低 CI 機器負載造成的波動
+RUNS = 3
+
+
+def test_cold_start():
+    samples = [run_once(sys.executable) for _ in range(RUNS)]
+    failures, _ = check_samples(samples)
+    assert not failures, '\n'.join(failures)
@@ -0,0 +1,792 @@
+"""
+FFmpeg 轉檔模組
+提供以管線 (stdin) 邊下載邊轉換為 MP3 的功能、長音訊的分段並行 MP3 轉換，
+m4a / opus 輸出 (來源編碼相符時直接複製串流，不重新編碼)，以及影像與音訊串流的合併；
+ASGI 模式另有以 asyncio 子行程執行 FFmpeg 的協程版本
+"""
+import os
+import math
+import mmap
+import asyncio
+import shutil
+import tempfile
+import subprocess
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodeError(Exception):
+    """FFmpeg 轉檔失敗"""
+
+
+def _drain_stderr(pipe, tail: deque) -> None:
+    """持續讀取 FFmpeg stderr，避免緩衝區塞滿造成死結，並保留最後幾行供錯誤訊息使用"""
+    try:
+        for line in iter(pipe.readline, b''):
+            tail.append(line.decode('utf-8', errors='ignore').rstrip())
+    except (OSError, ValueError):
+        pass
+    finally:
+        pipe.close()
+
+
+def encode_stream_to_mp3(chunks: Iterable[bytes], output_file: str, bitrate: str = '192k',
+                         timeout: Optional[float] = 300, input_format: Optional[str] = None,
+                         expected_duration: Optional[float] = None) -> str:
+    """
+    將串流資料透過 stdin 餵給 FFmpeg，邊下載邊編碼為 MP3
+
+    輸出先寫入 .part 暫存檔，成功後才改名，避免不完整的檔案被提供下載。
+
+    Args:
+        chunks: 音訊資料區塊 (如 pytubefix Stream.iter_chunks())
+        output_file: 輸出 MP3 檔案路徑
+        bitrate: MP3 位元率
+        timeout: 資料送完後等待 FFmpeg 結束的秒數
+        input_format: 輸入容器格式 (FFmpeg demuxer 名稱)，None 則由 FFmpeg 自動偵測
+        expected_duration: 預期長度 (秒)，用來檢查輸出是否被截斷
+            (moov 位於檔尾的 MP4 無法從管線讀取，FFmpeg 可能只輸出極短的檔案)
+
+    Returns:
+        str: 輸出 MP3 檔案路徑
+
+    Raises:
+        TranscodeError: FFmpeg 執行失敗
+        Exception: 讀取 chunks 時發生的錯誤 (如網路錯誤) 會原樣拋出
+    """
+    temp_file = output_file + '.part'
+
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if input_format:
+        cmd += ['-f', input_format]
+    cmd += [
+        '-i', 'pipe:0',
+        '-vn',
+        '-ar', '44100',
+        '-ac', '2',
+        '-b:a', bitrate,
+        '-f', 'mp3',
+        '-y',
+        temp_file
+    ]
+
+    try:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+    except OSError as e:
+        raise TranscodeError(f'無法啟動 FFmpeg: {e}')
+
+    stderr_tail = deque(maxlen=20)
+    stderr_thread = threading.Thread(target=_drain_stderr, args=(process.stderr, stderr_tail), daemon=True)
+    stderr_thread.start()
+
+    try:
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+            process.stdin.close()
+        except BrokenPipeError:
+            # FFmpeg 已提前結束，下方依返回碼回報錯誤
+            pass
+
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        _remove_quietly(temp_file)
+        raise TranscodeError('MP3 轉換超時')
+    except BaseException:
+        # 下載中斷或其他錯誤：終止 FFmpeg 並清除暫存檔
+        process.kill()
+        process.wait()
+        _remove_quietly(temp_file)
+        raise
+    finally:
+        stderr_thread.join(timeout=5)
+
+    if process.returncode != 0 or not os.path.exists(temp_file):
+        _remove_quietly(temp_file)
+        detail = ' | '.join(stderr_tail) or f'返回碼 {process.returncode}'
+        raise TranscodeError(f'FFmpeg 串流轉換失敗: {detail}')
+
+    if expected_duration:
+        # CBR MP3 大小約為 位元率 × 長度，明顯不足代表輸入被截斷
+        expected_size = int(bitrate.rstrip('k')) * 1000 / 8 * expected_duration
+        if os.path.getsize(temp_file) < expected_size * 0.5:
+            _remove_quietly(temp_file)
+            raise TranscodeError('FFmpeg 串流轉換輸出不完整')
+
+    os.replace(temp_file, output_file)
+    logger.info(f'串流轉換完成: {os.path.basename(output_file)}')
+    return output_file
+
+
+# 音訊輸出格式：相符的來源編碼可直接複製串流，否則以 encoder 重新編碼
+AUDIO_FORMATS: Dict[str, Dict[str, Any]] = {
+    'm4a': {'codec': 'aac', 'muxer': 'mp4', 'encoder': 'aac', 'options': ['-movflags', '+faststart']},
+    'opus': {'codec': 'opus', 'muxer': 'opus', 'encoder': 'libopus', 'options': []},
+}
+
+# 可選的音訊輸出格式 ('auto' 依來源編碼選擇可直接複製的格式)
+AUDIO_OUTPUT_FORMATS = ('mp3', 'm4a', 'opus', 'auto')
+
+# 來源容器 (如 pytubefix Stream.subtype) 對應的 FFmpeg demuxer
+CONTAINER_DEMUXERS = {'mp4': 'mp4', 'm4a': 'mp4', 'webm': 'webm'}
+
+
+def normalize_audio_codec(codec: Optional[str]) -> Optional[str]:
+    """
+    將 MIME codecs 字串轉為 FFmpeg 編碼名稱
+
+    Args:
+        codec: 如 'mp4a.40.2'、'opus'
+
+    Returns:
+        Optional[str]: 'aac'、'opus' 等，無法辨識時返回原值
+    """
+    if not codec:
+        return None
+    codec = codec.lower()
+    if codec.startswith('mp4a'):
+        return 'aac'
+    return codec
+
+
+def resolve_audio_format(requested: str, source_codec: Optional[str]) -> str:
+    """
+    決定實際輸出格式
+
+    Args:
+        requested: 要求的格式 ('mp3', 'm4a', 'opus', 'auto')
+        source_codec: 來源音訊編碼 (FFmpeg 名稱)
+
+    Returns:
+        str: 'mp3'、'm4a' 或 'opus'；'auto' 在無法直接複製時使用 'mp3'
+    """
+    if requested != 'auto':
+        return requested
+    for name, spec in AUDIO_FORMATS.items():
+        if spec['codec'] == source_codec:
+            return name
+    return 'mp3'
+
+
+def mp3_command(input_file: str, output_file: str, bitrate: str = '192k',
+                muxer: Optional[str] = None) -> List[str]:
+    """MP3 轉換 (44.1kHz 立體聲) 的 FFmpeg 指令；muxer 指定時以 -f 輸出 (寫入 .part 暫存檔時需要)"""
+    cmd = ['ffmpeg', '-i', input_file, '-vn', '-ar', '44100', '-ac', '2', '-b:a', bitrate]
+    if muxer:
+        cmd += ['-f', muxer]
+    return cmd + ['-y', output_file]
+
+
+def audio_command(input_file: str, output_file: str, output_format: str,
+                  source_codec: Optional[str] = None, input_format: Optional[str] = None,
+                  bitrate: str = '192k') -> Tuple[List[str], bool]:
+    """
+    m4a / opus 轉換的 FFmpeg 指令
+
+    Returns:
+        tuple: (指令, 是否為串流複製)
+    """
+    spec = AUDIO_FORMATS[output_format]
+    copy = source_codec == spec['codec']
+
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if input_format:
+        cmd += ['-f', input_format]
+    cmd += ['-i', input_file, '-vn']
+    if copy:
+        cmd += ['-c:a', 'copy']
+    else:
+        cmd += ['-c:a', spec['encoder'], '-b:a', bitrate]
+    return cmd + spec['options'] + ['-f', spec['muxer'], '-y', output_file], copy
+
+
+def convert_audio(input_file: str, output_file: str, output_format: str,
+                  source_codec: Optional[str] = None, input_format: Optional[str] = None,
+                  bitrate: str = '192k', timeout: Optional[float] = 300) -> Tuple[str, bool]:
+    """
+    轉換為 m4a / opus，來源編碼相符時只重新封裝 (-c:a copy)
+
+    已知的容器以 -f 指定給 FFmpeg，省略格式偵測。輸出先寫入 .part 暫存檔，成功後才改名。
+
+    Args:
+        input_file: 輸入檔案
+        output_file: 輸出檔案路徑
+        output_format: 'm4a' 或 'opus'
+        source_codec: 來源音訊編碼 (FFmpeg 名稱)，相符時直接複製串流
+        input_format: 來源容器的 FFmpeg demuxer 名稱
+        bitrate: 需要重新編碼時使用的位元率
+        timeout: 逾時秒數
+
+    Returns:
+        tuple: (輸出檔案路徑, 是否為串流複製)
+
+    Raises:
+        TranscodeError: FFmpeg 執行失敗
+    """
+    temp_file = output_file + '.part'
+    cmd, copy = audio_command(input_file, temp_file, output_format, source_codec, input_format, bitrate)
+
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _remove_quietly(temp_file)
+        raise TranscodeError(f'{output_format} 轉換超時')
+    except OSError as e:
+        raise TranscodeError(f'無法啟動 FFmpeg: {e}')
+
+    if result.returncode != 0 or not os.path.exists(temp_file):
+        _remove_quietly(temp_file)
+        detail = result.stderr.decode('utf-8', errors='ignore').strip()[-500:]
+        raise TranscodeError(f'{output_format} 轉換失敗: {detail or f"返回碼 {result.returncode}"}')
+
+    os.replace(temp_file, output_file)
+    logger.info(f'{"重新封裝" if copy else "重新編碼"}完成: {os.path.basename(output_file)}')
+    return output_file, copy
+
+
+def mux_command(video_file: str, audio_file: str, output_file: str,
+                video_format: Optional[str] = None, audio_format: Optional[str] = None) -> List[str]:
+    """影像與音訊以 -c copy 合併為 MP4 的 FFmpeg 指令 (mux_streams 與 mux_streams_async 共用)"""
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    for path, demuxer in ((video_file, video_format), (audio_file, audio_format)):
+        if demuxer:
+            cmd += ['-f', demuxer]
+        cmd += ['-i', path]
+    cmd += [
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        '-f', 'mp4', '-y', output_file
+    ]
+    return cmd
+
+
+def mux_streams(video_file: str, audio_file: str, output_file: str,
+                video_format: Optional[str] = None, audio_format: Optional[str] = None,
+                timeout: Optional[float] = 300) -> str:
+    """
+    將純影像與純音訊檔案合併為 MP4 (-c copy，不重新編碼)
+
+    Args:
+        video_file: 純影像檔案
+        audio_file: 純音訊檔案
+        output_file: 輸出 MP4 路徑
+        video_format: 影像容器的 FFmpeg demuxer (已知時省略格式偵測)
+        audio_format: 音訊容器的 FFmpeg demuxer
+        timeout: 逾時秒數
+
+    Returns:
+        str: 輸出檔案路徑
+
+    Raises:
+        TranscodeError: FFmpeg 執行失敗
+    """
+    temp_file = output_file + '.part'
+    cmd = mux_command(video_file, audio_file, temp_file, video_format, audio_format)
+
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _remove_quietly(temp_file)
+        raise TranscodeError('影音合併超時')
+    except OSError as e:
+        raise TranscodeError(f'無法啟動 FFmpeg: {e}')
+
+    if result.returncode != 0 or not os.path.exists(temp_file):
+        _remove_quietly(temp_file)
+        detail = result.stderr.decode('utf-8', errors='ignore').strip()[-500:]
+        raise TranscodeError(f'影音合併失敗: {detail or f"返回碼 {result.returncode}"}')
+
+    os.replace(temp_file, output_file)
+    logger.info(f'影音合併完成: {os.path.basename(output_file)}')
+    return output_file
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# asyncio 版本 (ASGI 模式)：等待 FFmpeg 時不佔用執行緒
+
+async def run_ffmpeg_async(cmd: List[str], temp_file: str, output_file: str,
+                           label: str, timeout: Optional[float] = 300) -> None:
+    """
+    以 asyncio 子行程執行 FFmpeg，成功後將 temp_file 改名為 output_file
+
+    Args:
+        cmd: FFmpeg 指令 (輸出為 temp_file)
+        temp_file: 暫存輸出檔
+        output_file: 最終輸出檔
+        label: 錯誤訊息使用的名稱
+        timeout: 逾時秒數
+
+    Raises:
+        TranscodeError: FFmpeg 執行失敗或逾時
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        raise TranscodeError(f'無法啟動 FFmpeg: {e}')
+
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        process.kill()
+        await process.wait()
+        _remove_quietly(temp_file)
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise TranscodeError(f'{label} 轉換超時')
+
+    if process.returncode != 0 or not os.path.exists(temp_file):
+        _remove_quietly(temp_file)
+        detail = stderr.decode('utf-8', errors='ignore').strip()[-500:]
+        raise TranscodeError(f'{label} 轉換失敗: {detail or f"返回碼 {process.returncode}"}')
+
+    os.replace(temp_file, output_file)
+
+
+async def encode_to_mp3_async(input_file: str, output_file: str, bitrate: str = '192k',
+                              timeout: Optional[float] = 300) -> str:
+    """convert_to_mp3 單一行程轉換的協程版本 (先寫入 .part)"""
+    temp_file = output_file + '.part'
+    cmd = mp3_command(input_file, temp_file, bitrate, muxer='mp3')
+    await run_ffmpeg_async(cmd, temp_file, output_file, 'MP3', timeout=timeout)
+    logger.info(f'MP3 轉換完成: {os.path.basename(output_file)}')
+    return output_file
+
+
+async def convert_audio_async(input_file: str, output_file: str, output_format: str,
+                              source_codec: Optional[str] = None, input_format: Optional[str] = None,
+                              bitrate: str = '192k', timeout: Optional[float] = 300) -> Tuple[str, bool]:
+    """convert_audio 的協程版本，參數與返回值相同"""
+    temp_file = output_file + '.part'
+    cmd, copy = audio_command(input_file, temp_file, output_format, source_codec, input_format, bitrate)
+    await run_ffmpeg_async(cmd, temp_file, output_file, output_format, timeout=timeout)
+    logger.info(f'{"重新封裝" if copy else "重新編碼"}完成: {os.path.basename(output_file)}')
+    return output_file, copy
+
+
+async def mux_streams_async(video_file: str, audio_file: str, output_file: str,
+                            video_format: Optional[str] = None, audio_format: Optional[str] = None,
+                            timeout: Optional[float] = 300) -> str:
+    """mux_streams 的協程版本，參數與返回值相同"""
+    temp_file = output_file + '.part'
+    cmd = mux_command(video_file, audio_file, temp_file, video_format, audio_format)
+    await run_ffmpeg_async(cmd, temp_file, output_file, '影音合併', timeout=timeout)
+    logger.info(f'影音合併完成: {os.path.basename(output_file)}')
+    return output_file
+
+
+# ---------------------------------------------------------------------------
+# 分段並行 MP3 轉換
+#
+# libmp3lame 為單執行緒，長音訊會讓單一核心忙碌數分鐘。分段模式將輸入依時間切成
+# 數段，每段由獨立的 FFmpeg 行程編碼，再以 MP3 frame 為單位接合成單一檔案：
+#
+# - 單次編碼時輸出的第 k 個 frame 對應輸入樣本 k * 1152 - 1105 起的 1152 個樣本
+#   (1105 = LAME 編碼延遲 576 + 解碼延遲 529)
+# - 每段從 frame 邊界往前多取 SEGMENT_PREROLL_FRAMES 個 frame 的輸入，編碼後丟棄這些
+#   frame，保留的 frame 與單次編碼的 frame 位置完全對齊，因此接合處沒有間隙或重疊
+# - 關閉 bit reservoir (-reservoir 0)，每個 frame 的資料不依賴前一個 frame，可直接接合
+# - 第一段的 Info (LAME) 標頭會依接合結果更新 frame 數、大小、TOC 與結尾補白，
+#   播放器仍可精確去除編碼延遲 (gapless)
+# ---------------------------------------------------------------------------
+
+MP3_SAMPLE_RATE = 44100
+SAMPLES_PER_FRAME = 1152
+SEGMENT_PREROLL_FRAMES = 3
+SEGMENT_POSTROLL_FRAMES = 3
+
+# 每段最短長度 (秒)，過短的分段會讓啟動 FFmpeg 的成本超過並行的效益
+MIN_SEGMENT_SECONDS = 30
+
+# 整個行程共用的分段 FFmpeg 名額：多個轉換任務同時分段時，同時執行的分段編碼總數
+# 不超過此值 (預設 CPU 數)，而不是 轉換執行緒數 × 每個任務的分段數
+_segment_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# MPEG-1 Layer III 位元率 (kbps) 與取樣率
+_MP3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0)
+_MP3_SAMPLE_RATES = (44100, 48000, 32000, 0)
+
+# Info 標頭欄位位置 (MPEG-1 立體聲，side info 32 bytes)
+_INFO_TAG_OFFSET = 36
+_INFO_FRAMES_OFFSET = 44
+_INFO_BYTES_OFFSET = 48
+_INFO_TOC_OFFSET = 52
+_LAME_DELAY_OFFSET = 177
+_LAME_MUSIC_LENGTH_OFFSET = 184
+_LAME_MUSIC_CRC_OFFSET = 188
+_LAME_TAG_CRC_OFFSET = 190
+
+
+class _SegmentResult:
+    """單一分段的編碼結果"""
+
+    __slots__ = ('path', 'id3_size', 'info_frame', 'frame_offsets', 'padding')
+
+    def __init__(self, path: str, id3_size: int, info_frame: bytes,
+                 frame_offsets: List[int], padding: int):
+        self.path = path
+        self.id3_size = id3_size
+        self.info_frame = info_frame
+        # 各音訊 frame 的起始位置，最後一個元素為音訊資料結尾
+        self.frame_offsets = frame_offsets
+        self.padding = padding
+
+
+def _crc16(data: bytes, crc: int = 0) -> int:
+    """LAME 標頭使用的 CRC-16 (多項式 0x8005，反射)"""
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def _id3v2_size(data: bytes) -> int:
+    """返回 ID3v2 標籤長度 (沒有標籤則為 0)"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _mp3_frame_size(header: int) -> int:
+    """依 MPEG-1 Layer III frame 標頭計算 frame 長度，格式不符時返回 0"""
+    if (header >> 21) & 0x7FF != 0x7FF or (header >> 19) & 0x3 != 0x3 or (header >> 17) & 0x3 != 0x1:
+        return 0
+    bitrate = _MP3_BITRATES[(header >> 12) & 0xF]
+    sample_rate = _MP3_SAMPLE_RATES[(header >> 10) & 0x3]
+    if not bitrate or not sample_rate:
+        return 0
+    return 144000 * bitrate // sample_rate + ((header >> 9) & 0x1)
+
+
+def set_segment_budget(limit: int) -> None:
+    """
+    設定整個行程同時執行的分段 FFmpeg 行程上限
+
+    應在開始轉換前呼叫 (例如應用程式初始化時)；執行中的分段不受影響
+    """
+    global _segment_slots
+    _segment_slots = threading.BoundedSemaphore(max(1, limit))
+
+
+def _parse_segment(path: str) -> _SegmentResult:
+    """
+    解析分段輸出：ID3 標籤、Info 標頭與各音訊 frame 的位置
+
+    以 mmap 逐一讀取 frame 標頭，不把整個分段讀入記憶體
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _SegmentResult(path, 0, b'', [0], 0)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _scan_frames(path, data)
+
+
+def _scan_frames(path: str, data: mmap.mmap) -> _SegmentResult:
+    """掃描分段檔案的 frame (data 為唯讀 mmap，切片只複製需要的部分)"""
+    position = _id3v2_size(data[:10])
+    id3_size = position
+    info_frame = b''
+    padding = 0
+    offsets = []
+
+    while position + 4 <= len(data):
+        size = _mp3_frame_size(int.from_bytes(data[position:position + 4], 'big'))
+        if not size or position + size > len(data):
+            break
+        if not offsets and not info_frame and \
+                data[position + _INFO_TAG_OFFSET:position + _INFO_TAG_OFFSET + 4] in (b'Info', b'Xing'):
+            info_frame = data[position:position + size]
+            delay_padding = int.from_bytes(info_frame[_LAME_DELAY_OFFSET:_LAME_DELAY_OFFSET + 3], 'big')
+            padding = delay_padding & 0xFFF
+        else:
+            offsets.append(position)
+        position += size
+
+    offsets.append(position)
+    return _SegmentResult(path, id3_size, info_frame, offsets, padding)
+
+
+def _encode_segment(input_file: str, output_file: str, bitrate: str, first_frame: int,
+                    frame_count: Optional[int], timeout: Optional[float]) -> _SegmentResult:
+    """
+    編碼一個分段
+
+    Args:
+        first_frame: 此段第一個保留 frame 在完整輸出中的索引
+        frame_count: 保留的 frame 數，None 表示編碼到輸入結尾
+    """
+    preroll = SEGMENT_PREROLL_FRAMES if first_frame > 0 else 0
+    start_sample = (first_frame - preroll) * SAMPLES_PER_FRAME
+
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if start_sample > 0:
+        cmd += ['-ss', f'{start_sample / MP3_SAMPLE_RATE:.6f}']
+    cmd += ['-i', input_file]
+    if frame_count is not None:
+        samples = (preroll + frame_count + SEGMENT_POSTROLL_FRAMES) * SAMPLES_PER_FRAME
+        cmd += ['-t', f'{samples / MP3_SAMPLE_RATE:.6f}']
+    cmd += [
+        '-vn',
+        '-ar', str(MP3_SAMPLE_RATE),
+        '-ac', '2',
+        '-c:a', 'libmp3lame',
+        '-b:a', bitrate,
+        '-reservoir', '0',
+    ]
+    if first_frame > 0:
+        # 只有第一段保留 ID3 標籤
+        cmd += ['-id3v2_version', '0']
+    cmd += ['-f', 'mp3', '-y', output_file]
+
+    try:
+        # 等待共用名額後才啟動 FFmpeg，逾時只計算實際編碼的時間
+        with _segment_slots:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise TranscodeError(f'分段轉換超時 (frame {first_frame})')
+    except OSError as e:
+        raise TranscodeError(f'無法啟動 FFmpeg: {e}')
+    if result.returncode != 0:
+        detail = result.stderr.decode('utf-8', errors='ignore').strip()[-500:]
+        raise TranscodeError(f'分段轉換失敗 (frame {first_frame}): {detail}')
+
+    segment = _parse_segment(output_file)
+    available = len(segment.frame_offsets) - 1 - preroll
+    if available <= 0 or (frame_count is not None and available < frame_count):
+        raise TranscodeError(f'分段輸出不完整 (frame {first_frame})')
+
+    # 只保留對齊後的 frame 範圍
+    end = preroll + frame_count if frame_count is not None else len(segment.frame_offsets) - 1
+    segment.frame_offsets = segment.frame_offsets[preroll:end + 1]
+    return segment
+
+
+def plan_segments(duration: float, workers: int) -> List[Tuple[int, Optional[int]]]:
+    """
+    依音訊長度與並行數切分 frame 範圍
+
+    Args:
+        duration: 音訊長度 (秒)
+        workers: 並行數
+
+    Returns:
+        list: [(第一個 frame 索引, frame 數)]，最後一段的 frame 數為 None (編碼到結尾)
+    """
+    frames_per_second = MP3_SAMPLE_RATE / SAMPLES_PER_FRAME
+    total_frames = int(duration * frames_per_second)
+    min_frames = int(MIN_SEGMENT_SECONDS * frames_per_second)
+    count = max(1, min(workers, total_frames // max(1, min_frames)))
+    per_segment = math.ceil(total_frames / count)
+
+    segments = []
+    for index in range(count):
+        first_frame = index * per_segment
+        segments.append((first_frame, per_segment if index < count - 1 else None))
+    return segments
+
+
+def _build_info_frame(template: bytes, frame_offsets: List[int], audio_frames: int,
+                      audio_bytes: int, padding: int) -> bytes:
+    """依接合後的結果更新 Info 標頭 (frame 數、大小、TOC、結尾補白與標頭 CRC)"""
+    frame = bytearray(template)
+    total_bytes = len(frame) + audio_bytes
+
+    frame[_INFO_FRAMES_OFFSET:_INFO_FRAMES_OFFSET + 4] = audio_frames.to_bytes(4, 'big')
+    frame[_INFO_BYTES_OFFSET:_INFO_BYTES_OFFSET + 4] = total_bytes.to_bytes(4, 'big')
+
+    # TOC：每 1% 播放位置對應的檔案位置 (以 1/256 為單位)
+    for i in range(100):
+        offset = len(frame) + frame_offsets[min(audio_frames - 1, audio_frames * i // 100)]
+        frame[_INFO_TOC_OFFSET + i] = min(255, offset * 256 // total_bytes)
+
+    delay_padding = int.from_bytes(frame[_LAME_DELAY_OFFSET:_LAME_DELAY_OFFSET + 3], 'big')
+    delay_padding = (delay_padding & ~0xFFF) | (padding & 0xFFF)
+    frame[_LAME_DELAY_OFFSET:_LAME_DELAY_OFFSET + 3] = delay_padding.to_bytes(3, 'big')
+    frame[_LAME_MUSIC_LENGTH_OFFSET:_LAME_MUSIC_LENGTH_OFFSET + 4] = total_bytes.to_bytes(4, 'big')
+    # 音訊 CRC 需要掃描全部資料，常見播放器與 FFmpeg 都不檢查，因此清為 0
+    frame[_LAME_MUSIC_CRC_OFFSET:_LAME_MUSIC_CRC_OFFSET + 2] = b'\x00\x00'
+    frame[_LAME_TAG_CRC_OFFSET:_LAME_TAG_CRC_OFFSET + 2] = \
+        _crc16(bytes(frame[:_LAME_TAG_CRC_OFFSET])).to_bytes(2, 'big')
+    return bytes(frame)
+
+
+def encode_file_to_mp3_segmented(input_file: str, output_file: str, duration: float,
+                                 bitrate: str = '192k', workers: Optional[int] = None,
+                                 timeout: Optional[float] = 300) -> str:
+    """
+    將長音訊切成多段並行編碼為 MP3，再接合為單一無間隙的檔案
+
+    輸出先寫入 .part 暫存檔，成功後才改名。
+
+    Args:
+        input_file: 輸入音訊 (或影片) 檔案
+        output_file: 輸出 MP3 檔案路徑
+        duration: 音訊長度 (秒)，用來切分；最後一段一律編碼到輸入結尾
+        bitrate: MP3 位元率 (CBR)
+        workers: 分段數上限，None 則使用 CPU 數；同時執行的 FFmpeg 行程另受
+                 set_segment_budget() 的全行程名額限制
+        timeout: 每段的逾時秒數
+
+    Returns:
+        str: 輸出 MP3 檔案路徑
+
+    Raises:
+        TranscodeError: 任一分段轉換失敗或接合失敗
+    """
+    workers = workers or os.cpu_count() or 1
+    segments = plan_segments(duration, workers)
+    temp_dir = tempfile.mkdtemp(prefix='segments-', dir=os.path.dirname(os.path.abspath(output_file)))
+    temp_file = output_file + '.part'
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix='mp3-segment') as executor:
+            futures = [
+                executor.submit(
+                    _encode_segment, input_file, os.path.join(temp_dir, f'{index:04d}.mp3'),
+                    bitrate, first_frame, frame_count, timeout
+                )
+                for index, (first_frame, frame_count) in enumerate(segments)
+            ]
+            results = [future.result() for future in futures]
+
+        first, last = results[0], results[-1]
+        if not first.info_frame:
+            raise TranscodeError('分段輸出缺少 Info 標頭')
+
+        # 接合後各 frame 的位置 (相對於音訊資料起點)
+        frame_offsets = []
+        audio_bytes = 0
+        for result in results:
+            base = result.frame_offsets[0]
+            frame_offsets.extend(audio_bytes + offset - base for offset in result.frame_offsets[:-1])
+            audio_bytes += result.frame_offsets[-1] - base
+        audio_frames = len(frame_offsets)
+
+        info_frame = _build_info_frame(first.info_frame, frame_offsets, audio_frames, audio_bytes,
+                                       last.padding)
+
+        with open(temp_file, 'wb') as out:
+            with open(first.path, 'rb') as f:
+                out.write(f.read(first.id3_size))
+            out.write(info_frame)
+            for result in results:
+                with open(result.path, 'rb') as f:
+                    f.seek(result.frame_offsets[0])
+                    remaining = result.frame_offsets[-1] - result.frame_offsets[0]
+                    while remaining > 0:
+                        block = f.read(min(remaining, 1024 * 1024))
+                        if not block:
+                            raise TranscodeError('分段檔案讀取不完整')
+                        out.write(block)
+                        remaining -= len(block)
+
+        os.replace(temp_file, output_file)
+    except BaseException:
+        _remove_quietly(temp_file)
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    logger.info(
+        f'分段轉換完成: {os.path.basename(output_file)} '
+        f'({len(segments)} 段, {audio_frames * SAMPLES_PER_FRAME / MP3_SAMPLE_RATE:.0f} 秒)'
+    )
+    return output_file
+
+
+# 效能測試：以 FFmpeg lavfi 產生的長音訊比較單一行程與分段並行轉換
+# 使用方式: python transcode.py [長度秒數, 預設 1800] [並行數, 預設 CPU 數]
+if __name__ == '__main__':
+    import sys
+    import time
+    import array
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1800
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    bitrate = '192k'
+
+    def decode_window(path, start_sample, count):
+        """解碼指定範圍的單聲道 PCM 樣本"""
+        cmd = ['ffmpeg', '-v', 'error', '-i', path, '-af',
+               f'atrim=start_sample={start_sample}:end_sample={start_sample + count}',
+               '-ac', '1', '-f', 's16le', '-']
+        samples = array.array('h')
+        samples.frombytes(subprocess.run(cmd, capture_output=True, check=True).stdout)
+        return samples
+
+    def snr(decoded, reference):
+        noise = sum((a - b) ** 2 for a, b in zip(decoded, reference))
+        signal = sum(b * b for b in reference)
+        return 10 * math.log10((signal + 1) / (noise + 1))
+
+    print('=' * 60)
+    print(f'🧪 MP3 轉換效能測試 ({duration:.0f} 秒合成音訊, {workers} 個並行行程)')
+    print('=' * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.m4a')
+        single = os.path.join(tmp, 'single.mp3')
+        segmented = os.path.join(tmp, 'segmented.mp3')
+
+        # 合成輸入：掃頻正弦波 + 粉紅噪音，以 AAC 編碼 (與 YouTube 音訊格式相同)
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', f'aevalsrc=0.4*sin(2*PI*(200+100*sin(2*PI*t/7))*t):s=44100:d={duration}',
+            '-f', 'lavfi', '-i', f'anoisesrc=color=pink:amplitude=0.1:sample_rate=44100:d={duration}',
+            '-filter_complex', 'amix=inputs=2:normalize=0',
+            '-ac', '2', '-c:a', 'aac', '-b:a', '128k', source
+        ], check=True)
+
+        started = time.monotonic()
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-i', source, '-vn', '-ar', '44100', '-ac', '2',
+            '-b:a', bitrate, single
+        ], check=True)
+        single_seconds = time.monotonic() - started
+        print(f'   單一行程: {single_seconds:.1f} 秒')
+
+        started = time.monotonic()
+        encode_file_to_mp3_segmented(source, segmented, duration, bitrate=bitrate, workers=workers)
+        segmented_seconds = time.monotonic() - started
+        print(f'   分段並行: {segmented_seconds:.1f} 秒 '
+              f'({len(plan_segments(duration, workers))} 段, 加速 {single_seconds / segmented_seconds:.2f}x)')
+
+        # 接合處檢查：每個接合點前後的解碼結果與原始音訊比較，應與單一行程輸出相當
+        print('   接合處訊噪比 (分段 / 單一行程):')
+        for first_frame, _ in plan_segments(duration, workers)[1:]:
+            boundary = first_frame * SAMPLES_PER_FRAME - 1105
+            reference = decode_window(source, boundary - 2048, 4096)
+            print(f'     {boundary / MP3_SAMPLE_RATE:8.1f}s: '
+                  f'{snr(decode_window(segmented, boundary - 2048, 4096), reference):5.1f} dB / '
+                  f'{snr(decode_window(single, boundary - 2048, 4096), reference):5.1f} dB')
+
+        lengths = [len(decode_window(path, 0, int(duration * MP3_SAMPLE_RATE) + 10 * MP3_SAMPLE_RATE))
+                   for path in (source, single, segmented)]
+        print(f'   樣本數 (原始 / 單一 / 分段): {lengths[0]} / {lengths[1]} / {lengths[2]}')
+        print('✅ 長度一致' if lengths[1] == lengths[2] else '❌ 長度不一致')
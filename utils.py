@@ -96,6 +96,29 @@ def clean_youtube_url(url: str) -> str:
     return url
 
 
+def extract_video_id(url: str) -> Optional[str]:
+    """
+    從 YouTube URL 提取影片 ID
+    
+    Args:
+        url: YouTube URL (建議先經過 clean_youtube_url)
+    
+    Returns:
+        Optional[str]: 影片 ID，無法辨識則返回 None
+    """
+    try:
+        parsed = urlparse(clean_youtube_url(url))
+        if parsed.hostname and 'youtube.com' in parsed.hostname and parsed.path == '/watch':
+            from urllib.parse import parse_qs
+            video_id = parse_qs(parsed.query).get('v', [None])[0]
+            if video_id and re.match(r'^[A-Za-z0-9_-]{6,20}$', video_id):
+                return video_id
+    except Exception as e:
+        logger.warning(f'提取影片 ID 失敗: {e}')
+    
+    return None
+
+
 def validate_bitrate(bitrate: str) -> str:
     """
     驗證音訊位元率格式
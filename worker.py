@@ -0,0 +1,311 @@
+"""
+下載 worker 入口
+從持久化工作佇列 (job_queue) 取出下載工作，以行程池執行，狀態寫回共用的 SQLite 任務儲存
+
+使用方式:
+    TASK_EXECUTION_MODE=queue python worker.py
+
+web 行程 (gunicorn) 只負責排入工作與讀取狀態；worker 當機或被終止時，
+執行中的工作會在心跳逾時 (JOB_STALE_SECONDS) 後由任一 worker 重新排入。
+心跳由主行程更新，子行程卡住時則由執行時間上限 (JOB_TIMEOUT_SECONDS) 終止。
+"""
+import os
+import time
+import signal
+import socket
+import queue
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import get_config
+from job_queue import JobQueue
+from task_store import create_task_store
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s [worker] %(message)s'
+)
+logger = logging.getLogger('worker')
+
+config = get_config()
+
+# 檢查逾時工作的間隔 (秒)
+REQUEUE_INTERVAL_SECONDS = max(5, config.JOB_STALE_SECONDS // 2)
+
+# 清理已結束工作的間隔與保留時間 (秒)
+PURGE_INTERVAL_SECONDS = 3600
+PURGE_AFTER_SECONDS = 2 * 3600
+
+
+def resolve_pool_size():
+    """
+    計算行程池大小
+
+    下載以網路 I/O 為主，轉檔 (FFmpeg) 則佔用 CPU，
+    因此取 CPU 數與網路頻寬預算可容納的工作數中較小者。
+
+    Returns:
+        int: 行程數
+    """
+    if config.WORKER_PROCESSES > 0:
+        return config.WORKER_PROCESSES
+    cpu_slots = os.cpu_count() or 1
+    network_slots = config.WORKER_NETWORK_BUDGET_MBPS // max(1, config.WORKER_JOB_MBPS)
+    return max(1, min(cpu_slots, network_slots))
+
+
+# 子行程回報 (工作 ID, pid) 的佇列，逾時時主行程據此終止對應的子行程
+_started_jobs = None
+
+# 子行程的應用程式 (第一個工作時建立)
+_app = None
+
+
+def init_child(started_jobs):
+    """
+    子行程初始化：忽略 Ctrl+C，由主行程統一處理停止流程
+
+    子行程自成一個行程群組，逾時終止時連同其 FFmpeg 與 yt-dlp 子行程一起結束
+    """
+    global _started_jobs
+    _started_jobs = started_jobs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+
+def execute_job(job_id, task_id, payload):
+    """
+    在子行程中執行下載工作 (狀態由 app_pytubefix.update_task 寫回任務儲存)
+
+    Args:
+        job_id: 工作 ID (回報給主行程)
+        task_id: 任務 ID
+        payload: 工作參數 (url, type, quality, bitrate, format, adaptive)
+    """
+    global _app
+    _started_jobs.put((job_id, os.getpid()))
+    # 延遲導入：只在子行程載入下載相關模組，應用程式在子行程中建立一次後重複使用
+    from app_pytubefix import create_app, run_download_job
+    if _app is None:
+        _app = create_app()
+    with _app.app_context():
+        run_download_job(
+            task_id,
+            payload['url'],
+            payload['type'],
+            payload['quality'],
+            payload['bitrate'],
+            wait_for_transcode=True,
+            audio_format=payload.get('format', 'mp3'),
+            adaptive=payload.get('adaptive', True)
+        )
+
+
+class Worker:
+    """
+    工作派送器
+
+    主行程只負責取出工作、更新心跳與回收結果，下載在行程池中執行；
+    只有在行程池有空位時才取出工作，其餘工作留在佇列中供其他 worker 取用。
+    """
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.queue = JobQueue(config.JOB_QUEUE_PATH, max_attempts=config.JOB_MAX_ATTEMPTS)
+        self.tasks = create_task_store(config.TASK_STORE_BACKEND, config.TASK_STORE_PATH)
+        self.running = {}  # future -> job
+        self.pids = {}  # 工作 ID -> 執行中的子行程 pid
+        self.timed_out = set()  # 逾時而被終止的工作 ID
+        self.interrupted = set()  # 因回收行程池而一併中斷的工作 ID
+        self.started_jobs = multiprocessing.get_context('spawn').Queue()
+        self.stopping = False
+        self.pool = self._create_pool()
+        self.last_requeue = 0.0
+        self.last_purge = 0.0
+
+    def _create_pool(self):
+        # 使用 spawn，避免 fork 時複製主行程的 SQLite 連線與執行緒狀態
+        return ProcessPoolExecutor(
+            max_workers=self.pool_size,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_child,
+            initargs=(self.started_jobs,)
+        )
+
+    def stop(self, signum=None, frame=None):
+        """停止取出新工作，等待執行中的工作完成後結束"""
+        if not self.stopping:
+            logger.info('收到停止訊號，等待執行中的工作完成...')
+        self.stopping = True
+
+    def run(self):
+        """主迴圈"""
+        logger.info(f'worker 啟動: id={self.worker_id}, 行程數={self.pool_size}')
+
+        while not self.stopping or self.running:
+            self._expire()
+            self._reap()
+            claimed = False if self.stopping else self._fill()
+            self.queue.heartbeat(self.worker_id)
+            self._maintain()
+            if not claimed:
+                time.sleep(config.WORKER_POLL_INTERVAL)
+
+        self.pool.shutdown(wait=True)
+        logger.info('worker 已結束')
+
+    def _fill(self):
+        """在行程池有空位時取出工作，返回是否取得工作"""
+        claimed = False
+        if self.timed_out:
+            return claimed  # 等待被終止的行程池由 _reap 重新建立
+        while len(self.running) < self.pool_size:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                break
+            try:
+                future = self.pool.submit(execute_job, job['id'], job['task_id'], job['payload'])
+            except BrokenProcessPool:
+                # 子行程剛異常結束，行程池尚未重新建立
+                self.queue.release(job['id'])
+                break
+            claimed = True
+            logger.info(f'開始工作: job={job["id"]}, task={job["task_id"]}, 第 {job["attempts"]} 次')
+            job['started'] = time.monotonic()
+            self.running[future] = job
+        return claimed
+
+    def _expire(self):
+        """終止執行超過 JOB_TIMEOUT_SECONDS 的工作 (行程池隨之損壞，由 _reap 重新建立)"""
+        while True:
+            try:
+                job_id, pid = self.started_jobs.get_nowait()
+            except queue.Empty:
+                break
+            self.pids[job_id] = pid
+
+        if config.JOB_TIMEOUT_SECONDS <= 0:
+            return
+        now = time.monotonic()
+        for future, job in self.running.items():
+            if future.done() or job['id'] in self.timed_out:
+                continue
+            if now - job['started'] < config.JOB_TIMEOUT_SECONDS:
+                continue
+            pid = self.pids.get(job['id'])
+            if pid is None:
+                continue  # 子行程尚未開始執行此工作
+            logger.error(
+                f'工作逾時 ({config.JOB_TIMEOUT_SECONDS} 秒)，終止子行程: '
+                f'job={job["id"]}, task={job["task_id"]}, pid={pid}'
+            )
+            self.timed_out.add(job['id'])
+            # 行程池損壞時其他執行中的工作也會被中斷：一併終止 (含其 FFmpeg 子行程)，這些工作不計入嘗試次數
+            for other in self.running.values():
+                if other['id'] != job['id'] and other['id'] not in self.timed_out:
+                    self.interrupted.add(other['id'])
+                    self._kill(self.pids.get(other['id']))
+            self._kill(pid)
+
+    def _kill(self, pid):
+        """終止子行程與其行程群組"""
+        if pid is None:
+            return
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(pid, signal.SIGKILL)
+            else:
+                os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass  # 已隨先前終止的行程池結束
+        except OSError as e:
+            logger.warning(f'無法終止子行程 pid={pid}: {e}')
+
+    def _reap(self):
+        """回收已結束的工作"""
+        broken = False
+        for future in [f for f in self.running if f.done()]:
+            job = self.running.pop(future)
+            self.pids.pop(job['id'], None)
+            timed_out = job['id'] in self.timed_out
+            interrupted = job['id'] in self.interrupted
+            self.timed_out.discard(job['id'])
+            self.interrupted.discard(job['id'])
+            error = future.exception()
+            if error is None:
+                self.queue.complete(job['id'])
+                continue
+
+            # run_download_job 已處理下載錯誤，這裡只會是子行程異常結束或逾時終止等情況
+            broken = broken or isinstance(error, BrokenProcessPool)
+            if timed_out:
+                logger.error(f'工作逾時已終止: job={job["id"]}, task={job["task_id"]}')
+                if self.queue.fail(job['id'], f'執行超過 {config.JOB_TIMEOUT_SECONDS} 秒'):
+                    self._mark_task(job['task_id'], status='pending', progress=0,
+                                    message='下載逾時，重新排隊等待下載...')
+                else:
+                    self._mark_task(job['task_id'], status='error', message='下載失敗: 執行逾時')
+                continue
+            if interrupted and isinstance(error, BrokenProcessPool):
+                logger.warning(f'工作因行程池回收而中斷，放回佇列: job={job["id"]}, task={job["task_id"]}')
+                self.queue.release(job['id'])
+                self._mark_task(job['task_id'], status='pending', progress=0,
+                                message='重新排隊等待下載...')
+                continue
+
+            logger.error(f'工作異常結束: job={job["id"]}, task={job["task_id"]}: {error!r}')
+            if self.queue.fail(job['id'], repr(error)):
+                self._mark_task(job['task_id'], status='pending', progress=0,
+                                message='worker 異常，重新排隊等待下載...')
+            else:
+                self._mark_task(job['task_id'], status='error', message='下載失敗: worker 異常結束')
+
+        if broken:
+            # 子行程被終止 (如 OOM) 後行程池無法再使用，重新建立
+            logger.warning('行程池已損壞，重新建立')
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._create_pool()
+
+    def _maintain(self):
+        """定期重新排入逾時工作並清理已結束的舊工作"""
+        now = time.monotonic()
+        if now - self.last_requeue >= REQUEUE_INTERVAL_SECONDS:
+            self.last_requeue = now
+            # 重新排入的工作重設任務狀態，否則用戶端會看到停在當機 worker 最後回報的進度
+            for job in self.queue.requeue_stale(config.JOB_STALE_SECONDS):
+                if job['requeued']:
+                    self._mark_task(job['task_id'], status='pending', progress=0,
+                                    message='worker 逾時，重新排隊等待下載...')
+                else:
+                    self._mark_task(job['task_id'], status='error', message='下載失敗: worker 逾時')
+
+        if now - self.last_purge >= PURGE_INTERVAL_SECONDS:
+            self.last_purge = now
+            purged = self.queue.purge_finished(PURGE_AFTER_SECONDS)
+            if purged:
+                logger.info(f'清理 {purged} 筆已結束的工作')
+
+    def _mark_task(self, task_id, **fields):
+        """更新任務狀態並同步到跟隨任務"""
+        with self.tasks.transaction():
+            task = self.tasks.update(task_id, fields)
+            for follower_id in (task or {}).get('followers', []):
+                self.tasks.update(follower_id, fields)
+
+
+def main():
+    if config.TASK_STORE_BACKEND != 'sqlite':
+        raise SystemExit('worker 需要共用的任務儲存，請設定 TASK_STORE_BACKEND=sqlite')
+
+    worker = Worker(resolve_pool_size())
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
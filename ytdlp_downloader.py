@@ -6,6 +6,39 @@ import yt_dlp
 import os
 import re
 
+from ytdlp_service import build_options
+
+# 獨立使用時額外的防封鎖與重試設定 (覆蓋 ytdlp_service 的共用選項)
+DOWNLOADER_OPTIONS = {
+    'quiet': False,
+    'no_warnings': False,
+    'extract_flat': False,
+    # 防封鎖設定
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+        'Sec-Fetch-Mode': 'navigate',
+    },
+    # 重試設定
+    'retries': 5,
+    'fragment_retries': 5,
+    'skip_unavailable_fragments': True,
+    # 額外選項
+    'ignoreerrors': False,
+    'no_check_certificate': True,
+    'prefer_insecure': True,
+    'socket_timeout': 30,
+    # 使用 extractor 參數繞過限制
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['ios', 'android', 'web'],
+            'skip': ['dash', 'hls'],
+        }
+    },
+}
+
+
 def sanitize_filename(filename):
     """清理檔案名稱，移除非法字元"""
     # 移除非法字元
@@ -43,36 +76,11 @@ def download_video(url, output_path='downloads', quality='highest'):
         format_spec = 'best[ext=mp4]/best'
     
     # yt-dlp 選項
-    ydl_opts = {
-        'format': format_spec,
-        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-        'quiet': False,
-        'no_warnings': False,
-        'extract_flat': False,
-        # 防封鎖設定
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-us,en;q=0.5',
-            'Sec-Fetch-Mode': 'navigate',
-        },
-        # 重試設定
-        'retries': 5,
-        'fragment_retries': 5,
-        'skip_unavailable_fragments': True,
-        # 額外選項
-        'ignoreerrors': False,
-        'no_check_certificate': True,
-        'prefer_insecure': True,
-        'socket_timeout': 30,
-        # 使用 extractor 參數繞過限制
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['ios', 'android', 'web'],
-                'skip': ['dash', 'hls'],
-            }
-        },
-    }
+    ydl_opts = build_options(
+        'video',
+        {**DOWNLOADER_OPTIONS, 'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s')},
+        format=format_spec
+    )
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -116,42 +124,12 @@ def download_audio(url, output_path='downloads', bitrate='192k'):
     os.makedirs(output_path, exist_ok=True)
     
     # yt-dlp 選項 - 直接轉換為 MP3
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-        'quiet': False,
-        'no_warnings': False,
-        'extract_flat': False,
-        # MP3 轉換
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': bitrate.replace('k', ''),
-        }],
-        # 防封鎖設定
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-us,en;q=0.5',
-            'Sec-Fetch-Mode': 'navigate',
-        },
-        # 重試設定
-        'retries': 5,
-        'fragment_retries': 5,
-        'skip_unavailable_fragments': True,
-        # 額外選項
-        'ignoreerrors': False,
-        'no_check_certificate': True,
-        'prefer_insecure': True,
-        'socket_timeout': 30,
-        # 使用 extractor 參數繞過限制
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['ios', 'android', 'web'],
-                'skip': ['dash', 'hls'],
-            }
-        },
-    }
+    ydl_opts = build_options(
+        'audio',
+        {**DOWNLOADER_OPTIONS, 'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s')},
+        codec='mp3',
+        quality=bitrate.replace('k', '')
+    )
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -183,20 +161,7 @@ def get_video_info(url):
     Returns:
         dict: 影片資訊
     """
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': False,
-        'skip_download': True,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        },
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['ios', 'android', 'web'],
-            }
-        },
-    }
+    ydl_opts = build_options('info')
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -0,0 +1,444 @@
+"""
+yt-dlp 擷取服務
+後備下載與影片資訊查詢交給常駐的 yt-dlp 輔助行程執行，經由 multiprocessing Pipe 傳遞工作；
+每個輔助行程依選項設定檔 (profile) 保留已初始化的 YoutubeDL，不需每次重新讀取 cookies 與初始化 extractor，
+yt-dlp 的記憶體與 CPU 尖峰也留在輔助行程中，不影響 web worker
+"""
+import os
+import copy
+import time
+import queue
+import signal
+import threading
+import logging
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# 所有設定檔共用的選項
+BASE_OPTIONS: Dict[str, Any] = {
+    'quiet': True,
+    'no_warnings': True,
+    'http_headers': {
+        'User-Agent': USER_AGENT,
+    },
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['ios', 'android', 'web'],
+        }
+    },
+}
+
+# 音訊格式對應的下載格式 (m4a / opus 優先下載相同編碼的串流，FFmpegExtractAudio 只需重新封裝)
+AUDIO_FORMAT_SPECS = {
+    'm4a': 'bestaudio[acodec^=mp4a]/bestaudio/best',
+    'opus': 'bestaudio[acodec=opus]/bestaudio/best',
+}
+
+
+def _info_options() -> Dict[str, Any]:
+    return {'skip_download': True}
+
+
+def _audio_options(codec: str = 'mp3', quality: str = '192') -> Dict[str, Any]:
+    return {
+        'format': AUDIO_FORMAT_SPECS.get(codec, 'bestaudio/best'),
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            # 'best' 保留來源編碼 (auto)
+            'preferredcodec': 'best' if codec == 'auto' else codec,
+            'preferredquality': quality,
+        }],
+        'retries': 5,
+        'socket_timeout': 30,
+    }
+
+
+def _video_options(format: str = 'best[ext=mp4]/best') -> Dict[str, Any]:
+    return {
+        'format': format,
+        'merge_output_format': 'mp4',
+        'retries': 5,
+        'socket_timeout': 30,
+    }
+
+
+# 選項設定檔：名稱 -> 以參數產生設定檔專屬選項的函數
+PROFILES: Dict[str, Callable[..., Dict[str, Any]]] = {
+    'info': _info_options,
+    'audio': _audio_options,
+    'video': _video_options,
+}
+
+
+def build_options(profile: str, defaults: Optional[Dict[str, Any]] = None, **params) -> Dict[str, Any]:
+    """
+    組合 YoutubeDL 選項：共用選項 → defaults (如 outtmpl、cookiefile) → 設定檔選項
+
+    Args:
+        profile: 設定檔名稱 (info, audio, video)
+        defaults: 覆蓋共用選項的設定
+        **params: 設定檔參數 (如 audio 的 codec、quality；video 的 format)
+
+    Returns:
+        dict: YoutubeDL 選項
+
+    Raises:
+        ValueError: 未知的設定檔
+    """
+    if profile not in PROFILES:
+        raise ValueError(f'未知的 yt-dlp 設定檔: {profile}')
+    options = copy.deepcopy(BASE_OPTIONS)
+    options.update(copy.deepcopy(defaults or {}))
+    options.update(PROFILES[profile](**params))
+    return options
+
+
+class YtdlpServiceError(Exception):
+    """輔助行程逾時、異常結束或工作失敗"""
+
+
+class ProfileRunner:
+    """
+    執行 yt-dlp 工作 (單一執行緒使用)
+
+    reuse=True 時依 (設定檔, 參數) 保留最多 max_instances 個 YoutubeDL，超過時關閉最久未使用的
+    """
+
+    # 回傳資訊中略過的大型欄位 (經由 Pipe 傳遞)
+    DROPPED_FIELDS = ('thumbnails', 'subtitles', 'automatic_captions', 'heatmap')
+
+    def __init__(self, defaults: Optional[Dict[str, Any]] = None, max_instances: int = 16, reuse: bool = True):
+        self.defaults = defaults or {}
+        self.max_instances = max(1, max_instances)
+        self.reuse = reuse
+        self._instances: 'OrderedDict[Tuple, Any]' = OrderedDict()
+
+    def run(self, op: str, profile: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        執行工作
+
+        Args:
+            op: 'extract' (只取得資訊) 或 'download'
+            profile: 設定檔名稱
+            url: 影片網址
+            params: 設定檔參數
+
+        Returns:
+            dict: info (影片資訊)、filename (prepare_filename 結果)、filepath (後處理後的檔案，可能為 None)
+        """
+        from engines import registry as engine_registry
+
+        key = (profile, tuple(sorted(params.items())))
+        ydl = self._instances.pop(key, None)
+        if ydl is None:
+            options = build_options(profile, self.defaults, **params)
+            ydl = engine_registry.load('yt-dlp').YoutubeDL(options)
+        try:
+            info = ydl.extract_info(url, download=(op == 'download'))
+            downloads = info.get('requested_downloads') or []
+            result = {
+                'info': self._compact(ydl.sanitize_info(info)),
+                'filename': ydl.prepare_filename(info),
+                'filepath': downloads[-1].get('filepath') if downloads else None,
+            }
+        finally:
+            if self.reuse:
+                self._instances[key] = ydl
+                while len(self._instances) > self.max_instances:
+                    self._close(self._instances.popitem(last=False)[1])
+            else:
+                self._close(ydl)
+        return result
+
+    def close(self) -> None:
+        """關閉所有 YoutubeDL (會寫回 cookies)"""
+        while self._instances:
+            self._close(self._instances.popitem()[1])
+
+    def _compact(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        for field in self.DROPPED_FIELDS:
+            info.pop(field, None)
+        for fmt in info.get('formats') or []:
+            fmt.pop('fragments', None)
+        return info
+
+    @staticmethod
+    def _close(ydl) -> None:
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning(f'關閉 YoutubeDL 失敗: {e}')
+
+
+def _helper_main(conn, defaults: Dict[str, Any], max_instances: int, idle_timeout: float) -> None:
+    """輔助行程主迴圈：逐一處理工作，閒置超過 idle_timeout 秒或收到 None 時結束"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    runner = ProfileRunner(defaults, max_instances)
+    try:
+        while conn.poll(idle_timeout or None):
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            try:
+                response = {'ok': True, 'result': runner.run(**request)}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e) or type(e).__name__}
+            conn.send(response)
+    finally:
+        runner.close()
+        conn.close()
+
+
+class YtdlpHelper:
+    """單一輔助行程 (同一時間只處理一個工作，由 YtdlpService 分派)"""
+
+    def __init__(self, name: str, defaults: Callable[[], Dict[str, Any]], max_instances: int,
+                 idle_timeout: float, max_jobs: int):
+        self.name = name
+        self._defaults = defaults
+        self.max_instances = max_instances
+        self.idle_timeout = idle_timeout
+        self.max_jobs = max_jobs
+        self._process = None
+        self._conn = None
+        self._last_used = 0.0
+        self.jobs = 0  # 目前行程已處理的工作數
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def call(self, request: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+        """
+        送出工作並等待結果
+
+        Raises:
+            YtdlpServiceError: 逾時 (行程會被終止)、行程異常結束或工作失敗
+        """
+        # 閒置逾時前先換新行程，避免送出工作時行程剛好結束
+        idle_expired = self.idle_timeout and time.monotonic() - self._last_used > self.idle_timeout * 0.9
+        if not self.alive or idle_expired or (self.max_jobs and self.jobs >= self.max_jobs):
+            self._start()
+
+        try:
+            self._conn.send(request)
+            if not self._conn.poll(timeout):
+                self.stop(kill=True)
+                raise YtdlpServiceError(f'yt-dlp 工作逾時 ({timeout:.0f} 秒)')
+            response = self._conn.recv()
+        except (EOFError, OSError) as e:
+            self.stop(kill=True)
+            raise YtdlpServiceError(f'yt-dlp 輔助行程異常結束: {e}') from e
+        finally:
+            self._last_used = time.monotonic()
+
+        self.jobs += 1
+        if not response['ok']:
+            raise YtdlpServiceError(response['error'])
+        return response['result']
+
+    def _start(self) -> None:
+        if self._process is not None:
+            self.stop()
+            self.restarts += 1
+        context = multiprocessing.get_context('spawn')  # web worker 有多個執行緒，不使用 fork
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_helper_main,
+            args=(child_conn, self._defaults(), self.max_instances, self.idle_timeout),
+            name=self.name,
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._process, self._conn = process, parent_conn
+        self.jobs = 0
+        logger.info(f'啟動 yt-dlp 輔助行程 {self.name} (pid={process.pid})')
+
+    def stop(self, kill: bool = False) -> None:
+        """結束行程 (kill=False 時先請行程自行結束，以寫回 cookies)"""
+        process, conn = self._process, self._conn
+        self._process = self._conn = None
+        if process is None:
+            return
+        if not kill and process.is_alive():
+            try:
+                conn.send(None)
+                process.join(5)
+            except (OSError, EOFError):
+                pass
+        if process.is_alive():
+            process.kill()
+            process.join(5)
+        conn.close()
+
+
+class YtdlpService:
+    """
+    yt-dlp 輔助行程池 (執行緒安全)
+
+    - 下載與資訊查詢使用各自的輔助行程 (download / info 兩個池)，
+      長時間的後備下載不會讓 /api/info 的查詢排隊等待
+    - 輔助行程在第一次使用時啟動，閒置 idle_timeout 秒後自行結束，處理 max_jobs 個工作後重啟
+    - 優先分派給最近使用過的行程，重用其中已初始化的 YoutubeDL
+    - 下載池的行程皆忙碌時，呼叫端等待空出的行程 (最多 timeout 秒)；
+      資訊查詢最多等待 info_acquire_timeout 秒，之後改在呼叫端的執行緒直接執行
+    - enabled=False、info_helpers=0 (資訊查詢) 或無法建立子行程 (如在 daemon 行程中) 時，
+      於呼叫端的執行緒直接執行，每次建立新的 YoutubeDL
+    """
+
+    def __init__(self, helpers: int = 2, defaults: Optional[Callable[[], Dict[str, Any]]] = None,
+                 timeout: float = 900, max_jobs: int = 100, idle_timeout: float = 600,
+                 max_instances: int = 16, enabled: bool = True, info_helpers: int = 1,
+                 info_timeout: float = 60, info_acquire_timeout: float = 5):
+        self.pool_sizes = {'download': max(1, helpers), 'info': max(0, info_helpers)}
+        self.defaults = defaults or dict
+        self.timeout = timeout
+        self.info_timeout = info_timeout
+        self.info_acquire_timeout = info_acquire_timeout
+        self.max_jobs = max_jobs
+        self.idle_timeout = idle_timeout
+        self.max_instances = max_instances
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        # 池名稱 -> (輔助行程, 閒置的輔助行程)；
+        # 閒置佇列後進先出：優先使用剛用過 (已初始化) 的行程，多餘的行程閒置逾時後自行結束
+        self._pools: Dict[str, Tuple[List[YtdlpHelper], 'queue.LifoQueue[YtdlpHelper]']] = {}
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+
+    def extract_info(self, url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        取得影片資訊 (不下載)
+
+        Returns:
+            dict: yt-dlp 影片資訊 (已移除縮圖列表、字幕等大型欄位)
+        """
+        timeout = self.info_timeout if timeout is None else timeout
+        request = {'op': 'extract', 'profile': 'info', 'url': url, 'params': {}}
+        return self._call('info', request, timeout, self.info_acquire_timeout)['info']
+
+    def download(self, url: str, profile: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        """
+        下載影片或音訊
+
+        Args:
+            url: 影片網址
+            profile: 'audio' 或 'video'
+            timeout: 等待秒數上限 (預設為服務的 timeout)
+            **params: 設定檔參數
+
+        Returns:
+            dict: info、filename (prepare_filename 結果)、filepath (後處理後的檔案，可能為 None)
+        """
+        if profile not in PROFILES:
+            raise ValueError(f'未知的 yt-dlp 設定檔: {profile}')
+        timeout = self.timeout if timeout is None else timeout
+        request = {'op': 'download', 'profile': profile, 'url': url, 'params': params}
+        return self._call('download', request, timeout)
+
+    def _call(self, pool: str, request: Dict[str, Any], timeout: float,
+              acquire_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        交給指定池的輔助行程執行
+
+        Args:
+            pool: 'download' 或 'info'
+            request: ProfileRunner.run() 的參數
+            timeout: 等待行程與執行工作的總秒數上限
+            acquire_timeout: 等待空出行程的秒數上限，逾時後在目前執行緒執行 (None 時逾時即失敗)
+        """
+        entry = self._pool(pool)
+        if entry is None:
+            return self._run_inline(request)
+
+        _, idle = entry
+        deadline = time.monotonic() + timeout
+        try:
+            helper = idle.get(timeout=timeout if acquire_timeout is None else min(acquire_timeout, timeout))
+        except queue.Empty:
+            if acquire_timeout is None:
+                raise YtdlpServiceError('yt-dlp 輔助行程皆忙碌中') from None
+            logger.warning(f'yt-dlp {pool} 輔助行程皆忙碌中，改在目前執行緒執行')
+            return self._run_inline(request)
+        try:
+            result = helper.call(request, max(1.0, deadline - time.monotonic()))
+            self.completed += 1
+            return result
+        except YtdlpServiceError:
+            self.failed += 1
+            raise
+        finally:
+            idle.put(helper)
+
+    def _run_inline(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.inline += 1
+        runner = ProfileRunner(self.defaults(), reuse=False)
+        return runner.run(**request)
+
+    def _pool(self, name: str) -> Optional[Tuple[List[YtdlpHelper], 'queue.LifoQueue[YtdlpHelper]']]:
+        """
+        返回此行程的輔助行程池 (fork 後的子行程重新建立)
+
+        Returns:
+            tuple | None: (輔助行程, 閒置佇列)；應在目前執行緒直接執行時返回 None
+        """
+        if not self.enabled or not self.pool_sizes[name] or multiprocessing.current_process().daemon:
+            return None
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pools = {
+                        pool: self._build_pool(pool, size)
+                        for pool, size in self.pool_sizes.items() if size
+                    }
+                    self._pid = os.getpid()
+        return self._pools[name]
+
+    def _build_pool(self, name: str, size: int) -> Tuple[List[YtdlpHelper], 'queue.LifoQueue[YtdlpHelper]']:
+        helpers = [
+            YtdlpHelper(f'ytdlp-{name}-{index}', self.defaults, self.max_instances, self.idle_timeout, self.max_jobs)
+            for index in range(size)
+        ]
+        idle: 'queue.LifoQueue[YtdlpHelper]' = queue.LifoQueue()
+        for helper in helpers:
+            idle.put(helper)
+        return helpers, idle
+
+    def close(self) -> None:
+        """結束此行程的所有輔助行程"""
+        with self._lock:
+            if self._pid == os.getpid():
+                for helpers, _ in self._pools.values():
+                    for helper in helpers:
+                        helper.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回服務統計資訊"""
+        pools = self._pools if self._pid == os.getpid() else {}
+        return {
+            'enabled': self.enabled,
+            'pools': {
+                name: {
+                    'helpers': size,
+                    'alive': sum(1 for helper in pools[name][0] if helper.alive) if name in pools else 0,
+                    'idle': pools[name][1].qsize() if name in pools else 0,
+                    'restarts': sum(helper.restarts for helper in pools[name][0]) if name in pools else 0,
+                }
+                for name, size in self.pool_sizes.items()
+            },
+            'completed': self.completed,
+            'failed': self.failed,
+            'inline': self.inline,
+        }
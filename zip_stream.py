@@ -0,0 +1,144 @@
+"""
+串流 ZIP 打包模組
+以不壓縮 (stored) 的項目即時產生 ZIP，邊讀取既有檔案邊輸出，不產生暫存壓縮檔
+"""
+import io
+import os
+import time
+import zipfile
+import logging
+from typing import Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每次讀取來源檔案的大小 (同時也是單次輸出的資料量上限)
+CHUNK_SIZE = 256 * 1024
+
+
+class _StreamWriter(io.RawIOBase):
+    """
+    不可 seek 的寫入端，暫存 zipfile 寫入的資料直到被取出
+
+    zipfile 偵測到無法 seek 時會改用資料描述區 (data descriptor) 記錄 CRC 與大小，
+    因此不需要回頭修改本機檔頭
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        """取出目前暫存的資料"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_names(names: Iterable[str]) -> List[str]:
+    """
+    確保壓縮檔內的檔名不重複 ('a.mp3' 重複時改為 'a (2).mp3')
+
+    Args:
+        names: 原始檔名
+
+    Returns:
+        list: 不重複的檔名 (順序不變)
+    """
+    seen = set()
+    result = []
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, counter = name, 2
+        while candidate.lower() in seen:
+            candidate = f'{base} ({counter}){ext}'
+            counter += 1
+        seen.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+
+def iter_zip(entries: Iterable[Tuple[str, str]], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    逐段產生 ZIP 內容 (不壓縮)
+
+    記憶體用量與檔案大小無關：每次只讀取 chunk_size 並立即輸出；
+    超過 4GB 的檔案自動使用 ZIP64。
+
+    Args:
+        entries: (壓縮檔內名稱, 檔案路徑) 列表
+        chunk_size: 每次讀取的位元組數
+
+    Yields:
+        bytes: ZIP 資料片段
+    """
+    writer = _StreamWriter()
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, path in entries:
+            stat = os.stat(path)
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = stat.st_size  # 讓 zipfile 預先決定是否需要 ZIP64
+
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                while True:
+                    block = source.read(chunk_size)
+                    if not block:
+                        break
+                    target.write(block)
+                    yield writer.drain()
+
+            tail = writer.drain()  # 資料描述區
+            if tail:
+                yield tail
+
+    # 中央目錄與結尾記錄
+    tail = writer.drain()
+    if tail:
+        yield tail
+
+
+if __name__ == '__main__':
+    # 自我檢查: python zip_stream.py [MB]
+    import sys
+    import hashlib
+    import tempfile
+
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for index, size in enumerate((size_mb * 1024 * 1024, 12345, 0)):
+            path = os.path.join(tmp, f'file{index}.mp3')
+            with open(path, 'wb') as fh:
+                remaining = size
+                while remaining:
+                    block = os.urandom(min(remaining, 1024 * 1024))
+                    fh.write(block)
+                    remaining -= len(block)
+            paths.append(path)
+
+        names = unique_names(['音樂.mp3', '音樂.mp3', 'empty.mp3'])
+        output = os.path.join(tmp, 'out.zip')
+        largest = total = 0
+        start = time.perf_counter()
+        with open(output, 'wb') as fh:
+            for chunk in iter_zip(zip(names, paths)):
+                largest = max(largest, len(chunk))
+                total += len(chunk)
+                fh.write(chunk)
+        elapsed = time.perf_counter() - start
+
+        with zipfile.ZipFile(output) as archive:
+            assert archive.testzip() is None
+            for name, path in zip(names, paths):
+                with open(path, 'rb') as fh:
+                    expected = hashlib.sha256(fh.read()).hexdigest()
+                assert hashlib.sha256(archive.read(name)).hexdigest() == expected, name
+            print(f'✅ {archive.namelist()} 驗證通過')
+        print(f'📦 {total / 1024 / 1024:.1f} MB，{elapsed:.2f}s，單次輸出最大 {largest // 1024} KB')